@@ -0,0 +1,2256 @@
+"""
+Almacenamiento del inventario de equipos
+
+Todas las implementaciones ofrecen la misma interfaz, que usa
+ServidorInventario:
+
+- AlmacenamientoMemoria: inventario e índices en memoria, sin persistencia
+- AlmacenamientoJSON: lo anterior más persistencia en un archivo JSON
+  (reescritura completa o journal de cambios), opcionalmente agrupando
+  los cambios en un hilo escritor
+- AlmacenamientoSQLite: base de datos SQLite en modo WAL; no carga el
+  inventario en memoria
+
+Las escrituras (insertar, actualizar, lotes) se llaman con el lock del
+servidor tomado; las lecturas pueden llegar desde cualquier hilo sin lock.
+Después de un cambio, marca_persistencia() identifica la escritura a
+disco que lo incluye y esperar_persistencia(marca) espera, ya fuera del
+lock, a que termine.
+
+Cada cambio recibe un número de versión creciente que se guarda en el
+equipo ('version'); cambios_desde(version) devuelve los equipos que
+cambiaron después.
+
+Los almacenamientos en memoria guardan cada equipo como un registro
+Equipo, que se lee como un diccionario y se convierte en dict recién al
+serializar.
+
+Cada cambio de estado se agrega a un historial que solo crece, indexado
+por código y fecha (historial), y suma la duración del estado que
+termina a la utilización de cada equipo y de cada estado (utilizacion,
+utilizacion_estados), sin recorrer el historial al consultarla.
+"""
+
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from datetime import date
+
+PATRON_PALABRA = re.compile(r'\w+')
+PATRON_FECHA = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\Z')
+CAMPOS_EQUIPO = ('codigo', 'nombre', 'tipo', 'estado', 'fecha_registro',
+                 'ultima_actualizacion', 'version')
+ATRIBUTOS_FECHA = {'fecha_registro': 'registro',
+                   'ultima_actualizacion': 'actualizacion'}
+PESO_NOMBRE = 2  # Una coincidencia en el nombre pesa más que en el tipo
+PESO_TIPO = 1
+MODOS_PERSISTENCIA = ['completo', 'journal']
+# 'sincrona': cada cambio se escribe antes de soltar el lock;
+# 'disco': un hilo agrupa los cambios y la respuesta espera la escritura;
+# 'memoria': igual, pero se responde sin esperar al disco
+MODOS_DURABILIDAD = ['sincrona', 'disco', 'memoria']
+CAPACIDAD_REGISTRO_CAMBIOS = 10000  # Cambios recientes para cambios_desde
+ORDINAL_EPOCA = date(1970, 1, 1).toordinal()
+# Volcado para la carga diferida: cabecera, equipos (largo de la clave,
+# clave y JSON) y al final dos arreglos, las posiciones de inicio de cada
+# equipo y el orden de los equipos por clave. Los enteros van en el orden
+# de bytes de la máquina, que queda anotado en la firma
+FIRMA_VOLCADO = b'INVVOL1' + (b'L' if sys.byteorder == 'little' else b'B')
+# firma, cantidad, versión, tamaño y mtime_ns del JSON de origen, inicio de los arreglos
+CABECERA_VOLCADO = struct.Struct('=8sQQQqQ')
+LARGO_CLAVE = struct.Struct('=H')
+
+
+class CodigoDuplicadoError(Exception):
+    """El código del equipo ya existe en el inventario"""
+
+
+class CursorInvalidoError(ValueError):
+    """El cursor de paginación no corresponde a este almacenamiento"""
+
+
+def normalizar_codigo(codigo):
+    """Devuelve la clave usada en el índice de códigos"""
+    return codigo.upper()
+
+
+def normalizar_tipo(tipo):
+    """Devuelve la clave usada en el índice de tipos"""
+    return tipo.strip().casefold()
+
+
+def extraer_palabras(texto):
+    """Separa un texto en palabras sin tildes y en minúsculas"""
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    sin_tildes = ''.join(
+        c for c in descompuesto if not unicodedata.combining(c))
+    return PATRON_PALABRA.findall(sin_tildes.casefold())
+
+
+def copiar_claves(conjunto, constructor=tuple):
+    """Copia las claves de un índice que un escritor puede estar modificando"""
+    while True:
+        try:
+            return constructor(conjunto)
+        except RuntimeError:
+            pass  # Cambió de tamaño durante la copia; se reintenta
+
+
+@contextmanager
+def medir_persistencia(metricas):
+    """Registra en las métricas, si las hay, la duración del bloque"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metricas is not None:
+            metricas.observar_persistencia(time.perf_counter() - inicio)
+
+
+def como_conjunto(claves):
+    """Vista de conjunto de un grupo de claves (diccionario o set)"""
+    return claves.keys() if isinstance(claves, dict) else claves
+
+
+def fecha_a_entero(fecha):
+    """Convierte 'AAAA-MM-DD HH:MM:SS' en el entero AAAAMMDDHHMMSS
+
+    Otros valores (fechas en otro formato, None) se devuelven tal cual.
+    """
+    if isinstance(fecha, str) and PATRON_FECHA.match(fecha):
+        return int(fecha[0:4] + fecha[5:7] + fecha[8:10]
+                   + fecha[11:13] + fecha[14:16] + fecha[17:19])
+    return fecha
+
+
+def entero_a_fecha(valor):
+    """Inversa de fecha_a_entero"""
+    if not isinstance(valor, int):
+        return valor
+    texto = str(valor).zfill(14)  # Cortar el texto es más rápido que dividir
+    return (f'{texto[:4]}-{texto[4:6]}-{texto[6:8]} '
+            f'{texto[8:10]}:{texto[10:12]}:{texto[12:]}')
+
+
+def clave_fecha(valor):
+    """Clave de orden de una fecha guardada (0 si no tiene el formato estándar)"""
+    return valor if isinstance(valor, int) else 0
+
+
+def limite_fecha(fecha, hora):
+    """Entero de un límite de filtro; a una fecha sin hora se le agrega 'hora'"""
+    return fecha_a_entero(fecha if len(fecha) > 10 else f'{fecha} {hora}')
+
+
+def internar(texto):
+    """Comparte un único objeto para cada texto repetido (tipo, estado)"""
+    return sys.intern(texto) if type(texto) is str else texto
+
+
+def segundos_de_fecha(fecha):
+    """Segundos desde 1970 de una fecha (texto o entero AAAAMMDDHHMMSS), o None
+
+    Las fechas no tienen zona horaria: los segundos solo sirven para
+    ordenar y medir duraciones.
+    """
+    valor = fecha_a_entero(fecha)
+    if not isinstance(valor, int):
+        return None
+    dia, hora = divmod(valor, 1000000)
+    try:
+        dias = date(dia // 10000, dia // 100 % 100, dia % 100).toordinal() - ORDINAL_EPOCA
+    except ValueError:
+        return None
+    return dias * 86400 + hora // 10000 * 3600 + hora // 100 % 100 * 60 + hora % 100
+
+
+def fecha_de_segundos(segundos):
+    """Inversa de segundos_de_fecha, como 'AAAA-MM-DD HH:MM:SS'"""
+    dias, resto = divmod(segundos, 86400)
+    dia = date.fromordinal(dias + ORDINAL_EPOCA)
+    return f'{dia.isoformat()} {resto // 3600:02d}:{resto // 60 % 60:02d}:{resto % 60:02d}'
+
+
+def segundos_ahora():
+    """Segundos de la hora local actual, en la escala de segundos_de_fecha"""
+    return segundos_de_fecha(time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def leer_cursor_historial(cursor):
+    """Convierte el cursor 'segundos:versión' del historial en una tupla"""
+    try:
+        segundos, version = str(cursor).split(':')
+        return int(segundos), int(version)
+    except (TypeError, ValueError):
+        raise CursorInvalidoError("Cursor inválido")
+
+
+def tiempo_por_estado(transiciones, estado_actual, inicio, fin):
+    """Segundos que pasó un equipo en cada estado entre inicio y fin (excluido)
+
+    'transiciones' son (segundos, anterior, nuevo) del equipo en orden,
+    desde la primera en 'inicio' o después: el estado en 'inicio' es el
+    anterior de esa transición, o el actual si no hay ninguna. Sin
+    'inicio' se cuenta desde la primera transición.
+    """
+    segundos = {}
+    estado = None
+    momento = inicio
+    for instante, anterior, nuevo in transiciones:
+        if estado is None:
+            estado = anterior
+            if momento is None:
+                momento = instante
+        if instante >= fin:
+            break
+        if instante > momento:
+            segundos[estado] = segundos.get(estado, 0) + instante - momento
+            momento = instante
+        estado = nuevo
+    if estado is None:
+        estado = estado_actual
+    if momento is not None and fin > momento:
+        segundos[estado] = segundos.get(estado, 0) + fin - momento
+    return segundos
+
+
+def agregar_en_orden(lista, elemento):
+    """Agrega al final de una lista ordenada, o en su lugar si llega atrasado"""
+    if lista and elemento < lista[-1]:
+        bisect.insort(lista, elemento)
+    else:
+        lista.append(elemento)
+
+
+class Equipo(Mapping):
+    """Equipo guardado en memoria: un registro con __slots__ en lugar de un dict
+
+    Sin diccionario por instancia, con 'tipo' y 'estado' internados y las
+    fechas como enteros ocupa mucho menos. Se lee como un diccionario de
+    solo lectura (equipo['estado'], dict(equipo)) y a_dict() lo convierte
+    para serializarlo. Como los diccionarios publicados, nunca se modifica.
+    """
+
+    __slots__ = ('codigo', 'nombre', 'tipo', 'estado', 'registro',
+                 'actualizacion', 'version', 'otros')
+
+    def __init__(self, codigo, nombre, tipo, estado, registro=None,
+                 actualizacion=None, version=0, otros=None):
+        self.codigo = codigo
+        self.nombre = nombre
+        self.tipo = internar(tipo)
+        self.estado = internar(estado)
+        self.registro = fecha_a_entero(registro)
+        self.actualizacion = fecha_a_entero(actualizacion)
+        self.version = version
+        self.otros = otros  # Campos adicionales, poco frecuentes
+
+    @classmethod
+    def desde_dict(cls, datos, codigo=None, version=None):
+        """Crea el registro a partir de un diccionario (o de otro Equipo)
+
+        'codigo' permite compartir el texto ya normalizado de los índices.
+        """
+        if isinstance(datos, Equipo):
+            return datos if version is None else datos.reemplazar(version=version)
+        otros = {campo: valor for campo, valor in datos.items()
+                 if campo not in CAMPOS_EQUIPO} or None
+        return cls(codigo if codigo is not None else datos['codigo'],
+                   datos['nombre'], datos['tipo'], datos['estado'],
+                   datos.get('fecha_registro'),
+                   datos.get('ultima_actualizacion'),
+                   datos.get('version', 0) if version is None else version,
+                   otros)
+
+    def reemplazar(self, **cambios):
+        """Copia del registro con algunos campos cambiados, sin pasar por un dict"""
+        nuevo = Equipo.__new__(Equipo)
+        for atributo in Equipo.__slots__:
+            setattr(nuevo, atributo, getattr(self, atributo))
+        for campo, valor in cambios.items():
+            if campo in ('fecha_registro', 'ultima_actualizacion'):
+                setattr(nuevo, ATRIBUTOS_FECHA[campo], fecha_a_entero(valor))
+            elif campo in ('tipo', 'estado'):
+                setattr(nuevo, campo, internar(valor))
+            elif campo in ('codigo', 'nombre', 'version'):
+                setattr(nuevo, campo, valor)
+            else:
+                nuevo.otros = dict(nuevo.otros or {}, **{campo: valor})
+        return nuevo
+
+    def a_dict(self):
+        """Devuelve el equipo como diccionario, con los campos en el orden habitual"""
+        datos = {'codigo': self.codigo, 'nombre': self.nombre,
+                 'tipo': self.tipo, 'estado': self.estado}
+        if self.registro is not None:
+            datos['fecha_registro'] = entero_a_fecha(self.registro)
+        if self.actualizacion is not None:
+            datos['ultima_actualizacion'] = entero_a_fecha(self.actualizacion)
+        datos['version'] = self.version
+        if self.otros:
+            datos.update(self.otros)
+        return datos
+
+    def __getitem__(self, campo):
+        if campo in ('codigo', 'nombre', 'tipo', 'estado', 'version'):
+            return getattr(self, campo)
+        if campo == 'fecha_registro' and self.registro is not None:
+            return entero_a_fecha(self.registro)
+        if campo == 'ultima_actualizacion' and self.actualizacion is not None:
+            return entero_a_fecha(self.actualizacion)
+        if self.otros and campo in self.otros:
+            return self.otros[campo]
+        raise KeyError(campo)
+
+    def __iter__(self):
+        return iter(self.a_dict())
+
+    def __len__(self):
+        return len(self.a_dict())
+
+    def __repr__(self):
+        return f'Equipo({self.a_dict()!r})'
+
+
+def con_cambios(equipo, **cambios):
+    """Copia de un equipo (registro Equipo o dict) con algunos campos cambiados"""
+    if isinstance(equipo, Equipo):
+        return equipo.reemplazar(**cambios)
+    return dict(equipo, **cambios)
+
+
+def escribir_volcado(archivo, inventario, origen):
+    """Escribe el volcado de un inventario de registros Equipo
+
+    'origen' es el os.stat del archivo JSON del que el volcado es copia;
+    si ese archivo cambia, el volcado deja de usarse.
+    """
+    inicios = array('Q')
+    claves = []
+    version = 0
+    archivo_temporal = archivo + '.tmp'
+    with open(archivo_temporal, 'wb') as f:
+        f.write(bytes(CABECERA_VOLCADO.size))
+        posicion = CABECERA_VOLCADO.size
+        for equipo in inventario:
+            clave = normalizar_codigo(equipo.codigo).encode('utf-8')
+            datos = json.dumps(equipo.a_dict(), ensure_ascii=False,
+                               separators=(',', ':')).encode('utf-8')
+            inicios.append(posicion)
+            claves.append(clave)
+            version = max(version, equipo.version)
+            f.write(LARGO_CLAVE.pack(len(clave)))
+            f.write(clave)
+            f.write(datos)
+            posicion += LARGO_CLAVE.size + len(clave) + len(datos)
+        # El orden de los bytes UTF-8 coincide con el de los textos
+        orden = array('I', sorted(range(len(claves)), key=claves.__getitem__))
+        f.write(inicios.tobytes())
+        f.write(orden.tobytes())
+        f.seek(0)
+        f.write(CABECERA_VOLCADO.pack(FIRMA_VOLCADO, len(inicios), version,
+                                      origen.st_size, origen.st_mtime_ns, posicion))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(archivo_temporal, archivo)
+
+
+class VolcadoMapeado:
+    """Volcado abierto con mmap: cada equipo se decodifica recién al pedirlo"""
+
+    def __init__(self, archivo):
+        with open(archivo, 'rb') as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (firma, self.cantidad, self.version, tamano, mtime,
+             self._fin_datos) = CABECERA_VOLCADO.unpack_from(self._mapa)
+            if firma != FIRMA_VOLCADO:
+                raise ValueError("Firma de volcado inválida")
+            self.origen = (tamano, mtime)
+            vista = memoryview(self._mapa)
+            fin_inicios = self._fin_datos + 8 * self.cantidad
+            self._inicios = vista[self._fin_datos:fin_inicios].cast('Q')
+            self._orden = vista[fin_inicios:fin_inicios + 4 * self.cantidad].cast('I')
+            vista.release()
+        except Exception:
+            self._mapa.close()
+            raise
+
+    @classmethod
+    def abrir(cls, archivo, archivo_origen):
+        """Abre el volcado si existe y corresponde al archivo de origen actual"""
+        try:
+            origen = os.stat(archivo_origen)
+            volcado = cls(archivo)
+        except (OSError, ValueError, struct.error) as e:
+            logging.info(f"Volcado no disponible ({e}); se carga el JSON")
+            return None
+        if volcado.origen != (origen.st_size, origen.st_mtime_ns):
+            logging.info("El volcado es anterior al JSON; se carga el JSON")
+            volcado.cerrar()
+            return None
+        return volcado
+
+    def __len__(self):
+        return self.cantidad
+
+    def limites(self, posicion):
+        """Devuelve (inicio, fin) del equipo en esa posición"""
+        inicio = self._inicios[posicion]
+        fin = (self._inicios[posicion + 1] if posicion + 1 < self.cantidad
+               else self._fin_datos)
+        return inicio, fin
+
+    def clave(self, posicion):
+        """Clave (código normalizado, en bytes) del equipo en esa posición"""
+        inicio = self._inicios[posicion]
+        (largo,) = LARGO_CLAVE.unpack_from(self._mapa, inicio)
+        inicio += LARGO_CLAVE.size
+        return self._mapa[inicio:inicio + largo]
+
+    def equipo(self, posicion):
+        """Decodifica el equipo en esa posición"""
+        inicio, fin = self.limites(posicion)
+        (largo,) = LARGO_CLAVE.unpack_from(self._mapa, inicio)
+        inicio += LARGO_CLAVE.size
+        clave = self._mapa[inicio:inicio + largo].decode('utf-8')
+        datos = json.loads(self._mapa[inicio + largo:fin])
+        if datos['codigo'] == clave:
+            return Equipo.desde_dict(datos, clave)
+        return Equipo.desde_dict(datos)
+
+    def posicion(self, clave):
+        """Posición del equipo con esa clave, por búsqueda binaria, o None"""
+        buscada = clave.encode('utf-8')
+        bajo, alto = 0, self.cantidad
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self.clave(self._orden[medio]) < buscada:
+                bajo = medio + 1
+            else:
+                alto = medio
+        if bajo < self.cantidad and self.clave(self._orden[bajo]) == buscada:
+            return self._orden[bajo]
+        return None
+
+    def cerrar(self):
+        """Libera el mapeo del archivo"""
+        self._inicios.release()
+        self._orden.release()
+        self._mapa.close()
+
+
+class InventarioDiferido(Sequence):
+    """Inventario leído del volcado mientras se arma el de memoria
+
+    Los cambios del journal posteriores al volcado se superponen: un
+    equipo cambiado se toma de 'superpuestos' y los registrados después
+    del volcado quedan al final, en 'nuevos'.
+    """
+
+    def __init__(self, volcado, superpuestos, nuevos):
+        self.volcado = volcado
+        self.superpuestos = superpuestos  # clave -> Equipo
+        self.nuevos = nuevos  # Claves registradas después del volcado
+
+    def __len__(self):
+        return len(self.volcado) + len(self.nuevos)
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return [self[i] for i in range(*posicion.indices(len(self)))]
+        if posicion < 0:
+            posicion += len(self)
+        if posicion >= len(self.volcado):
+            return self.superpuestos[self.nuevos[posicion - len(self.volcado)]]
+        if self.superpuestos:
+            equipo = self.superpuestos.get(self.volcado.clave(posicion).decode('utf-8'))
+            if equipo is not None:
+                return equipo
+        return self.volcado.equipo(posicion)
+
+    def __iter__(self):
+        for posicion in range(len(self)):
+            yield self[posicion]
+
+    def obtener(self, clave):
+        """Equipo con esa clave (código normalizado), o None"""
+        equipo = self.superpuestos.get(clave)
+        if equipo is None:
+            posicion = self.volcado.posicion(clave)
+            if posicion is not None:
+                equipo = self.volcado.equipo(posicion)
+        return equipo
+
+
+class HistorialEstados:
+    """Transiciones de estado de los equipos y tiempo acumulado en cada estado
+
+    Las transiciones (segundos, versión, código, anterior, nuevo) se
+    guardan en orden de fecha en una lista general y en una por equipo,
+    así un rango de fechas se encuentra con bisect. Cada transición suma
+    la duración del estado que termina al acumulado del equipo y a los
+    totales por estado: la utilización se responde sin recorrer el
+    historial. Solo se agregan transiciones, con el lock del servidor.
+    """
+
+    def __init__(self):
+        self.transiciones = []
+        self.por_codigo = {}  # código normalizado -> sus transiciones
+        self.acumulado = {}  # código -> {estado: segundos de estados ya dejados}
+        self.desde = {}  # código -> segundos de su último cambio de estado
+        self.version = 0  # Versión de la última transición registrada
+        # estado -> (segundos ya cerrados, equipos en el estado, suma de
+        # los inicios de su estado actual); None mientras se carga
+        self.totales = {}
+
+    def registrar(self, clave, fecha, anterior, nuevo, version, registro):
+        """Agrega una transición; 'registro' es la fecha de alta del equipo
+
+        Se ignoran las versiones ya registradas: al cargar, el journal
+        repite transiciones que ya están en el historial. Devuelve si la
+        transición era nueva.
+        """
+        if version <= self.version:
+            return False
+        self.version = version
+        segundos = segundos_de_fecha(fecha)
+        if segundos is None:
+            segundos = segundos_ahora()
+        transicion = (segundos, version, clave, anterior, nuevo)
+        agregar_en_orden(self.transiciones, transicion)
+        agregar_en_orden(self.por_codigo.setdefault(clave, []), transicion)
+
+        inicio = self.desde.get(clave)
+        if inicio is None:
+            inicio = segundos_de_fecha(registro)
+        duracion = max(segundos - inicio, 0) if inicio is not None else 0
+        acumulado = self.acumulado.setdefault(clave, {})
+        acumulado[anterior] = acumulado.get(anterior, 0) + duracion
+        self.desde[clave] = segundos
+        if self.totales is not None:
+            if inicio is not None:
+                cerrado, equipos, suma = self.totales.get(anterior, (0, 0, 0))
+                self.totales[anterior] = (cerrado + duracion, equipos - 1, suma - inicio)
+            cerrado, equipos, suma = self.totales.get(nuevo, (0, 0, 0))
+            self.totales[nuevo] = (cerrado, equipos + 1, suma + segundos)
+        return True
+
+    def agregar_equipo(self, estado, registro):
+        """Cuenta en los totales un equipo nuevo, en 'estado' desde su alta"""
+        if self.totales is None:
+            return
+        desde = segundos_de_fecha(registro)
+        if desde is None:
+            return  # Sin fecha válida no se puede medir
+        cerrado, equipos, suma = self.totales.get(estado, (0, 0, 0))
+        self.totales[estado] = (cerrado, equipos + 1, suma + desde)
+
+    def iniciar_totales(self, equipos):
+        """Arma los totales por estado al terminar la carga
+
+        'equipos' es el índice {código normalizado: equipo}.
+        """
+        totales = {}
+        for acumulado in self.acumulado.values():
+            for estado, segundos in acumulado.items():
+                cerrado, cantidad, suma = totales.get(estado, (0, 0, 0))
+                totales[estado] = (cerrado + segundos, cantidad, suma)
+        for clave, equipo in equipos.items():
+            desde = self.desde.get(clave)
+            if desde is None:
+                desde = segundos_de_fecha(equipo.registro)
+                if desde is None:
+                    continue
+            cerrado, cantidad, suma = totales.get(equipo.estado, (0, 0, 0))
+            totales[equipo.estado] = (cerrado, cantidad + 1, suma + desde)
+        self.totales = totales
+
+    def buscar(self, clave, desde, hasta, posicion, limite):
+        """Devuelve (transiciones, mas) entre dos fechas en segundos, incluidas
+
+        Sin clave recorre todos los equipos; 'posicion' es el cursor
+        (segundos, versión) de la última transición ya entregada.
+        """
+        lista = self.transiciones if clave is None else self.por_codigo.get(clave, [])
+        inicio = 0 if desde is None else bisect.bisect_left(lista, (desde,))
+        if posicion is not None:
+            inicio = max(inicio, bisect.bisect_left(
+                lista, (posicion[0], posicion[1] + 1)))
+        fin = len(lista) if hasta is None else bisect.bisect_left(lista, (hasta + 1,))
+        seleccion = lista[inicio:min(fin, inicio + limite + 1)]
+        return seleccion[:limite], len(seleccion) > limite
+
+    def utilizacion(self, clave, equipo, desde, hasta, ahora):
+        """Segundos de un equipo en cada estado; sin rango, desde su alta"""
+        registro = segundos_de_fecha(equipo.registro)
+        if desde is None and hasta is None:
+            segundos = copiar_claves(self.acumulado.get(clave, {}), dict)
+            inicio = self.desde.get(clave, registro)
+            if inicio is not None and ahora > inicio:
+                segundos[equipo.estado] = segundos.get(equipo.estado, 0) + ahora - inicio
+            return segundos
+
+        if registro is not None:
+            desde = registro if desde is None else max(desde, registro)
+        fin = ahora if hasta is None else min(hasta + 1, ahora)
+        lista = self.por_codigo.get(clave, [])
+        primera = 0 if desde is None else bisect.bisect_left(lista, (desde,))
+        return tiempo_por_estado(
+            ((segundos, anterior, nuevo)
+             for segundos, _, _, anterior, nuevo in lista[primera:]),
+            equipo.estado, desde, fin)
+
+    def utilizacion_estados(self, ahora):
+        """{estado: (segundos, equipos)} sumando todos los equipos hasta 'ahora'"""
+        return {estado: (cerrado + equipos * ahora - suma, equipos)
+                for estado, (cerrado, equipos, suma)
+                in copiar_claves(self.totales.items(), list)}
+
+
+class AlmacenamientoMemoria:
+    """Inventario en memoria con índices por código, estado, tipo, fecha y texto"""
+
+    def __init__(self, capacidad_cambios=CAPACIDAD_REGISTRO_CAMBIOS):
+        # Los equipos publicados (registros Equipo) nunca se modifican: un
+        # cambio reemplaza el registro completo, así las lecturas no
+        # necesitan el lock
+        self.inventario = []
+        self.indice_codigos = {}  # código normalizado -> equipo
+        self.posiciones = {}  # código normalizado -> posición en el inventario
+        # Índices secundarios para filtrar; los diccionarios se usan como
+        # conjuntos ordenados de códigos
+        self.indice_estado = {}  # estado -> {código: None}
+        self.indice_tipo = {}  # tipo normalizado -> {código: None}
+        self.indice_fechas = []  # (clave_fecha(registro), código) ordenado
+        self.indice_texto = {}  # palabra -> {peso: {código: None}}
+        self.palabras_ordenadas = []  # Palabras del índice, para buscar prefijos
+        self.version = 0  # Versión del último cambio del inventario
+        self._instantanea = (-1, ())  # (versión, tupla de equipos)
+        # Cambios recientes (versión, código) en orden; las versiones
+        # anteriores a _piso_registro ya no están y se buscan recorriendo
+        # el inventario
+        self.registro_cambios = collections.deque(maxlen=capacidad_cambios)
+        self._piso_registro = 0
+        self.historial_estados = HistorialEstados()
+        self.metricas = None  # Metricas del servidor, si las asigna
+
+    def descripcion(self):
+        """Texto corto para mostrar al iniciar el servidor"""
+        return "memoria (sin persistencia)"
+
+    def cargar(self):
+        """Carga el inventario persistido (nada que hacer en memoria)"""
+
+    def cerrar(self):
+        """Libera los recursos del almacenamiento"""
+
+    def esperar_carga(self, timeout=None):
+        """Espera a que el inventario termine de cargarse (False si no alcanzó)"""
+        return True
+
+    def marca_persistencia(self):
+        """Marca del último cambio a esperar (0: nada que esperar)"""
+        return 0
+
+    def esperar_persistencia(self, marca, timeout=None):
+        """Espera a que los cambios hasta 'marca' estén en disco"""
+        return True
+
+    # --- Índices ---
+
+    def reconstruir_indice(self):
+        """Reconstruye los índices a partir del inventario"""
+        self.indice_codigos = {}
+        self.posiciones = {}
+        inventario = []
+        for posicion, equipo in enumerate(self.inventario):
+            clave = normalizar_codigo(equipo['codigo'])
+            if equipo['codigo'] == clave:
+                equipo = Equipo.desde_dict(equipo, clave)
+            else:
+                equipo = Equipo.desde_dict(equipo)
+            inventario.append(equipo)
+            self.indice_codigos[clave] = equipo
+            self.posiciones[clave] = posicion
+        self.inventario = inventario
+
+        self.indice_estado = {}
+        self.indice_tipo = {}
+        self.indice_fechas = []
+        self.indice_texto = {}
+        for clave, equipo in self.indice_codigos.items():
+            self.indexar_equipo(clave, equipo)
+            self.indice_fechas.append((clave_fecha(equipo.registro), clave))
+        self.indice_fechas.sort()
+        self.palabras_ordenadas = sorted(self.indice_texto)
+        self.version = max([self.version] + [
+            equipo.version for equipo in self.inventario])
+        self._instantanea = (-1, ())
+        self.registro_cambios.clear()
+        self._piso_registro = self.version
+
+    def indexar_equipo(self, clave, equipo):
+        """Agrega un equipo a los índices de estado, tipo y texto"""
+        self.indice_estado.setdefault(equipo.estado, {})[clave] = None
+        self.indice_tipo.setdefault(
+            normalizar_tipo(equipo.tipo), {})[clave] = None
+
+        pesos = {}
+        for palabra in extraer_palabras(equipo.nombre):
+            pesos[palabra] = PESO_NOMBRE
+        for palabra in extraer_palabras(equipo.tipo):
+            pesos[palabra] = pesos.get(palabra, 0) + PESO_TIPO
+        nuevas = []
+        for palabra, peso in pesos.items():
+            if palabra not in self.indice_texto:
+                self.indice_texto[palabra] = {}
+                nuevas.append(palabra)
+            self.indice_texto[palabra].setdefault(peso, {})[clave] = None
+        return nuevas
+
+    def agregar_equipo(self, clave, equipo):
+        """Publica un equipo nuevo (requiere tener el lock)"""
+        self.posiciones[clave] = len(self.inventario)
+        self.inventario.append(equipo)
+        self.indice_codigos[clave] = equipo
+        for palabra in self.indexar_equipo(clave, equipo):
+            bisect.insort(self.palabras_ordenadas, palabra)
+        bisect.insort(self.indice_fechas,
+                      (clave_fecha(equipo.registro), clave))
+        self.historial_estados.agregar_equipo(equipo.estado, equipo.registro)
+        self.anotar_cambio(clave, equipo)
+
+    def reemplazar_equipo(self, clave, equipo):
+        """Publica una nueva versión de un equipo (requiere tener el lock)"""
+        anterior = self.indice_codigos[clave]
+        self.inventario[self.posiciones[clave]] = equipo
+        self.indice_codigos[clave] = equipo
+        if anterior.estado != equipo.estado:
+            self.indice_estado[anterior.estado].pop(clave, None)
+            self.indice_estado.setdefault(equipo.estado, {})[clave] = None
+            self.anotar_transicion(clave, anterior, equipo)
+        self.anotar_cambio(clave, equipo)
+
+    def anotar_transicion(self, clave, anterior, equipo):
+        """Agrega un cambio de estado al historial (requiere tener el lock)"""
+        self.historial_estados.registrar(
+            clave, equipo.actualizacion, anterior.estado, equipo.estado,
+            equipo.version, anterior.registro)
+
+    def anotar_cambio(self, clave, equipo):
+        """Avanza la versión y agrega el cambio al registro (requiere tener el lock)"""
+        version = max(self.version + 1, equipo.version)
+        if len(self.registro_cambios) == self.registro_cambios.maxlen:
+            self._piso_registro = self.registro_cambios[0][0]
+        self.registro_cambios.append((version, clave))
+        self.version = version
+
+    def instantanea(self):
+        """Devuelve una tupla inmutable con el inventario, sin bloquear"""
+        # Se lee la versión antes de copiar: si un escritor cambia el
+        # inventario en medio, la copia queda con una versión vieja y la
+        # siguiente lectura la regenera
+        version = self.version
+        instantanea = self._instantanea
+        if instantanea[0] != version:
+            instantanea = (version, tuple(self.inventario))
+            self._instantanea = instantanea
+        return instantanea[1]
+
+    # --- Escritura ---
+
+    def insertar(self, equipo):
+        """Agrega un equipo nuevo al inventario y lo devuelve con su versión"""
+        clave = normalizar_codigo(equipo['codigo'])
+        if clave in self.indice_codigos:
+            raise CodigoDuplicadoError(clave)
+        equipo = Equipo.desde_dict(equipo, clave, self.version + 1)
+        self.agregar_equipo(clave, equipo)
+        return equipo
+
+    def actualizar(self, equipo):
+        """Reemplaza un equipo existente y lo devuelve con su nueva versión"""
+        clave = normalizar_codigo(equipo['codigo'])
+        equipo = Equipo.desde_dict(
+            equipo, self.indice_codigos[clave].codigo, self.version + 1)
+        self.reemplazar_equipo(clave, equipo)
+        return equipo
+
+    def iniciar_lote(self):
+        """Difiere la persistencia hasta terminar_lote"""
+
+    def terminar_lote(self):
+        """Persiste de una vez los cambios del lote"""
+
+    # --- Lectura ---
+
+    def obtener(self, codigo):
+        """Devuelve el equipo con ese código, o None"""
+        return self.indice_codigos.get(normalizar_codigo(codigo))
+
+    def total(self):
+        """Cantidad de equipos en el inventario"""
+        return len(self.inventario)
+
+    def version_actual(self):
+        """Versión del último cambio"""
+        return self.version
+
+    def cambios_desde(self, version, limite):
+        """Devuelve (equipos, hasta, mas): los equipos cambiados después de 'version'
+
+        Los equipos van ordenados por versión. 'hasta' es la versión a
+        pedir la próxima vez y 'mas' indica si quedaron cambios por el límite.
+        """
+        actual = self.version
+        equipos = None
+        if version >= self._piso_registro:
+            registro = copiar_claves(self.registro_cambios, list)
+            # Si el registro descartó cambios mientras se copiaba, no alcanza
+            if version >= self._piso_registro:
+                claves = dict.fromkeys(
+                    clave for version_cambio, clave in registro
+                    if version_cambio > version)
+                equipos = [self.indice_codigos[clave] for clave in claves]
+        if equipos is None:
+            equipos = [equipo for equipo in self.instantanea()
+                       if equipo.version > version]
+        equipos.sort(key=lambda equipo: equipo.version)
+        if len(equipos) > limite:
+            equipos = equipos[:limite]
+            return equipos, equipos[-1].version, True
+        return equipos, actual, False
+
+    def estado_anterior(self, codigo, version):
+        """Estado de un equipo antes de su primer cambio de estado posterior a 'version'
+
+        None si no cambió de estado desde entonces.
+        """
+        posteriores = [
+            transicion for transicion
+            in self.historial_estados.por_codigo.get(normalizar_codigo(codigo), ())
+            if transicion[1] > version]
+        if not posteriores:
+            return None
+        return min(posteriores, key=lambda transicion: transicion[1])[3]
+
+    def historial(self, codigo=None, desde=None, hasta=None, cursor=None, limite=100):
+        """Devuelve (transiciones, siguiente_cursor): cambios de estado en orden de fecha
+
+        'desde' y 'hasta' son segundos (segundos_de_fecha), incluidos; sin
+        código incluye todos los equipos. El cursor identifica la última
+        transición entregada.
+        """
+        posicion = None if cursor is None else leer_cursor_historial(cursor)
+        clave = None if codigo is None else normalizar_codigo(codigo)
+        seleccion, mas = self.historial_estados.buscar(
+            clave, desde, hasta, posicion, limite)
+        transiciones = []
+        for segundos, version, clave, anterior, nuevo in seleccion:
+            equipo = self.indice_codigos.get(clave)
+            transiciones.append({
+                'codigo': equipo.codigo if equipo is not None else clave,
+                'fecha': fecha_de_segundos(segundos),
+                'estado_anterior': anterior,
+                'estado': nuevo,
+                'version': version
+            })
+        siguiente = f'{seleccion[-1][0]}:{seleccion[-1][1]}' if mas else None
+        return transiciones, siguiente
+
+    def utilizacion(self, codigo, desde=None, hasta=None, ahora=None):
+        """Segundos que pasó un equipo en cada estado, o None si no existe
+
+        Sin rango cuenta desde su alta hasta 'ahora' (por defecto, la
+        hora actual).
+        """
+        clave = normalizar_codigo(codigo)
+        equipo = self.indice_codigos.get(clave)
+        if equipo is None:
+            return None
+        return self.historial_estados.utilizacion(
+            clave, equipo, desde, hasta, segundos_ahora() if ahora is None else ahora)
+
+    def utilizacion_estados(self, ahora=None):
+        """{estado: (segundos, equipos)}: tiempo de todos los equipos en cada estado"""
+        return self.historial_estados.utilizacion_estados(
+            segundos_ahora() if ahora is None else ahora)
+
+    def pagina(self, cursor, limite):
+        """Devuelve (equipos, siguiente_cursor, total) a partir del cursor
+
+        El cursor es la posición del siguiente equipo; como el inventario
+        solo crece, sigue siendo válido entre páginas.
+        """
+        equipos = self.instantanea()
+        inicio = 0
+        if cursor is not None:
+            try:
+                inicio = int(cursor)
+            except (TypeError, ValueError):
+                raise CursorInvalidoError("Cursor inválido")
+            if inicio < 0 or inicio > len(equipos):
+                raise CursorInvalidoError("Cursor inválido")
+
+        fin = min(inicio + limite, len(equipos))
+        siguiente = str(fin) if fin < len(equipos) else None
+        return list(equipos[inicio:fin]), siguiente, len(equipos)
+
+    def bloques(self, tamano):
+        """Genera (total, equipos) en bloques sobre una misma instantánea"""
+        equipos = self.instantanea()
+        total = len(equipos)
+        for inicio in range(0, max(total, 1), tamano):
+            yield total, list(equipos[inicio:inicio + tamano])
+
+    def filtrar(self, estado=None, tipo=None, fecha_desde=None,
+                fecha_hasta=None, inicio=0, limite=None):
+        """Devuelve (total, equipos) que cumplen todos los filtros
+
+        Recibe el estado en minúsculas y el tipo normalizado. Una fecha
+        sin hora en fecha_hasta incluye todo ese día.
+        """
+        # Partir del índice con menos candidatos y verificar el resto de
+        # filtros sobre cada equipo
+        candidatos = []
+        if estado is not None:
+            candidatos.append(copiar_claves(
+                self.indice_estado.get(estado, ())))
+        if tipo is not None:
+            candidatos.append(copiar_claves(self.indice_tipo.get(tipo, ())))
+        if fecha_desde is not None:
+            fecha_desde = limite_fecha(fecha_desde, '00:00:00')
+        if fecha_hasta is not None:
+            fecha_hasta = limite_fecha(fecha_hasta, '23:59:59')
+        if fecha_desde is not None or fecha_hasta is not None:
+            fechas = self.indice_fechas
+            desde = 0 if fecha_desde is None else bisect.bisect_left(
+                fechas, (fecha_desde,))
+            hasta = len(fechas) if fecha_hasta is None else bisect.bisect_left(
+                fechas, (fecha_hasta + 1,))
+            candidatos.append(tuple(clave for _, clave in fechas[desde:hasta]))
+        claves = min(candidatos, key=len) if candidatos else ()
+
+        encontrados = []
+        for clave in claves:
+            equipo = self.indice_codigos.get(clave)
+            if equipo is None:
+                continue
+            if estado is not None and equipo.estado != estado:
+                continue
+            if tipo is not None and normalizar_tipo(equipo.tipo) != tipo:
+                continue
+            fecha = clave_fecha(equipo.registro)
+            if fecha_desde is not None and fecha < fecha_desde:
+                continue
+            if fecha_hasta is not None and fecha > fecha_hasta:
+                continue
+            encontrados.append((self.posiciones.get(clave, 0), equipo))
+
+        # Mismo orden que la consulta general
+        encontrados.sort(key=lambda par: par[0])
+        fin = len(encontrados) if limite is None else inicio + limite
+        return len(encontrados), [equipo for _, equipo in encontrados[inicio:fin]]
+
+    def palabras_con_prefijo(self, prefijo):
+        """Devuelve las palabras del índice que empiezan con el prefijo"""
+        palabras = self.palabras_ordenadas
+        encontradas = set()
+        i = bisect.bisect_left(palabras, prefijo)
+        while True:
+            try:
+                palabra = palabras[i]
+            except IndexError:
+                break
+            if not palabra.startswith(prefijo):
+                break
+            encontradas.add(palabra)
+            i += 1
+        return encontradas
+
+    def primeros_por_posicion(self, claves, cantidad):
+        """Devuelve las primeras claves en el orden del inventario"""
+        if isinstance(claves, dict):
+            # Los índices agregan códigos en orden de registro
+            return copiar_claves(
+                claves, lambda d: list(itertools.islice(d, cantidad)))
+        return heapq.nsmallest(cantidad, claves,
+                               key=self.posiciones.__getitem__)
+
+    def clases_de_palabra(self, buscada):
+        """Agrupa por puntaje los códigos que coinciden con una palabra buscada
+
+        Devuelve {puntaje: claves}; cada código aparece solo en su mejor
+        puntaje. Una coincidencia exacta vale el doble que por prefijo.
+        """
+        fuentes = {}
+        for palabra in self.palabras_con_prefijo(buscada):
+            factor = 2 if palabra == buscada else 1
+            grupos = copiar_claves(self.indice_texto.get(palabra, {}).items())
+            for peso, claves in grupos:
+                fuentes.setdefault(peso * factor, []).append(claves)
+
+        if len(fuentes) == 1 and len(next(iter(fuentes.values()))) == 1:
+            # Caso común: una sola palabra con un solo peso; se conserva el
+            # diccionario, que ya está en orden de inventario
+            return {puntaje: grupos[0] for puntaje, grupos in fuentes.items()}
+
+        clases = {}
+        vistos = set()
+        for puntaje in sorted(fuentes, reverse=True):
+            claves = set()
+            for fuente in fuentes[puntaje]:
+                claves.update(copiar_claves(fuente))
+            claves -= vistos
+            vistos |= claves
+            if claves:
+                clases[puntaje] = claves
+        return clases
+
+    def buscar_texto(self, palabras, limite):
+        """Devuelve (total, equipos) ordenados por relevancia"""
+        # Cada palabra buscada debe coincidir: se intersectan las clases
+        # de puntaje de cada palabra y los puntajes se suman
+        resultado = None
+        for buscada in dict.fromkeys(palabras):
+            clases = self.clases_de_palabra(buscada)
+            if resultado is None:
+                resultado = clases
+                continue
+            combinadas = {}
+            for puntaje1, claves1 in resultado.items():
+                for puntaje2, claves2 in clases.items():
+                    comunes = como_conjunto(claves1) & como_conjunto(claves2)
+                    if comunes:
+                        combinadas.setdefault(
+                            puntaje1 + puntaje2, set()).update(comunes)
+            resultado = combinadas
+            if not resultado:
+                break
+
+        total = sum(len(claves) for claves in resultado.values())
+        equipos = []
+        for puntaje in sorted(resultado, reverse=True):
+            faltan = limite - len(equipos)
+            if faltan <= 0:
+                break
+            for clave in self.primeros_por_posicion(resultado[puntaje], faltan):
+                equipo = self.indice_codigos.get(clave)
+                if equipo is not None:
+                    equipos.append(equipo)
+        return total, equipos
+
+
+class AlmacenamientoJSON(AlmacenamientoMemoria):
+    """Inventario en memoria persistido en un archivo JSON"""
+
+    def __init__(self, archivo_datos='inventario.json',
+                 modo_persistencia='completo', compactar_cada=1000,
+                 durabilidad='sincrona', ventana_ms=0, agrupar_cada=100,
+                 capacidad_cambios=CAPACIDAD_REGISTRO_CAMBIOS,
+                 carga_diferida=False):
+        if modo_persistencia not in MODOS_PERSISTENCIA:
+            raise ValueError(
+                f"Modo de persistencia inválido. Debe ser uno de: {', '.join(MODOS_PERSISTENCIA)}")
+        if durabilidad not in MODOS_DURABILIDAD:
+            raise ValueError(
+                f"Durabilidad inválida. Debe ser una de: {', '.join(MODOS_DURABILIDAD)}")
+
+        super().__init__(capacidad_cambios)
+        self.archivo_datos = archivo_datos
+        # En modo 'journal' cada cambio se agrega a este archivo y el
+        # inventario completo solo se reescribe al compactar
+        self.modo_persistencia = modo_persistencia
+        self.archivo_journal = archivo_datos + '.journal'
+        self.compactar_cada = compactar_cada
+        self.cambios_en_journal = 0
+        self._journal = None
+        self._cambios_lote = None  # Cambios diferidos mientras corre un lote
+        # Historial de estados: solo se agrega, una línea por transición
+        self.archivo_historial = archivo_datos + '.historial'
+        # Transiciones que no se pudieron confirmar sin el inventario
+        self.archivo_historial_apartado = self.archivo_historial + '.apartado'
+        self._historial = None
+        self._transiciones_journal = None  # Reproducidas del journal al cargar
+        # Escritura agrupada: el hilo escritor junta los cambios que llegan
+        # durante 'ventana_ms' (o hasta 'agrupar_cada') en una sola escritura
+        self.durabilidad = durabilidad
+        self.ventana = ventana_ms / 1000
+        self.agrupar_cada = agrupar_cada
+        self._condicion = threading.Condition()
+        self._pendientes = []  # Cambios que el escritor aún no tomó
+        self._encolados = 0  # Cambios entregados al escritor
+        self._persistidos = 0  # Cambios ya escritos en disco
+        # Cambios ya aplicados en memoria que aún no llegaron a _pendientes
+        # (un lote cuenta como uno hasta terminar_lote); el escritor no copia
+        # el inventario hasta que no quede ninguno
+        self._en_curso = 0
+        self._copiando = False
+        self._lote_en_curso = False
+        self._escritor = None
+        self._deteniendo = False
+        # Carga diferida: se atiende desde el volcado mapeado en memoria
+        # mientras un hilo arma el inventario y los índices; las escrituras
+        # y las consultas que usan índices esperan a que termine
+        self.carga_diferida = carga_diferida
+        self.archivo_volcado = archivo_datos + '.volcado'
+        self._volcado = None
+        self._origen_volcado = None  # (tamaño, mtime_ns) del JSON del volcado
+        self._diferido = None  # InventarioDiferido mientras se carga
+        self._cargado = threading.Event()
+        self._cargado.set()
+        self._cargador = None
+
+    def descripcion(self):
+        """Texto corto para mostrar al iniciar el servidor"""
+        texto = f"JSON ({self.modo_persistencia}): {self.archivo_datos}"
+        if self.durabilidad != 'sincrona':
+            texto += f", escritura agrupada ({self.durabilidad}, {self.ventana * 1000:g} ms)"
+        if self.carga_diferida:
+            texto += ", carga diferida"
+        return texto
+
+    def cargar(self):
+        """Carga el inventario, del volcado en segundo plano si se puede"""
+        if self.carga_diferida and self.abrir_volcado():
+            self._cargado.clear()
+            self._cargador = threading.Thread(
+                target=self.completar_carga, daemon=True)
+            self._cargador.start()
+            return
+        self.cargar_json()
+        self.iniciar_escritor()
+
+    def cargar_json(self):
+        """Carga el inventario completo desde el archivo JSON"""
+        cargado = False  # Sin el JSON la versión puede ser menor que la real
+        try:
+            if os.path.exists(self.archivo_datos):
+                with open(self.archivo_datos, 'r', encoding='utf-8') as f:
+                    self.inventario = json.load(f)
+                cargado = True
+                logging.info(
+                    f"Inventario cargado: {len(self.inventario)} equipos")
+            else:
+                self.inventario = []
+                logging.info(
+                    "Archivo de inventario no existe. Iniciando con inventario vacío.")
+        except Exception as e:
+            logging.error(f"Error al cargar inventario: {e}")
+            self.inventario = []
+
+        self.reconstruir_indice()
+        self._transiciones_journal = []
+        self.reproducir_journal()
+        transiciones, self._transiciones_journal = self._transiciones_journal, None
+        self.cargar_historial(transiciones, cargado)
+
+    def cargar_historial(self, transiciones=(), inventario_cargado=True):
+        """Lee el historial de estados y arma los totales por estado
+
+        El historial se escribe antes que el cambio: las transiciones con
+        una versión posterior a la del inventario cargado son de una
+        escritura que no terminó y se quitan del archivo. Si el inventario
+        no se pudo cargar esa versión no es confiable y las del final se
+        apartan en archivo_historial_apartado en lugar de borrarse.
+        'transiciones' son las del journal: se registran después del
+        archivo y las que ya estaban en él se descartan; las que faltaban
+        se agregan.
+        """
+        historial = HistorialEstados()
+        historial.totales = None
+        leidas = 0
+        try:
+            if os.path.exists(self.archivo_historial):
+                valido = 0  # Bytes hasta la última transición confirmada
+                posicion = 0
+                with open(self.archivo_historial, 'rb') as f:
+                    for linea in f:
+                        posicion += len(linea)
+                        try:
+                            transicion = json.loads(linea)
+                        except ValueError:
+                            # Línea incompleta por una caída durante la escritura
+                            logging.warning(
+                                "Registro incompleto en el historial, se ignora")
+                            continue
+                        if transicion['version'] > self.version:
+                            continue  # El cambio no llegó a guardarse
+                        clave = normalizar_codigo(transicion['codigo'])
+                        equipo = self.indice_codigos.get(clave)
+                        historial.registrar(
+                            clave, transicion['fecha'],
+                            internar(transicion['estado_anterior']),
+                            internar(transicion['estado']), transicion['version'],
+                            equipo.registro if equipo is not None else None)
+                        leidas += 1
+                        valido = posicion
+                if valido < posicion:
+                    # Sin las transiciones que no se confirmaron: sus versiones
+                    # se vuelven a usar
+                    with open(self.archivo_historial, 'r+b') as f:
+                        if not inventario_cargado:
+                            f.seek(valido)
+                            with open(self.archivo_historial_apartado, 'ab') as apartado:
+                                apartado.write(f.read())
+                                apartado.flush()
+                                os.fsync(apartado.fileno())
+                        f.truncate(valido)
+                        os.fsync(f.fileno())
+                    if inventario_cargado:
+                        logging.warning(
+                            f"Historial: se descartaron {posicion - valido} bytes "
+                            "de cambios que no se guardaron")
+                    else:
+                        logging.warning(
+                            f"Historial: el inventario no se cargó; {posicion - valido} "
+                            f"bytes posteriores a la versión {self.version} se "
+                            f"apartaron en {self.archivo_historial_apartado}")
+        except Exception as e:
+            logging.error(f"Error al cargar el historial de estados: {e}")
+        recuperadas = [
+            {'equipo': equipo, 'estado_anterior': anterior.estado}
+            for clave, anterior, equipo in transiciones
+            if historial.registrar(clave, equipo.actualizacion, anterior.estado,
+                                   equipo.estado, equipo.version, anterior.registro)]
+        historial.iniciar_totales(self.indice_codigos)
+        self.historial_estados = historial
+        self.escribir_historial(recuperadas)
+        if leidas:
+            logging.info(f"Historial de estados cargado: {leidas} transiciones")
+
+    def iniciar_escritor(self):
+        """Arranca el hilo escritor si la durabilidad lo usa"""
+        if self.durabilidad != 'sincrona' and self._escritor is None:
+            self._deteniendo = False
+            self._escritor = threading.Thread(
+                target=self.escribir_en_segundo_plano, daemon=True)
+            self._escritor.start()
+
+    def abrir_volcado(self):
+        """Empieza a atender desde el volcado, con el journal superpuesto"""
+        volcado = VolcadoMapeado.abrir(self.archivo_volcado, self.archivo_datos)
+        if volcado is None:
+            return False
+        try:
+            superpuestos, nuevos, aplicados = self.superponer_journal(volcado)
+        except Exception as e:
+            logging.error(f"Error al leer el journal sobre el volcado: {e}")
+            volcado.cerrar()
+            return False
+        self._volcado = volcado
+        self._origen_volcado = volcado.origen
+        self._diferido = InventarioDiferido(volcado, superpuestos, nuevos)
+        self.cambios_en_journal = aplicados
+        self.inventario = self._diferido
+        self.version = max([volcado.version] + [
+            equipo.version for equipo in superpuestos.values()])
+        logging.info(
+            f"Carga diferida: {len(self.inventario)} equipos disponibles desde "
+            f"el volcado; el inventario en memoria se arma en segundo plano")
+        return True
+
+    def superponer_journal(self, volcado):
+        """Lee el journal sobre el volcado sin cargar el inventario
+
+        Devuelve (superpuestos, nuevos, aplicados) para InventarioDiferido,
+        con las mismas reglas que aplicar_cambio. Los cambios de estado
+        quedan en _transiciones_journal para cargar_historial.
+        """
+        superpuestos = {}
+        nuevos = []
+        aplicados = 0
+        self._transiciones_journal = []
+        version = volcado.version
+        for cambio in self.leer_journal():
+            aplicados += 1
+            datos = cambio.get('equipo')
+            clave = normalizar_codigo(datos['codigo'] if datos else cambio['codigo'])
+            anterior = superpuestos.get(clave)
+            if anterior is None:
+                posicion = volcado.posicion(clave)
+                if posicion is not None:
+                    anterior = volcado.equipo(posicion)
+            if cambio['op'] == 'registrar':
+                if anterior is not None:
+                    continue
+                nuevos.append(clave)
+            elif cambio['op'] != 'actualizar' or anterior is None:
+                continue
+            if datos is None:
+                # Formato anterior: solo estado y fecha de actualización
+                datos = dict(anterior, estado=cambio['estado'],
+                             ultima_actualizacion=cambio['ultima_actualizacion'])
+                datos.pop('version', None)
+            version = max(version + 1, datos.get('version', 0))
+            equipo = Equipo.desde_dict(datos, version=version)
+            if cambio['op'] == 'actualizar' and equipo.estado != anterior.estado:
+                self._transiciones_journal.append((clave, anterior, equipo))
+            superpuestos[clave] = equipo
+        return superpuestos, nuevos, aplicados
+
+    def completar_carga(self):
+        """Hilo de la carga diferida: arma el inventario y los índices en memoria"""
+        inicio = time.perf_counter()
+        try:
+            # Decodifica cada equipo del volcado, ya con el journal aplicado
+            self.inventario = list(self._diferido)
+            self.reconstruir_indice()
+            transiciones, self._transiciones_journal = self._transiciones_journal, None
+            self.cargar_historial(transiciones or ())
+            if self.modo_persistencia != 'journal' and self.cambios_en_journal:
+                self.compactar_journal()
+        except Exception as e:
+            logging.error(f"Error en la carga diferida, se carga el JSON: {e}")
+            self.cargar_json()
+        self.iniciar_escritor()
+        self._cargado.set()
+        self._diferido = None
+        logging.info(
+            f"Carga diferida completa: {len(self.inventario)} equipos en "
+            f"{time.perf_counter() - inicio:.2f} s")
+
+    def esperar_carga(self, timeout=None):
+        """Espera a que el inventario termine de cargarse (False si no alcanzó)"""
+        return self._cargado.wait(timeout)
+
+    def leer_journal(self):
+        """Genera los cambios del journal, hasta el primer registro incompleto"""
+        if not os.path.exists(self.archivo_journal):
+            return
+        with open(self.archivo_journal, 'r', encoding='utf-8') as f:
+            for linea in f:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    cambio = json.loads(linea)
+                except json.JSONDecodeError:
+                    # Última línea incompleta por una caída durante la escritura
+                    logging.warning(
+                        "Registro incompleto en el journal, se ignora")
+                    return
+                yield cambio
+
+    def reproducir_journal(self):
+        """Aplica sobre el inventario los cambios pendientes del journal"""
+        if not os.path.exists(self.archivo_journal):
+            return
+
+        aplicados = 0
+        try:
+            for cambio in self.leer_journal():
+                self.aplicar_cambio(cambio)
+                aplicados += 1
+        except Exception as e:
+            logging.error(f"Error al reproducir journal: {e}")
+
+        self.cambios_en_journal = aplicados
+        logging.info(f"Journal reproducido: {aplicados} cambios")
+
+        if self.modo_persistencia != 'journal' and aplicados:
+            # Consolidar los cambios en el archivo principal
+            self.compactar_journal()
+
+    def aplicar_cambio(self, cambio):
+        """Aplica al inventario en memoria un cambio leído del journal"""
+        if 'equipo' in cambio and 'version' not in cambio['equipo']:
+            # Journal escrito antes de las versiones
+            cambio['equipo']['version'] = self.version + 1
+
+        if cambio['op'] == 'registrar':
+            equipo = cambio['equipo']
+            clave = normalizar_codigo(equipo['codigo'])
+            if clave not in self.indice_codigos:
+                self.agregar_equipo(clave, Equipo.desde_dict(equipo))
+
+        elif cambio['op'] == 'actualizar':
+            if 'equipo' in cambio:
+                clave = normalizar_codigo(cambio['equipo']['codigo'])
+                if clave in self.indice_codigos:
+                    self.reemplazar_equipo(
+                        clave, Equipo.desde_dict(cambio['equipo']))
+                return
+
+            # Formato anterior: solo estado y fecha de actualización
+            clave = normalizar_codigo(cambio['codigo'])
+            equipo = self.indice_codigos.get(clave)
+            if equipo is not None:
+                self.reemplazar_equipo(clave, Equipo.desde_dict(dict(
+                    equipo,
+                    estado=cambio['estado'],
+                    ultima_actualizacion=cambio['ultima_actualizacion']),
+                    version=self.version + 1))
+
+    def anotar_transicion(self, clave, anterior, equipo):
+        """Agrega un cambio de estado al historial (requiere tener el lock)"""
+        if self._transiciones_journal is not None:
+            # Reproduciendo el journal: se registran después de leer el historial
+            self._transiciones_journal.append((clave, anterior, equipo))
+            return
+        super().anotar_transicion(clave, anterior, equipo)
+
+    def insertar(self, equipo):
+        """Agrega un equipo nuevo y persiste el cambio"""
+        self.esperar_carga()
+        with self.cambio_en_curso():
+            equipo = super().insertar(equipo)
+            self.registrar_cambio({'op': 'registrar', 'equipo': equipo})
+        return equipo
+
+    def actualizar(self, equipo):
+        """Reemplaza un equipo y persiste el cambio"""
+        self.esperar_carga()
+        estado_anterior = self.indice_codigos[normalizar_codigo(equipo['codigo'])].estado
+        with self.cambio_en_curso():
+            equipo = super().actualizar(equipo)
+            cambio = {'op': 'actualizar', 'equipo': equipo}
+            if equipo.estado != estado_anterior:
+                cambio['estado_anterior'] = estado_anterior  # Va también al historial
+            self.registrar_cambio(cambio)
+        return equipo
+
+    @contextmanager
+    def cambio_en_curso(self):
+        """Cuenta un cambio desde que se aplica en memoria hasta que se encola
+
+        Así el hilo escritor no copia un inventario con cambios cuya
+        transición todavía no está entre los pendientes.
+        """
+        if self._escritor is None or self._cambios_lote is not None:
+            yield  # Se escribe en el momento, o el lote ya cuenta
+            return
+        self.empezar_cambio()
+        try:
+            yield
+        finally:
+            self.terminar_cambio()
+
+    def empezar_cambio(self):
+        """Espera a que el escritor termine de copiar y cuenta un cambio en curso"""
+        with self._condicion:
+            self._condicion.wait_for(lambda: not self._copiando)
+            self._en_curso += 1
+
+    def terminar_cambio(self):
+        """Descuenta un cambio en curso, ya entregado al escritor"""
+        with self._condicion:
+            self._en_curso -= 1
+            self._condicion.notify_all()
+
+    def iniciar_lote(self):
+        """Difiere la persistencia hasta terminar_lote"""
+        self.esperar_carga()
+        self._lote_en_curso = self._escritor is not None
+        if self._lote_en_curso:
+            self.empezar_cambio()
+        self._cambios_lote = []
+
+    # --- Lectura durante la carga diferida ---
+    # Mientras se carga se atiende desde el volcado lo que no necesita
+    # índices; lo demás espera a que termine la carga
+
+    def obtener(self, codigo):
+        """Devuelve el equipo con ese código, o None"""
+        if not self._cargado.is_set():
+            diferido = self._diferido
+            if diferido is not None:
+                return diferido.obtener(normalizar_codigo(codigo))
+        return super().obtener(codigo)
+
+    def instantanea(self):
+        """Devuelve una secuencia inmutable con el inventario, sin bloquear"""
+        if not self._cargado.is_set():
+            diferido = self._diferido
+            if diferido is not None:
+                return diferido  # Decodifica solo lo que se lee
+        return super().instantanea()
+
+    def cambios_desde(self, version, limite):
+        """Devuelve (equipos, hasta, mas): los equipos cambiados después de 'version'"""
+        self.esperar_carga()
+        return super().cambios_desde(version, limite)
+
+    def filtrar(self, *args, **kwargs):
+        """Devuelve (total, equipos) que cumplen todos los filtros"""
+        self.esperar_carga()
+        return super().filtrar(*args, **kwargs)
+
+    def buscar_texto(self, palabras, limite):
+        """Devuelve (total, equipos) ordenados por relevancia"""
+        self.esperar_carga()
+        return super().buscar_texto(palabras, limite)
+
+    def historial(self, *args, **kwargs):
+        """Devuelve (transiciones, siguiente_cursor): cambios de estado en orden de fecha"""
+        self.esperar_carga()
+        return super().historial(*args, **kwargs)
+
+    def utilizacion(self, *args, **kwargs):
+        """Segundos que pasó un equipo en cada estado, o None si no existe"""
+        self.esperar_carga()
+        return super().utilizacion(*args, **kwargs)
+
+    def utilizacion_estados(self, ahora=None):
+        """{estado: (segundos, equipos)}: tiempo de todos los equipos en cada estado"""
+        self.esperar_carga()
+        return super().utilizacion_estados(ahora)
+
+    def terminar_lote(self):
+        """Persiste de una vez los cambios del lote"""
+        cambios = self._cambios_lote
+        self._cambios_lote = None
+        try:
+            if cambios:
+                self.persistir(cambios)
+        finally:
+            if self._lote_en_curso:
+                self._lote_en_curso = False
+                self.terminar_cambio()
+
+    def registrar_cambio(self, cambio):
+        """Persiste un cambio según el modo de persistencia configurado"""
+        if self._cambios_lote is not None:
+            # Dentro de un lote se persiste todo junto al final
+            self._cambios_lote.append(cambio)
+            return
+        self.persistir([cambio])
+
+    def persistir(self, cambios):
+        """Escribe los cambios ahora o los entrega al hilo escritor"""
+        if self._escritor is None:
+            self.escribir_cambios(cambios)
+            return
+        with self._condicion:
+            self._pendientes.extend(cambios)
+            self._encolados += len(cambios)
+            self._condicion.notify_all()
+
+    def marca_persistencia(self):
+        """Marca del último cambio a esperar (0: nada que esperar)"""
+        if self.durabilidad != 'disco' or self._escritor is None:
+            return 0
+        return self._encolados
+
+    def esperar_persistencia(self, marca, timeout=None):
+        """Espera a que los cambios hasta 'marca' estén en disco"""
+        if not marca:
+            return True
+        with self._condicion:
+            return self._condicion.wait_for(
+                lambda: self._persistidos >= marca, timeout)
+
+    def escribir_en_segundo_plano(self):
+        """Hilo escritor: junta los cambios pendientes y los escribe juntos"""
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(
+                    lambda: self._pendientes or self._deteniendo)
+                if not self._pendientes:
+                    return  # Detenido y sin nada pendiente
+                if self.ventana > 0 and not self._deteniendo:
+                    # Dar tiempo a que lleguen más cambios para la misma escritura
+                    self._condicion.wait_for(
+                        lambda: len(self._pendientes) >= self.agrupar_cada
+                        or self._deteniendo, self.ventana)
+                # Con un cambio aplicado en memoria pero sin encolar, la copia
+                # lo guardaría sin su transición en el historial: se espera
+                # a que llegue a los pendientes sin dejar que empiecen otros
+                self._copiando = True
+                self._condicion.wait_for(lambda: not self._en_curso)
+                cambios, self._pendientes = self._pendientes, []
+                marca = self._encolados
+                inventario = list(self.inventario)
+                self._copiando = False
+                self._condicion.notify_all()
+
+            # Fuera del lock: los cambios siguientes se acumulan mientras tanto
+            self.escribir_cambios(cambios, inventario)
+
+            with self._condicion:
+                self._persistidos = marca
+                self._condicion.notify_all()
+
+    def escribir_cambios(self, cambios, inventario=None):
+        """Escribe en disco una lista de cambios en un solo paso"""
+        with medir_persistencia(self.metricas):
+            # El historial va antes: un cambio guardado siempre tiene su
+            # transición, y la de un cambio que no llegó a guardarse se
+            # descarta al cargar por su versión
+            self.escribir_historial(cambios)
+            self.escribir_inventario(cambios, inventario)
+
+    def escribir_inventario(self, cambios, inventario=None):
+        """Guarda los cambios en el JSON o en el journal según el modo"""
+        if self.modo_persistencia != 'journal':
+            self.guardar_inventario(inventario)
+            return
+        if len(cambios) >= self.compactar_cada and self.compactar_journal(inventario):
+            # Un lote tan grande (p. ej. una importación) se compactaría
+            # enseguida: se guarda el inventario sin pasar por el journal
+            return
+
+        try:
+            if self._journal is None:
+                self._journal = open(
+                    self.archivo_journal, 'a', encoding='utf-8')
+            # Línea por línea: un lote grande no arma todo el texto en memoria
+            self._journal.writelines(
+                json.dumps(cambio, ensure_ascii=False,
+                           separators=(',', ':'),
+                           default=Equipo.a_dict) + '\n'
+                for cambio in cambios)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.cambios_en_journal += len(cambios)
+        except Exception as e:
+            logging.error(f"Error al escribir en el journal: {e}")
+            return
+
+        if self.cambios_en_journal >= self.compactar_cada:
+            self.compactar_journal(inventario)
+
+    def escribir_historial(self, cambios):
+        """Agrega al historial las transiciones de estado de los cambios
+
+        El historial no se compacta: es el registro de auditoría.
+        """
+        lineas = [
+            json.dumps({'codigo': cambio['equipo']['codigo'],
+                        'fecha': cambio['equipo'].get('ultima_actualizacion'),
+                        'estado_anterior': cambio['estado_anterior'],
+                        'estado': cambio['equipo']['estado'],
+                        'version': cambio['equipo']['version']},
+                       ensure_ascii=False, separators=(',', ':')) + '\n'
+            for cambio in cambios if 'estado_anterior' in cambio]
+        if not lineas:
+            return
+        try:
+            if self._historial is None:
+                self._historial = open(
+                    self.archivo_historial, 'a', encoding='utf-8')
+                if self._historial.tell():
+                    with open(self.archivo_historial, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read() != b'\n':
+                            # Cerrar la línea incompleta de una caída
+                            self._historial.write('\n')
+            self._historial.writelines(lineas)
+            self._historial.flush()
+            os.fsync(self._historial.fileno())
+        except Exception as e:
+            logging.error(f"Error al escribir el historial de estados: {e}")
+
+    def compactar_journal(self, inventario=None):
+        """Guarda el inventario completo y vacía el journal
+
+        Devuelve False si no se pudo guardar el inventario.
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        if inventario is None:
+            inventario = list(self.inventario)
+        if not self.guardar_inventario(inventario):
+            return False
+        if self.carga_diferida:
+            # El volcado debe quedar al día antes de vaciar el journal
+            self.guardar_volcado(inventario)
+
+        try:
+            if os.path.exists(self.archivo_journal):
+                os.remove(self.archivo_journal)
+            self.cambios_en_journal = 0
+            logging.info("Journal compactado")
+        except Exception as e:
+            logging.error(f"Error al compactar journal: {e}")
+        return True
+
+    def guardar_volcado(self, inventario=None):
+        """Escribe el volcado del inventario recién guardado en el JSON"""
+        if inventario is None:
+            inventario = list(self.inventario)
+        try:
+            origen = os.stat(self.archivo_datos)
+            inicio = time.perf_counter()
+            escribir_volcado(self.archivo_volcado, inventario, origen)
+            self._origen_volcado = (origen.st_size, origen.st_mtime_ns)
+            logging.info(
+                f"Volcado guardado: {len(inventario)} equipos en "
+                f"{time.perf_counter() - inicio:.2f} s")
+        except Exception as e:
+            logging.error(f"Error al guardar el volcado: {e}")
+
+    def guardar_inventario(self, inventario=None):
+        """Guarda el inventario (o la copia indicada) en el archivo JSON"""
+        if inventario is None:
+            inventario = self.inventario
+        try:
+            # Escribir en un archivo temporal, llevarlo al disco y reemplazar,
+            # para que una caída nunca deje el archivo principal a medio escribir
+            archivo_temporal = self.archivo_datos + '.tmp'
+            with open(archivo_temporal, 'w', encoding='utf-8') as f:
+                json.dump(inventario, f, indent=4, ensure_ascii=False,
+                          default=Equipo.a_dict)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(archivo_temporal, self.archivo_datos)
+            logging.info("Inventario guardado correctamente")
+            return True
+        except Exception as e:
+            logging.error(f"Error al guardar inventario: {e}")
+            return False
+
+    def cerrar(self):
+        """Escribe lo pendiente y libera los recursos de persistencia"""
+        if self._cargador is not None:
+            self._cargador.join()
+            self._cargador = None
+        if self._escritor is not None:
+            with self._condicion:
+                self._deteniendo = True
+                self._condicion.notify_all()
+            self._escritor.join()
+            self._escritor = None
+        if self.modo_persistencia == 'journal' and self.cambios_en_journal:
+            self.compactar_journal()
+        elif self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._historial is not None:
+            self._historial.close()
+            self._historial = None
+        if self.carga_diferida and os.path.exists(self.archivo_datos):
+            origen = os.stat(self.archivo_datos)
+            if self._origen_volcado != (origen.st_size, origen.st_mtime_ns):
+                self.guardar_volcado()
+        if self._volcado is not None:
+            self._volcado.cerrar()
+            self._volcado = None
+
+
+class AlmacenamientoSQLite:
+    """Inventario guardado en una base de datos SQLite
+
+    Cada hilo usa su propia conexión; en modo WAL los lectores no esperan
+    a los escritores. Solo se mantiene en memoria lo que pide cada consulta.
+    """
+
+    COLUMNAS = 'codigo, nombre, tipo, estado, fecha_registro, ultima_actualizacion, version'
+
+    def __init__(self, archivo_datos='inventario.db'):
+        self.archivo_datos = archivo_datos
+        self._local = threading.local()
+        self._conexiones = {}  # hilo -> conexión abierta por ese hilo
+        self._lock_conexiones = threading.Lock()
+        self.texto_disponible = True
+        self.metricas = None  # Metricas del servidor, si las asigna
+
+    def descripcion(self):
+        """Texto corto para mostrar al iniciar el servidor"""
+        return f"SQLite (WAL): {self.archivo_datos}"
+
+    def conexion(self):
+        """Devuelve la conexión del hilo actual, creándola si hace falta"""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            # isolation_level=None: las transacciones se abren explícitamente
+            conexion = sqlite3.connect(
+                self.archivo_datos, isolation_level=None,
+                check_same_thread=False, timeout=5)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+            self._local.en_lote = False
+            with self._lock_conexiones:
+                # Cerrar las conexiones de hilos que ya terminaron
+                for hilo in [h for h in self._conexiones if not h.is_alive()]:
+                    self._conexiones.pop(hilo).close()
+                self._conexiones[threading.current_thread()] = conexion
+        return conexion
+
+    def cargar(self):
+        """Crea las tablas e índices si no existen"""
+        conexion = self.conexion()
+        conexion.executescript('''
+            CREATE TABLE IF NOT EXISTS equipos (
+                posicion INTEGER PRIMARY KEY AUTOINCREMENT,
+                codigo TEXT NOT NULL UNIQUE,
+                nombre TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                tipo_normalizado TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                fecha_registro TEXT NOT NULL,
+                ultima_actualizacion TEXT,
+                version INTEGER NOT NULL DEFAULT 0,
+                desde INTEGER  -- Segundos desde los que está en su estado
+            );
+            CREATE INDEX IF NOT EXISTS idx_equipos_estado
+                ON equipos (estado, posicion);
+            CREATE INDEX IF NOT EXISTS idx_equipos_tipo
+                ON equipos (tipo_normalizado, posicion);
+            CREATE INDEX IF NOT EXISTS idx_equipos_fecha
+                ON equipos (fecha_registro);
+            CREATE TABLE IF NOT EXISTS contadores (
+                nombre TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO contadores (nombre, valor)
+                VALUES ('total', 0), ('version', 0);
+            CREATE TABLE IF NOT EXISTS historial (
+                id INTEGER PRIMARY KEY,
+                codigo TEXT NOT NULL,
+                fecha TEXT NOT NULL,
+                segundos INTEGER NOT NULL,
+                estado_anterior TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_historial_codigo
+                ON historial (codigo, segundos, version);
+            CREATE INDEX IF NOT EXISTS idx_historial_fecha
+                ON historial (segundos, version);
+            CREATE TABLE IF NOT EXISTS utilizacion (
+                codigo TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                segundos INTEGER NOT NULL,
+                PRIMARY KEY (codigo, estado)
+            ) WITHOUT ROWID;
+        ''')
+        columnas = {fila[1] for fila in conexion.execute('PRAGMA table_info(equipos)')}
+        if 'version' not in columnas:
+            # Base creada antes de las versiones: sus equipos quedan en la 0
+            conexion.execute(
+                'ALTER TABLE equipos ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        conexion.execute(
+            'CREATE INDEX IF NOT EXISTS idx_equipos_version ON equipos (version)')
+        if 'desde' not in columnas:
+            # Base creada antes del historial: cada equipo está en su
+            # estado desde que se registró
+            with self.transaccion():
+                conexion.execute('ALTER TABLE equipos ADD COLUMN desde INTEGER')
+                conexion.execute(
+                    "UPDATE equipos SET desde = CAST(strftime('%s', fecha_registro) AS INTEGER)")
+        if not conexion.execute("SELECT 1 FROM sqlite_master "
+                                "WHERE name = 'utilizacion_estados'").fetchone():
+            with self.transaccion():
+                conexion.execute('''
+                    CREATE TABLE utilizacion_estados (
+                        estado TEXT PRIMARY KEY,
+                        cerrado INTEGER NOT NULL,
+                        equipos INTEGER NOT NULL,
+                        suma_desde INTEGER NOT NULL
+                    )
+                ''')
+                conexion.execute(
+                    'INSERT INTO utilizacion_estados '
+                    'SELECT estado, 0, count(*), sum(desde) FROM equipos '
+                    'WHERE desde IS NOT NULL GROUP BY estado')
+        try:
+            conexion.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS equipos_texto USING fts5(
+                    nombre, tipo, content='equipos', content_rowid='posicion',
+                    tokenize='unicode61 remove_diacritics 2')
+            ''')
+        except sqlite3.OperationalError as e:
+            # SQLite compilado sin FTS5
+            logging.warning(f"Búsqueda por texto no disponible: {e}")
+            self.texto_disponible = False
+        logging.info(
+            f"Base de datos SQLite lista: {self.total()} equipos")
+
+    def cerrar(self):
+        """Cierra todas las conexiones abiertas"""
+        with self._lock_conexiones:
+            for conexion in self._conexiones.values():
+                try:
+                    conexion.close()
+                except sqlite3.Error:
+                    pass
+            self._conexiones = {}
+        self._local = threading.local()
+
+    def esperar_carga(self, timeout=None):
+        """Espera a que el inventario termine de cargarse (nada que esperar)"""
+        return True
+
+    def marca_persistencia(self):
+        """Marca del último cambio a esperar (0: cada COMMIT ya escribió)"""
+        return 0
+
+    def esperar_persistencia(self, marca, timeout=None):
+        """Espera a que los cambios hasta 'marca' estén en disco"""
+        return True
+
+    @staticmethod
+    def fila_a_equipo(fila):
+        """Convierte una fila de la tabla en el diccionario del equipo"""
+        equipo = {
+            'codigo': fila[0],
+            'nombre': fila[1],
+            'tipo': fila[2],
+            'estado': fila[3],
+            'fecha_registro': fila[4]
+        }
+        if fila[5] is not None:
+            equipo['ultima_actualizacion'] = fila[5]
+        equipo['version'] = fila[6]
+        return equipo
+
+    @property
+    def inventario(self):
+        """Lista completa de equipos (lee toda la tabla)"""
+        filas = self.conexion().execute(
+            f'SELECT {self.COLUMNAS} FROM equipos ORDER BY posicion')
+        return [self.fila_a_equipo(fila) for fila in filas]
+
+    # --- Escritura ---
+
+    @contextmanager
+    def transaccion(self):
+        """Abre una transacción, salvo que ya haya un lote en curso"""
+        conexion = self.conexion()
+        if self._local.en_lote:
+            yield conexion
+            return
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            yield conexion
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        with medir_persistencia(self.metricas):
+            conexion.execute('COMMIT')
+
+    @staticmethod
+    def siguiente_version(conexion):
+        """Reserva el número de versión del cambio (dentro de la transacción)"""
+        # Sin RETURNING, que requiere SQLite 3.35
+        conexion.execute(
+            "UPDATE contadores SET valor = valor + 1 WHERE nombre = 'version'")
+        return conexion.execute(
+            "SELECT valor FROM contadores WHERE nombre = 'version'").fetchone()[0]
+
+    def insertar(self, equipo):
+        """Agrega un equipo nuevo al inventario y lo devuelve con su versión"""
+        desde = segundos_de_fecha(equipo.get('fecha_registro'))
+        with self.transaccion() as conexion:
+            equipo = dict(equipo, version=self.siguiente_version(conexion))
+            try:
+                cursor = conexion.execute(
+                    'INSERT INTO equipos (codigo, nombre, tipo, tipo_normalizado, '
+                    'estado, fecha_registro, ultima_actualizacion, version, desde) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (normalizar_codigo(equipo['codigo']), equipo['nombre'],
+                     equipo['tipo'], normalizar_tipo(equipo['tipo']),
+                     equipo['estado'], equipo.get('fecha_registro', ''),
+                     equipo.get('ultima_actualizacion'), equipo['version'], desde))
+            except sqlite3.IntegrityError:
+                raise CodigoDuplicadoError(equipo['codigo'])
+            if desde is not None:
+                self.sumar_estado(conexion, equipo['estado'], 0, 1, desde)
+            if self.texto_disponible:
+                conexion.execute(
+                    'INSERT INTO equipos_texto (rowid, nombre, tipo) VALUES (?, ?, ?)',
+                    (cursor.lastrowid, equipo['nombre'], equipo['tipo']))
+            conexion.execute(
+                "UPDATE contadores SET valor = valor + 1 WHERE nombre = 'total'")
+        return equipo
+
+    def actualizar(self, equipo):
+        """Guarda la nueva versión de un equipo existente y la devuelve
+
+        Un cambio de estado se agrega al historial y a la utilización en
+        la misma transacción.
+        """
+        clave = normalizar_codigo(equipo['codigo'])
+        with self.transaccion() as conexion:
+            equipo = dict(equipo, version=self.siguiente_version(conexion))
+            anterior, desde = conexion.execute(
+                'SELECT estado, desde FROM equipos WHERE codigo = ?', (clave,)).fetchone()
+            if equipo['estado'] != anterior:
+                desde = self.registrar_transicion(conexion, clave, equipo, anterior, desde)
+            conexion.execute(
+                'UPDATE equipos SET estado = ?, ultima_actualizacion = ?, version = ?, '
+                'desde = ? WHERE codigo = ?',
+                (equipo['estado'], equipo.get('ultima_actualizacion'),
+                 equipo['version'], desde, clave))
+        return equipo
+
+    def registrar_transicion(self, conexion, clave, equipo, anterior, inicio):
+        """Guarda un cambio de estado y cierra la duración del anterior
+
+        'inicio' son los segundos desde los que el equipo estaba en el
+        estado anterior. Devuelve los segundos del cambio.
+        """
+        fecha = equipo.get('ultima_actualizacion')
+        segundos = segundos_de_fecha(fecha)
+        if segundos is None:
+            segundos = segundos_ahora()
+            fecha = fecha_de_segundos(segundos)
+        conexion.execute(
+            'INSERT INTO historial (codigo, fecha, segundos, estado_anterior, '
+            'estado, version) VALUES (?, ?, ?, ?, ?, ?)',
+            (clave, fecha, segundos, anterior, equipo['estado'], equipo['version']))
+        duracion = max(segundos - inicio, 0) if inicio is not None else 0
+        conexion.execute(
+            'INSERT INTO utilizacion (codigo, estado, segundos) VALUES (?, ?, ?) '
+            'ON CONFLICT (codigo, estado) DO UPDATE SET segundos = segundos + excluded.segundos',
+            (clave, anterior, duracion))
+        if inicio is not None:
+            self.sumar_estado(conexion, anterior, duracion, -1, -inicio)
+        self.sumar_estado(conexion, equipo['estado'], 0, 1, segundos)
+        return segundos
+
+    @staticmethod
+    def sumar_estado(conexion, estado, cerrado, equipos, suma_desde):
+        """Suma a los totales de utilización de un estado (dentro de la transacción)"""
+        conexion.execute(
+            'INSERT INTO utilizacion_estados (estado, cerrado, equipos, suma_desde) '
+            'VALUES (?, ?, ?, ?) ON CONFLICT (estado) DO UPDATE SET '
+            'cerrado = cerrado + excluded.cerrado, equipos = equipos + excluded.equipos, '
+            'suma_desde = suma_desde + excluded.suma_desde',
+            (estado, cerrado, equipos, suma_desde))
+
+    def iniciar_lote(self):
+        """Agrupa las escrituras siguientes en una sola transacción"""
+        conexion = self.conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        self._local.en_lote = True
+
+    def terminar_lote(self):
+        """Confirma la transacción del lote"""
+        self._local.en_lote = False
+        with medir_persistencia(self.metricas):
+            self.conexion().execute('COMMIT')
+
+    # --- Lectura ---
+
+    def obtener(self, codigo):
+        """Devuelve el equipo con ese código, o None"""
+        fila = self.conexion().execute(
+            f'SELECT {self.COLUMNAS} FROM equipos WHERE codigo = ?',
+            (normalizar_codigo(codigo),)).fetchone()
+        return self.fila_a_equipo(fila) if fila else None
+
+    def total(self):
+        """Cantidad de equipos en el inventario"""
+        fila = self.conexion().execute(
+            "SELECT valor FROM contadores WHERE nombre = 'total'").fetchone()
+        return fila[0] if fila else 0
+
+    def version_actual(self):
+        """Versión del último cambio"""
+        fila = self.conexion().execute(
+            "SELECT valor FROM contadores WHERE nombre = 'version'").fetchone()
+        return fila[0] if fila else 0
+
+    def estado_anterior(self, codigo, version):
+        """Estado de un equipo antes de su primer cambio de estado posterior a 'version'
+
+        None si no cambió de estado desde entonces.
+        """
+        fila = self.conexion().execute(
+            'SELECT estado_anterior FROM historial WHERE codigo = ? AND version > ? '
+            'ORDER BY version LIMIT 1', (normalizar_codigo(codigo), version)).fetchone()
+        return fila[0] if fila else None
+
+    def cambios_desde(self, version, limite):
+        """Devuelve (equipos, hasta, mas): los equipos cambiados después de 'version'
+
+        La columna indexada 'version' hace de registro de cambios completo.
+        """
+        actual = self.version_actual()
+        filas = self.conexion().execute(
+            f'SELECT {self.COLUMNAS} FROM equipos WHERE version > ? '
+            'ORDER BY version LIMIT ?', (version, limite + 1)).fetchall()
+        equipos = [self.fila_a_equipo(fila) for fila in filas[:limite]]
+        if len(filas) > limite:
+            return equipos, equipos[-1]['version'], True
+        return equipos, actual, False
+
+    def historial(self, codigo=None, desde=None, hasta=None, cursor=None, limite=100):
+        """Devuelve (transiciones, siguiente_cursor): cambios de estado en orden de fecha"""
+        condiciones = []
+        parametros = []
+        if codigo is not None:
+            condiciones.append('codigo = ?')
+            parametros.append(normalizar_codigo(codigo))
+        if desde is not None:
+            condiciones.append('segundos >= ?')
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append('segundos <= ?')
+            parametros.append(hasta)
+        if cursor is not None:
+            condiciones.append('(segundos, version) > (?, ?)')
+            parametros.extend(leer_cursor_historial(cursor))
+        donde = ' AND '.join(condiciones) if condiciones else '1'
+
+        filas = self.conexion().execute(
+            'SELECT codigo, fecha, estado_anterior, estado, version, segundos '
+            f'FROM historial WHERE {donde} ORDER BY segundos, version LIMIT ?',
+            parametros + [limite + 1]).fetchall()
+        transiciones = [{'codigo': fila[0], 'fecha': fila[1], 'estado_anterior': fila[2],
+                         'estado': fila[3], 'version': fila[4]}
+                        for fila in filas[:limite]]
+        siguiente = None
+        if len(filas) > limite:
+            siguiente = f'{filas[limite - 1][5]}:{filas[limite - 1][4]}'
+        return transiciones, siguiente
+
+    def utilizacion(self, codigo, desde=None, hasta=None, ahora=None):
+        """Segundos que pasó un equipo en cada estado, o None si no existe
+
+        Sin rango suma la tabla de utilización y el estado actual; con
+        rango recorre las transiciones del equipo desde 'desde'.
+        """
+        clave = normalizar_codigo(codigo)
+        conexion = self.conexion()
+        fila = conexion.execute(
+            'SELECT estado, desde, fecha_registro FROM equipos WHERE codigo = ?',
+            (clave,)).fetchone()
+        if fila is None:
+            return None
+        estado, inicio, fecha_registro = fila
+        if ahora is None:
+            ahora = segundos_ahora()
+        if desde is None and hasta is None:
+            segundos = dict(conexion.execute(
+                'SELECT estado, segundos FROM utilizacion WHERE codigo = ?', (clave,)))
+            if inicio is not None and ahora > inicio:
+                segundos[estado] = segundos.get(estado, 0) + ahora - inicio
+            return segundos
+
+        registro = segundos_de_fecha(fecha_registro)
+        if registro is not None:
+            desde = registro if desde is None else max(desde, registro)
+        fin = ahora if hasta is None else min(hasta + 1, ahora)
+        transiciones = conexion.execute(
+            'SELECT segundos, estado_anterior, estado FROM historial '
+            'WHERE codigo = ? AND segundos >= ? ORDER BY segundos, version',
+            (clave, -sys.maxsize if desde is None else desde))
+        return tiempo_por_estado(transiciones, estado, desde, fin)
+
+    def utilizacion_estados(self, ahora=None):
+        """{estado: (segundos, equipos)}: tiempo de todos los equipos en cada estado"""
+        if ahora is None:
+            ahora = segundos_ahora()
+        filas = self.conexion().execute(
+            'SELECT estado, cerrado, equipos, suma_desde FROM utilizacion_estados')
+        return {estado: (cerrado + equipos * ahora - suma_desde, equipos)
+                for estado, cerrado, equipos, suma_desde in filas}
+
+    def pagina(self, cursor, limite):
+        """Devuelve (equipos, siguiente_cursor, total) a partir del cursor
+
+        El cursor es la posición interna del último equipo entregado.
+        """
+        desde = 0
+        if cursor is not None:
+            try:
+                desde = int(cursor)
+            except (TypeError, ValueError):
+                raise CursorInvalidoError("Cursor inválido")
+            if desde < 0:
+                raise CursorInvalidoError("Cursor inválido")
+
+        filas = self.conexion().execute(
+            f'SELECT posicion, {self.COLUMNAS} FROM equipos '
+            'WHERE posicion > ? ORDER BY posicion LIMIT ?',
+            (desde, limite + 1)).fetchall()
+        siguiente = str(filas[limite - 1][0]) if len(filas) > limite else None
+        equipos = [self.fila_a_equipo(fila[1:]) for fila in filas[:limite]]
+        return equipos, siguiente, self.total()
+
+    def bloques(self, tamano):
+        """Genera (total, equipos) en bloques leídos de la base"""
+        total = self.total()
+        cursor = None
+        while True:
+            equipos, cursor, _ = self.pagina(cursor, tamano)
+            yield total, equipos
+            if cursor is None:
+                break
+
+    def filtrar(self, estado=None, tipo=None, fecha_desde=None,
+                fecha_hasta=None, inicio=0, limite=None):
+        """Devuelve (total, equipos) que cumplen todos los filtros"""
+        condiciones = []
+        parametros = []
+        if estado is not None:
+            condiciones.append('estado = ?')
+            parametros.append(estado)
+        if tipo is not None:
+            condiciones.append('tipo_normalizado = ?')
+            parametros.append(tipo)
+        if fecha_desde is not None:
+            condiciones.append('fecha_registro >= ?')
+            parametros.append(fecha_desde)
+        if fecha_hasta is not None:
+            # Una fecha sin hora incluye todo ese día
+            condiciones.append('fecha_registro <= ?')
+            parametros.append(fecha_hasta + '\uffff')
+        donde = ' AND '.join(condiciones) if condiciones else '1'
+
+        conexion = self.conexion()
+        total = conexion.execute(
+            f'SELECT count(*) FROM equipos WHERE {donde}', parametros).fetchone()[0]
+        filas = conexion.execute(
+            f'SELECT {self.COLUMNAS} FROM equipos WHERE {donde} '
+            'ORDER BY posicion LIMIT ? OFFSET ?',
+            parametros + [-1 if limite is None else limite, inicio])
+        return total, [self.fila_a_equipo(fila) for fila in filas]
+
+    def buscar_texto(self, palabras, limite):
+        """Devuelve (total, equipos) ordenados por relevancia"""
+        if not self.texto_disponible:
+            raise RuntimeError("Búsqueda por texto no disponible")
+
+        # Cada palabra como prefijo; todas deben coincidir
+        consulta = ' AND '.join(f'"{palabra}"*' for palabra in palabras)
+        conexion = self.conexion()
+        total = conexion.execute(
+            'SELECT count(*) FROM equipos_texto WHERE equipos_texto MATCH ?',
+            (consulta,)).fetchone()[0]
+        filas = conexion.execute(
+            'SELECT e.codigo, e.nombre, e.tipo, e.estado, e.fecha_registro, '
+            'e.ultima_actualizacion, e.version FROM equipos_texto '
+            'JOIN equipos e ON e.posicion = equipos_texto.rowid '
+            'WHERE equipos_texto MATCH ? '
+            f'ORDER BY bm25(equipos_texto, {PESO_NOMBRE}.0, {PESO_TIPO}.0), e.posicion '
+            'LIMIT ?',
+            (consulta, limite))
+        return total, [self.fila_a_equipo(fila) for fila in filas]
+
+
+ALMACENAMIENTOS = ['json', 'sqlite', 'memoria']
+
+
+def crear_almacenamiento(tipo, archivo_datos=None, **opciones):
+    """Crea el almacenamiento indicado por nombre"""
+    if tipo == 'json':
+        return AlmacenamientoJSON(archivo_datos or 'inventario.json', **opciones)
+    if tipo == 'sqlite':
+        return AlmacenamientoSQLite(archivo_datos or 'inventario.db')
+    if tipo == 'memoria':
+        return AlmacenamientoMemoria()
+    raise ValueError(
+        f"Almacenamiento inválido. Debe ser uno de: {', '.join(ALMACENAMIENTOS)}")
@@ -0,0 +1,361 @@
+"""
+Benchmark de carga y latencia del servidor de inventario
+
+Inicia ServidorInventario en otro proceso sobre un puerto libre, carga un
+inventario del tamaño indicado y lo somete a una mezcla de operaciones
+desde N clientes concurrentes. Informa operaciones por segundo y
+latencias p50/p99/p999 por operación, y puede guardar los resultados en
+JSON y compararlos con una ejecución anterior.
+
+Ejemplo:
+    python benchmark.py --clientes 16 --equipos 50000 --duracion 10 \\
+        --mezcla buscar=70,consultar=10,actualizar=15,registrar=5 \\
+        --salida actual.json --comparar base.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from cliente import ConexionInventario, ErrorComunicacion
+
+MEZCLA_POR_DEFECTO = 'buscar=70,consultar=10,actualizar=15,registrar=5'
+OPERACIONES = ['registrar', 'consultar', 'buscar', 'actualizar']
+ESTADOS = ['disponible', 'en uso', 'en mantenimiento', 'fuera de servicio']
+TIPOS = ['Computador', 'Multímetro', 'Osciloscopio', 'Sensor',
+         'Fuente de poder', 'Generador de señales']
+TAMANO_PAGINA = 100
+TAMANO_LOTE_CARGA = 1000
+
+
+def parsear_mezcla(texto):
+    """Convierte 'buscar=70,registrar=30' en pesos por operación"""
+    pesos = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        nombre = nombre.strip().lower()
+        if nombre not in OPERACIONES:
+            raise ValueError(
+                f"Operación inválida '{nombre}'. Debe ser una de: {', '.join(OPERACIONES)}")
+        pesos[nombre] = float(peso or 1)
+    if not any(pesos.values()):
+        raise ValueError("La mezcla debe tener al menos un peso positivo")
+    return pesos
+
+
+def percentil(ordenadas, fraccion):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordenadas:
+        return 0.0
+    indice = min(len(ordenadas) - 1, max(0, int(fraccion * len(ordenadas) + 0.5) - 1))
+    return ordenadas[indice]
+
+
+def resumir(latencias, errores, duracion):
+    """Estadísticas de una operación (latencias en milisegundos)"""
+    ordenadas = sorted(latencias)
+    return {
+        'operaciones': len(ordenadas),
+        'errores': errores,
+        'ops_s': round(len(ordenadas) / duracion, 1) if duracion else 0.0,
+        'p50_ms': round(percentil(ordenadas, 0.50), 3),
+        'p99_ms': round(percentil(ordenadas, 0.99), 3),
+        'p999_ms': round(percentil(ordenadas, 0.999), 3),
+        'max_ms': round(ordenadas[-1], 3) if ordenadas else 0.0
+    }
+
+
+def ejecutar_servidor(opciones, cola):
+    """Proceso hijo: inicia el servidor y avisa el puerto asignado"""
+    from registro import configurar_registro
+    from servidor import ServidorInventario, ServidorMultiproceso
+
+    configurar_registro(nivel='INFO' if opciones.pop('log') else 'WARNING')
+    sys.stdout = open(os.devnull, 'w')  # Sin banner en la salida del benchmark
+    procesos = opciones.pop('procesos')
+    if procesos > 1:
+        servidor = ServidorMultiproceso(procesos, host='127.0.0.1', puerto=0, **opciones)
+    else:
+        servidor = ServidorInventario(host='127.0.0.1', puerto=0, **opciones)
+    threading.Thread(
+        target=lambda: cola.put(servidor.puerto if servidor.listo.wait(30) else None),
+        daemon=True).start()
+    servidor.iniciar()
+
+
+def iniciar_servidor(args, directorio):
+    """Inicia el servidor en otro proceso y devuelve (proceso, puerto)"""
+    extension = '.db' if args.almacenamiento == 'sqlite' else '.json'
+    opciones = {
+        'archivo_datos': os.path.join(directorio, 'inventario' + extension),
+        'almacenamiento': args.almacenamiento,
+        'modo_persistencia': args.persistencia,
+        'durabilidad': args.durabilidad,
+        'ventana_ms': args.ventana_ms,
+        'agrupar_cada': args.agrupar_cada,
+        'modo_servidor': args.modo,
+        'procesos': args.procesos,
+        'log': args.log
+    }
+    cola = multiprocessing.Queue()
+    # Un proceso daemon no puede iniciar los procesos del modo multiproceso;
+    # el benchmark lo termina igualmente al salir
+    proceso = multiprocessing.Process(
+        target=ejecutar_servidor, args=(opciones, cola), daemon=args.procesos == 1)
+    proceso.start()
+    puerto = cola.get(timeout=60)
+    if puerto is None:
+        proceso.terminate()
+        raise RuntimeError("El servidor no inició a tiempo")
+    return proceso, puerto
+
+
+def cargar_inventario(puerto, cantidad, formato):
+    """Registra la cantidad indicada de equipos en lotes"""
+    conexion = ConexionInventario('127.0.0.1', puerto, timeout=300,
+                                  formato=formato, comprimir=formato != 'json')
+    try:
+        for inicio in range(0, cantidad, TAMANO_LOTE_CARGA):
+            fin = min(inicio + TAMANO_LOTE_CARGA, cantidad)
+            conexion.solicitar({'accion': 'lote', 'solicitudes': [
+                solicitud_registrar(f'BASE{i:07d}', i) for i in range(inicio, fin)]})
+    finally:
+        conexion.cerrar()
+
+
+def solicitud_registrar(codigo, i):
+    """Solicitud de registro de un equipo de prueba"""
+    return {
+        'accion': 'registrar',
+        'codigo': codigo,
+        'nombre': f'{TIPOS[i % len(TIPOS)]} de laboratorio {i}',
+        'tipo': TIPOS[i % len(TIPOS)],
+        'estado': ESTADOS[i % len(ESTADOS)]
+    }
+
+
+class Trabajador(threading.Thread):
+    """Cliente que envía operaciones aleatorias según la mezcla"""
+
+    def __init__(self, numero, puerto, args, pesos, fin):
+        super().__init__(daemon=True)
+        self.numero = numero
+        self.args = args
+        self.fin = fin
+        self.random = random.Random(args.semilla + numero)
+        self.operaciones = list(pesos)
+        self.pesos = list(pesos.values())
+        self.conexion = ConexionInventario(
+            '127.0.0.1', puerto, timeout=30, formato=args.formato,
+            comprimir=args.formato != 'json')
+        self.latencias = {operacion: [] for operacion in OPERACIONES}
+        self.errores = {operacion: 0 for operacion in OPERACIONES}
+        self.registrados = 0
+
+    def solicitud(self, operacion):
+        """Arma una solicitud aleatoria de la operación indicada"""
+        if operacion == 'registrar':
+            self.registrados += 1
+            return solicitud_registrar(
+                f'B{self.numero:03d}-{self.registrados:07d}', self.registrados)
+        codigo = f'BASE{self.random.randrange(max(self.args.equipos, 1)):07d}'
+        if operacion == 'buscar':
+            return {'accion': 'buscar', 'codigo': codigo}
+        if operacion == 'actualizar':
+            return {'accion': 'actualizar', 'codigo': codigo,
+                    'estado': self.random.choice(ESTADOS)}
+        paginas = max(self.args.equipos // TAMANO_PAGINA, 1)
+        return {'accion': 'consultar', 'limite': TAMANO_PAGINA,
+                'cursor': str(self.random.randrange(paginas) * TAMANO_PAGINA)}
+
+    def run(self):
+        while not self.fin.is_set():
+            operacion = self.random.choices(self.operaciones, self.pesos)[0]
+            solicitud = self.solicitud(operacion)
+            inicio = time.perf_counter()
+            try:
+                respuesta = self.conexion.solicitar(solicitud)
+            except ErrorComunicacion:
+                self.errores[operacion] += 1
+                continue
+            self.latencias[operacion].append(
+                (time.perf_counter() - inicio) * 1000)
+            if respuesta.get('resultado') != 'ok':
+                self.errores[operacion] += 1
+        self.conexion.cerrar()
+
+
+def ejecutar_benchmark(args):
+    """Ejecuta el benchmark y devuelve el diccionario de resultados"""
+    pesos = parsear_mezcla(args.mezcla)
+    directorio = tempfile.mkdtemp(prefix='benchmark_inventario_')
+    proceso = None
+    try:
+        proceso, puerto = iniciar_servidor(args, directorio)
+        print(f"Servidor en el puerto {puerto}; cargando {args.equipos} equipos...")
+        cargar_inventario(puerto, args.equipos, args.formato)
+
+        fin = threading.Event()
+        trabajadores = [Trabajador(n, puerto, args, pesos, fin)
+                        for n in range(args.clientes)]
+        if args.calentamiento:
+            # Conectar y negociar el formato fuera de la medición
+            for trabajador in trabajadores:
+                trabajador.conexion.abrir()
+
+        print(f"Midiendo {args.duracion} s con {args.clientes} clientes...")
+        inicio = time.perf_counter()
+        for trabajador in trabajadores:
+            trabajador.start()
+        time.sleep(args.duracion)
+        fin.set()
+        for trabajador in trabajadores:
+            trabajador.join(60)
+        duracion = time.perf_counter() - inicio
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.join(10)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    resultados = {}
+    todas = []
+    errores_totales = 0
+    for operacion in pesos:
+        latencias = [l for t in trabajadores for l in t.latencias[operacion]]
+        errores = sum(t.errores[operacion] for t in trabajadores)
+        resultados[operacion] = resumir(latencias, errores, duracion)
+        todas.extend(latencias)
+        errores_totales += errores
+    resultados['total'] = resumir(todas, errores_totales, duracion)
+
+    return {
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'configuracion': {
+            'clientes': args.clientes,
+            'equipos': args.equipos,
+            'duracion_s': args.duracion,
+            'mezcla': pesos,
+            'modo': args.modo,
+            'procesos': args.procesos,
+            'almacenamiento': args.almacenamiento,
+            'persistencia': args.persistencia,
+            'durabilidad': args.durabilidad,
+            'ventana_ms': args.ventana_ms,
+            'agrupar_cada': args.agrupar_cada,
+            'formato': args.formato,
+            'log': args.log,
+            'python': sys.version.split()[0]
+        },
+        'resultados': resultados
+    }
+
+
+def mostrar_resultados(datos):
+    """Imprime la tabla de resultados"""
+    print(f"\n{'='*78}")
+    print(f"{'Operación':<12}{'ops':>10}{'ops/s':>11}{'p50 ms':>10}"
+          f"{'p99 ms':>10}{'p999 ms':>10}{'errores':>10}")
+    print(f"{'-'*78}")
+    for operacion, r in datos['resultados'].items():
+        print(f"{operacion:<12}{r['operaciones']:>10}{r['ops_s']:>11.1f}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['p999_ms']:>10.3f}"
+              f"{r['errores']:>10}")
+    print(f"{'='*78}\n")
+
+
+def comparar(actual, base, tolerancia):
+    """Compara con una ejecución anterior; devuelve las regresiones"""
+    regresiones = []
+    print(f"Comparación con la ejecución del {base.get('fecha', '?')} "
+          f"(tolerancia {tolerancia:.0f}%):")
+    for operacion, r in actual['resultados'].items():
+        anterior = base.get('resultados', {}).get(operacion)
+        if not anterior:
+            continue
+        cambios = []
+        for metrica, mayor_es_mejor in (('ops_s', True), ('p99_ms', False)):
+            previo, nuevo = anterior[metrica], r[metrica]
+            if not previo:
+                continue
+            variacion = (nuevo - previo) / previo * 100
+            cambios.append(f"{metrica} {previo} -> {nuevo} ({variacion:+.1f}%)")
+            empeora = -variacion if mayor_es_mejor else variacion
+            if empeora > tolerancia:
+                regresiones.append(f"{operacion}: {metrica} {variacion:+.1f}%")
+        print(f"  {operacion:<12}" + ", ".join(cambios))
+    return regresiones
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark de carga y latencia del servidor de inventario")
+    parser.add_argument('--clientes', type=int, default=8,
+                        help="Clientes concurrentes, cada uno con su conexión")
+    parser.add_argument('--equipos', type=int, default=10000,
+                        help="Equipos cargados antes de medir")
+    parser.add_argument('--duracion', type=float, default=10,
+                        help="Segundos de medición")
+    parser.add_argument('--mezcla', default=MEZCLA_POR_DEFECTO,
+                        help="Pesos por operación, p. ej. buscar=70,registrar=30")
+    parser.add_argument('--modo', choices=['hilos', 'asyncio'], default='hilos',
+                        help="Motor de conexiones del servidor")
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="Procesos del servidor (SO_REUSEPORT, requiere sqlite)")
+    parser.add_argument('--almacenamiento', choices=['json', 'sqlite', 'memoria'],
+                        default='json', help="Almacenamiento del servidor")
+    parser.add_argument('--persistencia', choices=['completo', 'journal'],
+                        default='journal', help="Modo de persistencia JSON")
+    parser.add_argument('--durabilidad', choices=['sincrona', 'disco', 'memoria'],
+                        default='sincrona', help="Durabilidad del almacenamiento JSON")
+    parser.add_argument('--ventana-ms', type=float, default=0,
+                        help="Ventana de la escritura agrupada del servidor")
+    parser.add_argument('--agrupar-cada', type=int, default=100,
+                        help="Cambios que disparan la escritura agrupada sin esperar la ventana")
+    parser.add_argument('--formato', choices=['json', 'compacto'], default='json',
+                        help="Formato de los mensajes")
+    parser.add_argument('--log', action='store_true',
+                        help="Mantener el log INFO del servidor por solicitud")
+    parser.add_argument('--sin-calentamiento', dest='calentamiento',
+                        action='store_false',
+                        help="No abrir las conexiones antes de medir")
+    parser.add_argument('--semilla', type=int, default=1,
+                        help="Semilla de la mezcla aleatoria")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar los resultados")
+    parser.add_argument('--comparar', help="Resultados anteriores para comparar")
+    parser.add_argument('--tolerancia', type=float, default=10,
+                        help="Porcentaje de empeoramiento aceptado al comparar")
+    args = parser.parse_args()
+    if args.procesos > 1 and args.almacenamiento != 'sqlite':
+        parser.error("--procesos mayor que 1 requiere --almacenamiento sqlite")
+
+    datos = ejecutar_benchmark(args)
+    mostrar_resultados(datos)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, indent=4, ensure_ascii=False)
+        print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(datos, base, args.tolerancia)
+        if regresiones:
+            print("\n❌ Regresiones: " + "; ".join(regresiones))
+            return 1
+        print("\n✅ Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
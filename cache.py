@@ -0,0 +1,84 @@
+"""
+Caché de respuestas ya codificadas para consultas repetidas
+
+Guarda los bytes que se envían al cliente, así una consulta o búsqueda
+repetida se responde sin volver a armar ni codificar la respuesta: solo
+se copian los bytes al socket. Las claves incluyen el formato de la
+conexión. Registrar o actualizar un equipo descarta las búsquedas de ese
+código y las consultas del inventario; las búsquedas de otros códigos
+siguen valiendo. El tamaño se acota en bytes descartando las entradas
+usadas hace más tiempo.
+"""
+
+import collections
+import threading
+
+TAMANO_CACHE_RESPUESTAS = 64 * 1024 * 1024  # Bytes de respuestas guardadas
+
+
+class CacheRespuestas:
+    """LRU de respuestas codificadas, acotada en bytes y segura para varios hilos"""
+
+    def __init__(self, capacidad=TAMANO_CACHE_RESPUESTAS, metricas=None):
+        self.capacidad = capacidad  # 0 desactiva la caché
+        self.metricas = metricas
+        self.ocupado = 0  # Bytes guardados
+        # Cambia con cada invalidación: una respuesta armada mientras se
+        # modificaba el inventario no se guarda
+        self.generacion = 0
+        self._entradas = collections.OrderedDict()  # clave -> (bytes, código)
+        self._claves_por_codigo = {}  # código (None: consultas) -> claves
+        self._lock = threading.Lock()
+
+    def activa(self):
+        """Indica si la caché guarda respuestas"""
+        return self.capacidad > 0
+
+    def total(self):
+        """Cantidad de respuestas guardadas"""
+        return len(self._entradas)
+
+    def obtener(self, clave):
+        """Devuelve los bytes guardados con esa clave, o None"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+        if self.metricas is not None:
+            self.metricas.registrar_cache(entrada is not None)
+        return entrada[0] if entrada is not None else None
+
+    def guardar(self, clave, datos, generacion, codigo=None):
+        """Guarda los bytes de una respuesta si nada la invalidó desde 'generacion'
+
+        'codigo' es el equipo del que depende una búsqueda; None indica
+        que la respuesta depende de todo el inventario.
+        """
+        tamano = len(datos)
+        if tamano > self.capacidad // 2:
+            return  # Una sola respuesta no vacía la caché
+        with self._lock:
+            if generacion != self.generacion or clave in self._entradas:
+                return
+            self._entradas[clave] = (datos, codigo)
+            self._claves_por_codigo.setdefault(codigo, set()).add(clave)
+            self.ocupado += tamano
+            while self.ocupado > self.capacidad:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar(self, codigo):
+        """Descarta lo que depende de un equipo que cambió"""
+        with self._lock:
+            self.generacion += 1
+            for grupo in (None, codigo):
+                for clave in list(self._claves_por_codigo.get(grupo, ())):
+                    self._quitar(clave)
+
+    def _quitar(self, clave):
+        """Elimina una entrada (requiere el lock)"""
+        datos, codigo = self._entradas.pop(clave)
+        self.ocupado -= len(datos)
+        claves = self._claves_por_codigo[codigo]
+        claves.discard(clave)
+        if not claves:
+            del self._claves_por_codigo[codigo]
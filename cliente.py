@@ -1,6 +1,288 @@
 import socket
-import json
 import sys
+import queue
+import threading
+from contextlib import contextmanager
+
+from protocolo import Codificador, LectorMensajes, enviar_mensaje
+
+# Acciones sin efectos: se pueden reintentar si la conexión falla
+ACCIONES_LECTURA = {'consultar', 'buscar', 'filtrar', 'buscar_texto', 'cambios_desde',
+                    'historial', 'utilizacion', 'estadisticas'}
+
+
+class ErrorComunicacion(Exception):
+    """Falla de red o de protocolo al hablar con el servidor"""
+
+    def __init__(self, mensaje, enviada=False):
+        super().__init__(mensaje)
+        self.enviada = enviada  # La solicitud alcanzó a enviarse completa
+
+
+class ConexionInventario:
+    """Conexión al servidor para uso desde código (un hilo a la vez)
+
+    A diferencia de ClienteInventario, no imprime nada: las fallas de red
+    se lanzan como ErrorComunicacion y la conexión queda cerrada.
+    """
+
+    def __init__(self, host='localhost', puerto=5555, timeout=10,
+                 formato='compacto', comprimir=True):
+        self.host = host
+        self.puerto = puerto
+        self.timeout = timeout
+        self.formato = formato
+        self.comprimir = comprimir
+        self.socket = None
+        self.lector = None
+        self.codificador = Codificador()
+
+    @property
+    def abierta(self):
+        """Indica si la conexión está abierta"""
+        return self.socket is not None
+
+    def abrir(self):
+        """Conecta con el servidor y negocia el formato"""
+        try:
+            self.socket = socket.create_connection(
+                (self.host, self.puerto), timeout=self.timeout)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Detectar conexiones muertas que quedan en el pool sin uso
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except OSError as e:
+            self.socket = None
+            raise ErrorComunicacion(
+                f"No se pudo conectar a {self.host}:{self.puerto}: {e}")
+        self.lector = LectorMensajes(self.socket)
+        self.codificador = Codificador()
+
+        if self.formato != 'json' or self.comprimir:
+            respuesta = self.solicitar({
+                'accion': 'negociar',
+                'formato': self.formato,
+                'comprimir': self.comprimir
+            })
+            # Un servidor que no lo soporta sigue en JSON
+            if respuesta['resultado'] == 'ok':
+                self.codificador = Codificador(
+                    respuesta['formato'], respuesta['comprimir'])
+
+    def cerrar(self):
+        """Cierra la conexión"""
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+        self.lector = None
+
+    def enviar(self, solicitud):
+        """Envía una solicitud sin esperar la respuesta"""
+        if self.socket is None:
+            self.abrir()
+        try:
+            enviar_mensaje(self.socket, self.codificador.codificar(solicitud))
+        except OSError as e:
+            self.cerrar()
+            raise ErrorComunicacion(f"Error al enviar: {e}")
+
+    def recibir(self):
+        """Recibe la siguiente respuesta del servidor"""
+        try:
+            data = self.lector.leer()
+            if data is None:
+                raise ConnectionError("El servidor cerró la conexión")
+            return self.codificador.decodificar(data)
+        except (OSError, ValueError) as e:
+            self.cerrar()
+            raise ErrorComunicacion(f"Error al recibir: {e}", enviada=True)
+
+    def solicitar(self, solicitud):
+        """Envía una solicitud y devuelve su respuesta"""
+        self.enviar(solicitud)
+        return self.recibir()
+
+    def suscribir(self, estado=None, tipo=None):
+        """Se suscribe a los cambios del inventario, opcionalmente filtrados
+
+        Si la respuesta es 'ok' la conexión queda dedicada a la
+        suscripción y los cambios se leen con eventos().
+        """
+        solicitud = {'accion': 'suscribir'}
+        if estado is not None:
+            solicitud['estado'] = estado
+        if tipo is not None:
+            solicitud['tipo'] = tipo
+        return self.solicitar(solicitud)
+
+    def eventos(self):
+        """Genera los eventos de la suscripción a medida que llegan, sin latidos"""
+        while True:
+            evento = self.recibir()
+            if evento.get('evento') == 'latido':
+                continue
+            yield evento
+            if evento.get('evento') == 'desbordado':
+                return  # El servidor cierra la suscripción
+
+
+class PoolConexiones:
+    """Cliente thread-safe que reparte un número acotado de conexiones
+
+    Cada solicitud toma una conexión libre (o abre una nueva si no se
+    llegó al máximo) y la devuelve al terminar. Las conexiones caídas se
+    descartan y se vuelven a abrir; las consultas se reintentan.
+    """
+
+    def __init__(self, host='localhost', puerto=5555, tamano=4, timeout=10,
+                 espera=30, reintentos=1, formato='compacto', comprimir=True):
+        self.host = host
+        self.puerto = puerto
+        self.timeout = timeout  # Para conectar y para cada respuesta
+        self.espera = espera  # Máximo a esperar por una conexión libre
+        self.reintentos = reintentos
+        self.formato = formato
+        self.comprimir = comprimir
+        self._libres = queue.LifoQueue()  # La más reciente sigue "caliente"
+        self._cupos = threading.BoundedSemaphore(tamano)
+        self._cerrado = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión de uso exclusivo mientras dure el bloque"""
+        if self._cerrado:
+            raise ErrorComunicacion("El pool está cerrado")
+        if not self._cupos.acquire(timeout=self.espera):
+            raise ErrorComunicacion("No hay conexiones disponibles")
+        try:
+            try:
+                conexion = self._libres.get_nowait()
+            except queue.Empty:
+                conexion = ConexionInventario(
+                    self.host, self.puerto, self.timeout,
+                    self.formato, self.comprimir)
+            try:
+                yield conexion
+            except BaseException:
+                # Puede haber quedado una respuesta a medio leer
+                conexion.cerrar()
+                raise
+            if conexion.abierta and not self._cerrado:
+                self._libres.put(conexion)
+            else:
+                conexion.cerrar()
+        finally:
+            self._cupos.release()
+
+    def solicitar(self, solicitud):
+        """Envía una solicitud por una conexión del pool y devuelve la respuesta"""
+        accion = str(solicitud.get('accion', '')).lower()
+        intento = 0
+        while True:
+            try:
+                with self.conexion() as conexion:
+                    return conexion.solicitar(solicitud)
+            except ErrorComunicacion as e:
+                # Si una conexión se cayó (p. ej. el servidor se reinició)
+                # las demás libres probablemente también
+                self.descartar_libres()
+                # Una escritura que ya llegó al servidor no se repite
+                if intento >= self.reintentos or (
+                        e.enviada and accion not in ACCIONES_LECTURA):
+                    raise
+                intento += 1
+
+    def cerrar(self):
+        """Cierra las conexiones libres; las prestadas se cierran al devolverse"""
+        self._cerrado = True
+        self.descartar_libres()
+
+    def descartar_libres(self):
+        """Cierra las conexiones que no están prestadas"""
+        while True:
+            try:
+                self._libres.get_nowait().cerrar()
+            except queue.Empty:
+                break
+
+    def registrar(self, codigo, nombre, tipo, estado='disponible'):
+        """Registra un nuevo equipo"""
+        return self.solicitar({'accion': 'registrar', 'codigo': codigo,
+                               'nombre': nombre, 'tipo': tipo, 'estado': estado})
+
+    def consultar(self, limite=None, cursor=None):
+        """Consulta todos los equipos, o una página si se indica límite o cursor"""
+        solicitud = {'accion': 'consultar'}
+        if limite is not None:
+            solicitud['limite'] = limite
+        if cursor is not None:
+            solicitud['cursor'] = cursor
+        return self.solicitar(solicitud)
+
+    def consultar_en_flujo(self, tamano_bloque=500):
+        """Genera los bloques de una consulta; la conexión queda ocupada hasta el final"""
+        with self.conexion() as conexion:
+            conexion.enviar({'accion': 'consultar', 'flujo': True,
+                             'tamano_bloque': tamano_bloque})
+            while True:
+                respuesta = conexion.recibir()
+                yield respuesta
+                if respuesta.get('fin', True):
+                    break
+
+    def buscar(self, codigo):
+        """Busca un equipo por código"""
+        return self.solicitar({'accion': 'buscar', 'codigo': codigo})
+
+    def actualizar(self, codigo, estado):
+        """Actualiza el estado de un equipo"""
+        return self.solicitar({'accion': 'actualizar', 'codigo': codigo,
+                               'estado': estado})
+
+    def filtrar(self, **filtros):
+        """Filtra por estado, tipo, fecha_desde y fecha_hasta"""
+        return self.solicitar(dict(filtros, accion='filtrar'))
+
+    def buscar_texto(self, texto, limite=None):
+        """Busca equipos por palabras de su nombre y tipo"""
+        solicitud = {'accion': 'buscar_texto', 'texto': texto}
+        if limite is not None:
+            solicitud['limite'] = limite
+        return self.solicitar(solicitud)
+
+    def cambios_desde(self, version, limite=None):
+        """Equipos creados o modificados después de una versión"""
+        solicitud = {'accion': 'cambios_desde', 'version': version}
+        if limite is not None:
+            solicitud['limite'] = limite
+        return self.solicitar(solicitud)
+
+    def historial(self, codigo=None, **filtros):
+        """Cambios de estado; filtros: fecha_desde, fecha_hasta, limite, cursor"""
+        solicitud = dict(filtros, accion='historial')
+        if codigo is not None:
+            solicitud['codigo'] = codigo
+        return self.solicitar(solicitud)
+
+    def utilizacion(self, codigo=None, **rango):
+        """Tiempo en cada estado de un equipo (o de todos); rango: fecha_desde, fecha_hasta"""
+        solicitud = dict(rango, accion='utilizacion')
+        if codigo is not None:
+            solicitud['codigo'] = codigo
+        return self.solicitar(solicitud)
+
+    def lote(self, solicitudes):
+        """Envía varias solicitudes en un solo mensaje"""
+        return self.solicitar({'accion': 'lote',
+                               'solicitudes': list(solicitudes)})
 
 
 class ClienteInventario:
@@ -8,12 +290,16 @@ class ClienteInventario:
         self.host = host
         self.puerto = puerto
         self.socket = None
+        self.lector = None
+        self.codificador = Codificador()  # JSON hasta que se negocie
 
     def conectar(self):
         """Establece conexión con el servidor"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.puerto))
+            self.lector = LectorMensajes(self.socket)
+            self.codificador = Codificador()
             return True
         except ConnectionRefusedError:
             print(
@@ -33,18 +319,68 @@ class ClienteInventario:
         """Envía una solicitud al servidor y recibe la respuesta"""
         try:
             # Enviar solicitud
-            mensaje_json = json.dumps(solicitud, ensure_ascii=False)
-            self.socket.sendall(mensaje_json.encode('utf-8'))
+            enviar_mensaje(self.socket, self.codificador.codificar(solicitud))
 
-            # Recibir respuesta
-            data = self.socket.recv(4096)
-            respuesta = json.loads(data.decode('utf-8'))
+            # Recibir respuesta completa
+            return self.recibir_respuesta()
+
+        except Exception as e:
+            print(f"\nError en la comunicación: {e}")
+            return None
 
-            return respuesta
+    def recibir_respuesta(self):
+        """Recibe el siguiente mensaje de respuesta del servidor"""
+        data = self.lector.leer()
+        if data is None:
+            raise ConnectionError("El servidor cerró la conexión")
+        return self.codificador.decodificar(data)
+
+    def negociar(self, formato='compacto', comprimir=True):
+        """Acuerda con el servidor un formato más compacto para esta conexión
+
+        Devuelve False si el servidor no lo soporta; la conexión sigue en JSON.
+        """
+        respuesta = self.enviar_solicitud({
+            'accion': 'negociar',
+            'formato': formato,
+            'comprimir': comprimir
+        })
+        if respuesta is None or respuesta['resultado'] != 'ok':
+            return False
+        self.codificador = Codificador(
+            respuesta['formato'], respuesta['comprimir'])
+        return True
+
+    def consultar_en_flujo(self, tamano_bloque=500):
+        """Genera los bloques de una consulta a medida que llegan"""
+        try:
+            enviar_mensaje(self.socket, self.codificador.codificar({
+                'accion': 'consultar',
+                'flujo': True,
+                'tamano_bloque': tamano_bloque
+            }))
+
+            while True:
+                respuesta = self.recibir_respuesta()
+                yield respuesta
+                if respuesta.get('fin', True):
+                    break
 
         except Exception as e:
             print(f"\nError en la comunicación: {e}")
+
+    def enviar_lote(self, solicitudes):
+        """Envía varias solicitudes en un solo mensaje y devuelve sus respuestas"""
+        respuesta = self.enviar_solicitud({
+            'accion': 'lote',
+            'solicitudes': list(solicitudes)
+        })
+        if respuesta is None:
+            return None
+        if respuesta['resultado'] != 'ok':
+            print(f"\nError: {respuesta['mensaje']}")
             return None
+        return respuesta['respuestas']
 
     def registrar_equipo(self):
         """Captura datos y registra un nuevo equipo"""
@@ -99,26 +435,23 @@ class ClienteInventario:
         print("LISTA DE EQUIPOS")
         print("="*60)
 
-        # Crear solicitud
-        solicitud = {'accion': 'consultar'}
-
-        # Enviar solicitud
-        respuesta = self.enviar_solicitud(solicitud)
-
-        # Mostrar respuesta
-        if respuesta:
-            if respuesta['resultado'] == 'ok':
-                equipos = respuesta.get('equipos', [])
+        # Recibir la consulta por bloques y mostrar cada uno al llegar
+        i = 0
+        for respuesta in self.consultar_en_flujo():
+            if respuesta['resultado'] != 'ok':
+                print(f"\nError: {respuesta['mensaje']}")
+                break
 
-                if not equipos:
+            if i == 0:
+                if not respuesta['total']:
                     print("\nNo hay equipos registrados en el inventario.")
-                else:
-                    print(f"\n{respuesta['mensaje']}\n")
-                    for i, equipo in enumerate(equipos, 1):
-                        print(f"\n--- Equipo #{i} ---")
-                        self.mostrar_equipo(equipo)
-            else:
-                print(f"\nError: {respuesta['mensaje']}")
+                    break
+                print(f"\n{respuesta['mensaje']}\n")
+
+            for equipo in respuesta['equipos']:
+                i += 1
+                print(f"\n--- Equipo #{i} ---")
+                self.mostrar_equipo(equipo)
 
     def buscar_equipo(self):
         """Busca un equipo por código"""
@@ -222,6 +555,7 @@ class ClienteInventario:
             return
 
         print(f"Conectado exitosamente al servidor\n")
+        self.negociar()
 
         try:
             while True:
@@ -0,0 +1,241 @@
+"""
+Cliente asyncio del inventario de equipos
+
+Cada conexión admite muchas solicitudes en vuelo: se envían sin esperar
+la respuesta anterior y, como el servidor responde en orden por conexión,
+cada respuesta se asigna a la solicitud más antigua pendiente.
+"""
+
+import asyncio
+import collections
+import socket
+
+from cliente import ErrorComunicacion
+from protocolo import Codificador, empaquetar_mensaje, leer_mensaje_async
+
+
+class ConexionAsync:
+    """Una conexión con solicitudes encoladas en orden de envío"""
+
+    def __init__(self, host, puerto, formato='compacto', comprimir=True):
+        self.host = host
+        self.puerto = puerto
+        self.formato = formato
+        self.comprimir = comprimir
+        self.reader = None
+        self.writer = None
+        self.codificador = Codificador()
+        self.pendientes = collections.deque()  # Futuros en orden de envío
+        self._lector = None
+        self._abriendo = None
+        self._lista = False  # Conectada y con el formato ya negociado
+
+    @property
+    def abierta(self):
+        """Indica si la conexión está lista para enviar solicitudes"""
+        return self._lista
+
+    async def abrir(self):
+        """Conecta y negocia el formato; llamadas concurrentes esperan la misma apertura"""
+        if self.abierta:
+            return
+        if self._abriendo is None:
+            self._abriendo = asyncio.ensure_future(self._abrir())
+        try:
+            await asyncio.shield(self._abriendo)
+        finally:
+            if self._abriendo is not None and self._abriendo.done():
+                self._abriendo = None
+
+    async def _abrir(self):
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.puerto)
+        except OSError as e:
+            raise ErrorComunicacion(
+                f"No se pudo conectar a {self.host}:{self.puerto}: {e}")
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.reader, self.writer = reader, writer
+        self.codificador = Codificador()
+        self._lector = asyncio.ensure_future(self.leer_respuestas())
+
+        if self.formato != 'json' or self.comprimir:
+            # Nadie más envía hasta terminar: el servidor cambia de formato
+            # justo después de esta respuesta
+            try:
+                respuesta = await self.solicitar({
+                    'accion': 'negociar',
+                    'formato': self.formato,
+                    'comprimir': self.comprimir
+                })
+            except BaseException:
+                self.cerrar()
+                raise
+            # Un servidor que no lo soporta sigue en JSON
+            if respuesta['resultado'] == 'ok':
+                self.codificador = Codificador(
+                    respuesta['formato'], respuesta['comprimir'])
+        self._lista = True
+
+    def enviar(self, solicitud):
+        """Envía la solicitud y devuelve el futuro de su respuesta"""
+        if self.writer is None:
+            raise ErrorComunicacion("Conexión cerrada")
+        futuro = asyncio.get_running_loop().create_future()
+        # Sin await entre escribir y encolar: el orden de envío y el de la
+        # cola de pendientes coinciden
+        self.pendientes.append(futuro)
+        try:
+            self.writer.write(empaquetar_mensaje(
+                self.codificador.codificar(solicitud)))
+        except OSError as e:
+            self.cerrar(ErrorComunicacion(f"Error al enviar: {e}"))
+        return futuro
+
+    async def solicitar(self, solicitud, timeout=None):
+        """Envía la solicitud y espera su respuesta"""
+        futuro = self.enviar(solicitud)
+        if self.writer is not None:
+            try:
+                await self.writer.drain()
+            except OSError as e:
+                self.cerrar(ErrorComunicacion(f"Error al enviar: {e}"))
+        try:
+            # Si se agota el tiempo el futuro queda cancelado y su
+            # respuesta, si llega, se descarta
+            return await asyncio.wait_for(futuro, timeout)
+        except asyncio.TimeoutError:
+            raise ErrorComunicacion("Tiempo de espera agotado", enviada=True)
+
+    async def leer_respuestas(self):
+        """Entrega cada respuesta recibida a la solicitud más antigua"""
+        try:
+            while True:
+                data = await leer_mensaje_async(self.reader)
+                if data is None:
+                    raise ConnectionError("El servidor cerró la conexión")
+                respuesta = self.codificador.decodificar(data)
+                futuro = self.pendientes.popleft()
+                if not futuro.done():  # Cancelado por timeout
+                    futuro.set_result(respuesta)
+        except asyncio.CancelledError:
+            self.cerrar(ErrorComunicacion("Conexión cerrada"))
+        except Exception as e:
+            self.cerrar(ErrorComunicacion(f"Error al recibir: {e}", enviada=True))
+
+    def cerrar(self, error=None):
+        """Cierra la conexión y hace fallar las solicitudes pendientes"""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self._lista = False
+        if self._lector is not None and self._lector is not asyncio.current_task():
+            self._lector.cancel()
+        self._lector = None
+        error = error or ErrorComunicacion("Conexión cerrada")
+        while self.pendientes:
+            futuro = self.pendientes.popleft()
+            if not futuro.done():
+                futuro.set_exception(error)
+
+
+class ClienteInventarioAsync:
+    """Cliente asyncio que reparte las solicitudes entre varias conexiones
+
+    Las fallas de red se lanzan como ErrorComunicacion; los errores de
+    validación llegan en la respuesta, igual que en el cliente síncrono.
+    """
+
+    def __init__(self, host='localhost', puerto=5555, conexiones=2,
+                 timeout=10, formato='compacto', comprimir=True):
+        self.timeout = timeout  # Máximo a esperar por cada respuesta
+        self.conexiones = [
+            ConexionAsync(host, puerto, formato, comprimir)
+            for _ in range(conexiones)]
+
+    async def __aenter__(self):
+        await self.conectar()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.cerrar()
+
+    async def conectar(self):
+        """Abre todas las conexiones"""
+        await asyncio.gather(*(c.abrir() for c in self.conexiones))
+
+    async def cerrar(self):
+        """Cierra todas las conexiones"""
+        for conexion in self.conexiones:
+            conexion.cerrar()
+        await asyncio.sleep(0)  # Dejar terminar a los lectores
+
+    async def solicitar(self, solicitud):
+        """Envía una solicitud por la conexión menos ocupada y devuelve la respuesta"""
+        conexion = min(self.conexiones, key=lambda c: len(c.pendientes))
+        if not conexion.abierta:
+            await conexion.abrir()
+        return await conexion.solicitar(solicitud, self.timeout)
+
+    async def registrar(self, codigo, nombre, tipo, estado='disponible'):
+        """Registra un nuevo equipo"""
+        return await self.solicitar({'accion': 'registrar', 'codigo': codigo,
+                                     'nombre': nombre, 'tipo': tipo,
+                                     'estado': estado})
+
+    async def consultar(self, limite=None, cursor=None):
+        """Consulta todos los equipos, o una página si se indica límite o cursor"""
+        solicitud = {'accion': 'consultar'}
+        if limite is not None:
+            solicitud['limite'] = limite
+        if cursor is not None:
+            solicitud['cursor'] = cursor
+        return await self.solicitar(solicitud)
+
+    async def buscar(self, codigo):
+        """Busca un equipo por código"""
+        return await self.solicitar({'accion': 'buscar', 'codigo': codigo})
+
+    async def actualizar(self, codigo, estado):
+        """Actualiza el estado de un equipo"""
+        return await self.solicitar({'accion': 'actualizar', 'codigo': codigo,
+                                     'estado': estado})
+
+    async def filtrar(self, **filtros):
+        """Filtra por estado, tipo, fecha_desde y fecha_hasta"""
+        return await self.solicitar(dict(filtros, accion='filtrar'))
+
+    async def buscar_texto(self, texto, limite=None):
+        """Busca equipos por palabras de su nombre y tipo"""
+        solicitud = {'accion': 'buscar_texto', 'texto': texto}
+        if limite is not None:
+            solicitud['limite'] = limite
+        return await self.solicitar(solicitud)
+
+    async def cambios_desde(self, version, limite=None):
+        """Equipos creados o modificados después de una versión"""
+        solicitud = {'accion': 'cambios_desde', 'version': version}
+        if limite is not None:
+            solicitud['limite'] = limite
+        return await self.solicitar(solicitud)
+
+    async def historial(self, codigo=None, **filtros):
+        """Cambios de estado; filtros: fecha_desde, fecha_hasta, limite, cursor"""
+        solicitud = dict(filtros, accion='historial')
+        if codigo is not None:
+            solicitud['codigo'] = codigo
+        return await self.solicitar(solicitud)
+
+    async def utilizacion(self, codigo=None, **rango):
+        """Tiempo en cada estado de un equipo (o de todos); rango: fecha_desde, fecha_hasta"""
+        solicitud = dict(rango, accion='utilizacion')
+        if codigo is not None:
+            solicitud['codigo'] = codigo
+        return await self.solicitar(solicitud)
+
+    async def lote(self, solicitudes):
+        """Envía varias solicitudes en un solo mensaje"""
+        return await self.solicitar({'accion': 'lote',
+                                     'solicitudes': list(solicitudes)})
@@ -0,0 +1,148 @@
+"""
+Eventos de cambios del inventario para clientes suscritos
+
+Cada suscripción tiene una cola acotada de eventos pendientes. Publicar
+solo agrega a esas colas (sin E/S), así que se puede hacer con el lock
+de escritura tomado y los eventos llegan en el orden de los cambios.
+Un suscriptor que no lee a tiempo llena su cola y la suscripción se
+cierra: debe volver a consultar el inventario y suscribirse de nuevo.
+"""
+
+import asyncio
+import collections
+import threading
+
+from almacenamiento import normalizar_tipo
+
+CAPACIDAD_SUSCRIPCION = 1000  # Eventos pendientes antes de cerrar la suscripción
+
+
+class Suscripcion:
+    """Eventos pendientes de un suscriptor, con filtros opcionales por estado y tipo"""
+
+    def __init__(self, estado=None, tipo=None, capacidad=CAPACIDAD_SUSCRIPCION,
+                 bucle=None):
+        self.estado = estado.lower() if estado else None
+        self.tipo = normalizar_tipo(tipo) if tipo else None
+        self.capacidad = capacidad
+        self.pendientes = collections.deque()
+        self.cerrada = False
+        self.desbordada = False
+        self._condicion = threading.Condition()
+        # En modo asyncio el suscriptor espera un asyncio.Event del bucle
+        self._bucle = bucle
+        self._aviso = asyncio.Event() if bucle is not None else None
+
+    def acepta(self, equipo, estado_anterior=None):
+        """Indica si el cambio de este equipo pasa los filtros
+
+        Con filtro de estado también se avisa cuando un equipo sale de
+        ese estado, para que el suscriptor pueda quitarlo de su vista.
+        """
+        if self.tipo is not None and normalizar_tipo(equipo['tipo']) != self.tipo:
+            return False
+        if self.estado is not None:
+            return self.estado in (equipo['estado'], estado_anterior)
+        return True
+
+    def agregar(self, evento):
+        """Encola un evento; si la cola está llena cierra la suscripción"""
+        with self._condicion:
+            if self.cerrada:
+                return
+            if len(self.pendientes) >= self.capacidad:
+                self.desbordada = True
+                self.cerrada = True
+            else:
+                self.pendientes.append(evento)
+            self._condicion.notify_all()
+        self.avisar()
+
+    def cerrar(self):
+        """Termina la suscripción y despierta a quien espera eventos"""
+        with self._condicion:
+            self.cerrada = True
+            self._condicion.notify_all()
+        self.avisar()
+
+    def avisar(self):
+        """Despierta al suscriptor asyncio, desde cualquier hilo"""
+        if self._bucle is not None:
+            try:
+                self._bucle.call_soon_threadsafe(self._aviso.set)
+            except RuntimeError:
+                pass  # El bucle ya terminó
+
+    def tomar_pendientes(self):
+        """Devuelve y vacía los eventos pendientes"""
+        with self._condicion:
+            eventos = list(self.pendientes)
+            self.pendientes.clear()
+            return eventos
+
+    def esperar(self, timeout):
+        """Espera eventos (o el cierre) hasta 'timeout' segundos y los devuelve"""
+        with self._condicion:
+            self._condicion.wait_for(
+                lambda: self.pendientes or self.cerrada, timeout)
+        return self.tomar_pendientes()
+
+    async def esperar_async(self, timeout):
+        """Como esperar(), sin bloquear el bucle de eventos"""
+        if not self.pendientes and not self.cerrada:
+            try:
+                await asyncio.wait_for(self._aviso.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._aviso.clear()
+        return self.tomar_pendientes()
+
+
+class PublicadorEventos:
+    """Reparte los cambios del inventario entre las suscripciones activas"""
+
+    def __init__(self):
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def total(self):
+        """Cantidad de suscripciones activas"""
+        return len(self._suscripciones)
+
+    def suscribir(self, estado=None, tipo=None, capacidad=CAPACIDAD_SUSCRIPCION,
+                  bucle=None):
+        """Crea y registra una suscripción"""
+        suscripcion = Suscripcion(estado, tipo, capacidad, bucle)
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        """Cierra una suscripción y deja de enviarle eventos"""
+        suscripcion.cerrar()
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def publicar(self, tipo_evento, equipo, estado_anterior=None):
+        """Entrega un cambio a las suscripciones cuyos filtros lo aceptan"""
+        if not self._suscripciones:
+            return  # Sin suscriptores publicar no cuesta nada
+        evento = {'evento': tipo_evento, 'equipo': equipo}
+        if estado_anterior is not None:
+            evento['estado_anterior'] = estado_anterior
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            if suscripcion.acepta(equipo, estado_anterior):
+                suscripcion.agregar(evento)
+            if suscripcion.cerrada:
+                with self._lock:
+                    self._suscripciones.discard(suscripcion)
+
+    def cerrar(self):
+        """Cierra todas las suscripciones (al detener el servidor)"""
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+            self._suscripciones.clear()
+        for suscripcion in suscripciones:
+            suscripcion.cerrar()
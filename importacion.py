@@ -0,0 +1,261 @@
+"""
+Importación y exportación masiva del inventario
+
+El cliente envía el archivo en bloques de líneas completas, en JSON por
+líneas o CSV, con la acción 'importar'. El servidor valida cada bloque
+al recibirlo y guarda las filas válidas en un archivo temporal, así la
+memoria no crece con el tamaño del archivo; con 'fin' las inserta todas
+en un solo lote (una sola escritura a disco o una sola transacción).
+Las filas con errores se informan por número de línea. 'exportar'
+devuelve el inventario en bloques de texto en los mismos formatos.
+
+Aquí está solo lo del servidor; el envío y la descarga de archivos desde
+el cliente están en transferencia.py.
+"""
+
+import csv
+import io
+import json
+import tempfile
+
+from almacenamiento import PATRON_FECHA
+
+FORMATOS_IMPORTACION = ['jsonl', 'csv']
+COLUMNAS_EXPORTACION = ['codigo', 'nombre', 'tipo', 'estado',
+                        'fecha_registro', 'ultima_actualizacion']
+CAMPOS_REQUERIDOS = ['codigo', 'nombre', 'tipo', 'estado']
+MAXIMO_ERRORES_INFORMADOS = 100  # Las demás filas con error solo se cuentan
+FILAS_POR_BLOQUE = 5000  # Filas por mensaje al importar o exportar
+MAXIMO_REGISTRO_CSV = 1024 * 1024  # Caracteres de un registro CSV de varias líneas
+
+
+def sigue_entre_comillas(linea, abiertas=False):
+    """Indica si un registro CSV sigue dentro de un campo entre comillas al final de la línea
+
+    Como csv.reader, una comilla solo abre un campo al principio de él;
+    en medio de un campo sin comillas es un carácter más.
+    """
+    if '"' not in linea:
+        return abiertas
+    posicion = 0
+    while True:
+        if not abiertas:
+            if linea.startswith('"', posicion):
+                abiertas = True
+                posicion += 1
+            else:
+                coma = linea.find(',', posicion)
+                if coma < 0:
+                    return False
+                posicion = coma + 1
+                continue
+        comilla = linea.find('"', posicion)
+        if comilla < 0:
+            return True
+        if linea.startswith('"', comilla + 1):
+            posicion = comilla + 2  # Comilla duplicada dentro del campo
+            continue
+        # Campo cerrado: lo que sigue hasta la coma también es parte de él
+        abiertas = False
+        coma = linea.find(',', comilla + 1)
+        if coma < 0:
+            return False
+        posicion = coma + 1
+
+
+class Importacion:
+    """Importación en curso en una conexión: filas validadas y errores por fila"""
+
+    def __init__(self, formato, validar):
+        if formato not in FORMATOS_IMPORTACION:
+            raise ValueError(
+                f"Formato inválido. Debe ser uno de: {', '.join(FORMATOS_IMPORTACION)}")
+        self.formato = formato
+        self.validar = validar  # Función que devuelve (es_valido, mensaje)
+        self.columnas = None  # Encabezado del CSV
+        self._pendiente = ''  # Registro CSV con comillas abiertas al final del bloque
+        self.filas = 0  # Líneas recibidas, incluido el encabezado
+        self.validas = 0
+        self.errores = 0
+        self.detalle_errores = []
+        self._validas = tempfile.TemporaryFile('w+', encoding='utf-8')
+
+    def agregar(self, texto):
+        """Valida las filas de un bloque y guarda las válidas
+
+        Solo '\\n' separa líneas: json.dumps deja sin escapar otros
+        separadores (U+2028, U+0085) dentro de los textos. Lanza
+        ValueError si el encabezado del CSV no sirve.
+        """
+        if self.formato == 'csv':
+            self.agregar_csv(texto)
+            return
+        lineas = texto.split('\n')
+        if lineas[-1] == '':
+            lineas.pop()  # El bloque termina con un salto de línea
+        for linea in lineas:
+            self.filas += 1
+            if not linea.strip():
+                continue
+            self.guardar_fila(self.filas, *self.parsear_fila(linea))
+
+    def agregar_csv(self, texto):
+        """Lee los registros CSV completos; uno con comillas abiertas sigue en el próximo bloque
+
+        Un campo entre comillas puede tener saltos de línea: un registro
+        termina en la primera línea que no deja un campo entre comillas
+        abierto. Si pasa de MAXIMO_REGISTRO_CSV, su primera línea se
+        informa como error y la lectura sigue desde la siguiente.
+        """
+        lineas = (self._pendiente + texto).split('\n')
+        resto = lineas.pop()  # Lo que sigue al último salto de línea
+        inicio = 0  # Primera línea del registro abierto
+        abiertas = False
+        tamano = 0
+        indice = 0
+        while indice < len(lineas):
+            abiertas = sigue_entre_comillas(lineas[indice], abiertas)
+            tamano += len(lineas[indice]) + 1
+            indice += 1
+            if not abiertas:
+                inicio = indice
+                tamano = 0
+            elif tamano > MAXIMO_REGISTRO_CSV:
+                # Las líneas anteriores ocupan una fila del lector cada una
+                self.anotar_error(self.filas + inicio + 1, "Campo entre comillas sin cerrar")
+                lineas[inicio] = ''
+                inicio = indice = inicio + 1
+                abiertas = False
+                tamano = 0
+        if resto and inicio == len(lineas) and not sigue_entre_comillas(resto):
+            lineas.append(resto)  # Última línea del archivo, sin salto final
+            inicio += 1
+            resto = ''
+        self._pendiente = '\n'.join(lineas[inicio:] + [resto])
+
+        lineas = iter(lineas[:inicio])
+        while True:
+            # Un solo lector para todo el bloque; si falla un registro se
+            # anota y otro lector sigue desde la línea siguiente
+            base = self.filas
+            lector = csv.reader(linea + '\n' for linea in lineas)
+            try:
+                for valores in lector:
+                    fila = self.filas + 1
+                    self.filas = base + lector.line_num
+                    if not valores or (len(valores) == 1 and not valores[0].strip()):
+                        continue
+                    if self.columnas is None:
+                        self.leer_encabezado(valores)
+                        continue
+                    if len(valores) != len(self.columnas):
+                        self.anotar_error(fila, f"Se esperaban {len(self.columnas)} columnas y hay {len(valores)}")
+                        continue
+                    self.guardar_fila(fila, dict(zip(self.columnas, valores)), None)
+                return
+            except csv.Error as e:
+                fila = self.filas + 1
+                self.filas = base + lector.line_num
+                self.anotar_error(fila, f"CSV inválido: {e}")
+
+    def terminar(self):
+        """Cierra la lectura: un registro que quedó con comillas abiertas es un error
+
+        Se informa su primera línea y las siguientes se vuelven a leer.
+        """
+        while self._pendiente.strip():
+            lineas = self._pendiente.split('\n')
+            self._pendiente = ''
+            self.filas += 1
+            self.anotar_error(self.filas, "Campo entre comillas sin cerrar")
+            self.agregar_csv('\n'.join(lineas[1:]))
+        self._pendiente = ''
+
+    def leer_encabezado(self, valores):
+        """Toma los nombres de columna del primer registro del CSV"""
+        columnas = [columna.strip().lower() for columna in valores]
+        faltantes = [campo for campo in CAMPOS_REQUERIDOS if campo not in columnas]
+        if faltantes:
+            raise ValueError(
+                f"Al encabezado del CSV le faltan columnas: {', '.join(faltantes)}")
+        self.columnas = columnas
+
+    def parsear_fila(self, linea):
+        """Devuelve (diccionario, error) de una línea JSON"""
+        try:
+            datos = json.loads(linea)
+        except ValueError:
+            return None, "JSON inválido"
+        if not isinstance(datos, dict):
+            return None, "La fila no es un objeto JSON"
+        return datos, None
+
+    def guardar_fila(self, fila, datos, error):
+        """Guarda una fila válida en el archivo temporal o anota su error"""
+        if error is None:
+            datos, error = self.limpiar_fila(datos)
+        if error is not None:
+            self.anotar_error(fila, error)
+            return
+        self._validas.write(json.dumps([fila, datos], ensure_ascii=False) + '\n')
+        self.validas += 1
+
+    def limpiar_fila(self, datos):
+        """Valida una fila y deja solo los campos de un equipo"""
+        for campo in CAMPOS_REQUERIDOS:
+            if datos.get(campo) is not None and not isinstance(datos[campo], str):
+                return None, f"Campo '{campo}' debe ser texto"
+        es_valido, mensaje = self.validar(datos)
+        if not es_valido:
+            return None, mensaje
+        equipo = {campo: datos[campo] for campo in CAMPOS_REQUERIDOS}
+        # Las fechas de un archivo exportado se conservan
+        for campo in ('fecha_registro', 'ultima_actualizacion'):
+            fecha = datos.get(campo)
+            if fecha:
+                if not isinstance(fecha, str) or not PATRON_FECHA.match(fecha):
+                    return None, f"Campo '{campo}' debe tener el formato AAAA-MM-DD HH:MM:SS"
+                equipo[campo] = fecha
+        return equipo, None
+
+    def anotar_error(self, fila, mensaje):
+        """Cuenta una fila rechazada; las primeras se informan con su número"""
+        self.errores += 1
+        if len(self.detalle_errores) < MAXIMO_ERRORES_INFORMADOS:
+            self.detalle_errores.append({'fila': fila, 'mensaje': mensaje})
+
+    def filas_validas(self):
+        """Genera (número de fila, equipo) de las filas guardadas"""
+        self._validas.seek(0)
+        for linea in self._validas:
+            fila, datos = json.loads(linea)
+            yield fila, datos
+
+    def resumen(self):
+        """Campos de progreso para las respuestas"""
+        return {
+            "filas": self.filas,
+            "validas": self.validas,
+            "errores": self.errores,
+            "detalle_errores": sorted(self.detalle_errores, key=lambda error: error['fila'])
+        }
+
+    def cerrar(self):
+        """Descarta el archivo temporal"""
+        self._validas.close()
+
+
+def texto_exportacion(equipos, formato, encabezado=False):
+    """Líneas de texto de un bloque de equipos en el formato pedido"""
+    if formato == 'csv':
+        salida = io.StringIO()
+        escritor = csv.writer(salida, lineterminator='\n')
+        if encabezado:
+            escritor.writerow(COLUMNAS_EXPORTACION)
+        for equipo in equipos:
+            escritor.writerow([equipo.get(campo) or '' for campo in COLUMNAS_EXPORTACION])
+        return salida.getvalue()
+    return ''.join(
+        json.dumps({campo: equipo.get(campo) for campo in COLUMNAS_EXPORTACION},
+                   ensure_ascii=False) + '\n'
+        for equipo in equipos)
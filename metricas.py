@@ -0,0 +1,276 @@
+"""
+Métricas internas del servidor de inventario
+
+Contadores e histogramas en memoria: solicitudes y latencia por acción,
+espera por el lock de escritura, tiempo de persistencia, bytes y
+conexiones. Se consultan con la acción 'estadisticas' o, en formato de
+texto de Prometheus, por un puerto HTTP opcional.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites superiores de los intervalos de los histogramas, en segundos
+LIMITES_HISTOGRAMA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                      0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histograma:
+    """Cuenta observaciones por intervalo de duración"""
+
+    def __init__(self):
+        self.conteos = [0] * (len(LIMITES_HISTOGRAMA) + 1)  # El último es +Inf
+        self.suma = 0.0
+        self.cantidad = 0
+        self.maximo = 0.0
+
+    def observar(self, segundos):
+        """Agrega una observación (requiere el lock de Metricas)"""
+        self.conteos[bisect.bisect_left(LIMITES_HISTOGRAMA, segundos)] += 1
+        self.suma += segundos
+        self.cantidad += 1
+        if segundos > self.maximo:
+            self.maximo = segundos
+
+    def percentil(self, fraccion):
+        """Estimación del percentil: límite superior de su intervalo"""
+        if not self.cantidad:
+            return 0.0
+        objetivo = fraccion * self.cantidad
+        acumulado = 0
+        for limite, conteo in zip(LIMITES_HISTOGRAMA, self.conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+    def resumen(self):
+        """Cantidad y latencias en milisegundos"""
+        return {
+            'cantidad': self.cantidad,
+            'promedio_ms': round(self.suma / self.cantidad * 1000, 3) if self.cantidad else 0.0,
+            'p50_ms': round(self.percentil(0.50) * 1000, 3),
+            'p99_ms': round(self.percentil(0.99) * 1000, 3),
+            'max_ms': round(self.maximo * 1000, 3)
+        }
+
+    def lineas_prometheus(self, nombre, etiquetas=''):
+        """Líneas de texto de Prometheus con los intervalos acumulados"""
+        separador = ',' if etiquetas else ''
+        lineas = []
+        acumulado = 0
+        for limite, conteo in zip(LIMITES_HISTOGRAMA, self.conteos):
+            acumulado += conteo
+            lineas.append(
+                f'{nombre}_bucket{{{etiquetas}{separador}le="{limite}"}} {acumulado}')
+        lineas.append(
+            f'{nombre}_bucket{{{etiquetas}{separador}le="+Inf"}} {self.cantidad}')
+        llaves = f'{{{etiquetas}}}' if etiquetas else ''
+        lineas.append(f'{nombre}_sum{llaves} {self.suma}')
+        lineas.append(f'{nombre}_count{llaves} {self.cantidad}')
+        return lineas
+
+
+class Metricas:
+    """Instrumentación del servidor, segura para varios hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inicio = time.time()
+        self.solicitudes = {}  # acción -> cantidad
+        self.errores = {}  # acción -> respuestas con resultado 'error'
+        self.latencias = {}  # acción -> Histograma
+        self.espera_lock = Histograma()
+        self.persistencia = Histograma()
+        self.bytes_recibidos = 0
+        self.bytes_enviados = 0
+        self.conexiones_activas = 0
+        self.conexiones_totales = 0
+        self.cache_aciertos = 0  # Respuestas enviadas desde la caché
+        self.cache_fallos = 0
+
+    def registrar_solicitud(self, accion, segundos, exitosa):
+        """Cuenta una solicitud atendida y su duración"""
+        with self._lock:
+            self.solicitudes[accion] = self.solicitudes.get(accion, 0) + 1
+            if not exitosa:
+                self.errores[accion] = self.errores.get(accion, 0) + 1
+            histograma = self.latencias.get(accion)
+            if histograma is None:
+                histograma = self.latencias[accion] = Histograma()
+            histograma.observar(segundos)
+
+    def observar_espera_lock(self, segundos):
+        """Registra la espera por el lock de escritura"""
+        with self._lock:
+            self.espera_lock.observar(segundos)
+
+    def observar_persistencia(self, segundos):
+        """Registra la duración de una escritura a disco"""
+        with self._lock:
+            self.persistencia.observar(segundos)
+
+    def sumar_bytes(self, recibidos=0, enviados=0):
+        """Suma bytes de mensajes recibidos y enviados"""
+        with self._lock:
+            self.bytes_recibidos += recibidos
+            self.bytes_enviados += enviados
+
+    def registrar_cache(self, acierto):
+        """Cuenta una búsqueda en la caché de respuestas"""
+        with self._lock:
+            if acierto:
+                self.cache_aciertos += 1
+            else:
+                self.cache_fallos += 1
+
+    def conexion_abierta(self):
+        """Cuenta una conexión nueva"""
+        with self._lock:
+            self.conexiones_activas += 1
+            self.conexiones_totales += 1
+
+    def conexion_cerrada(self):
+        """Descuenta una conexión que terminó"""
+        with self._lock:
+            self.conexiones_activas -= 1
+
+    def resumen(self):
+        """Diccionario con todas las métricas, para la acción 'estadisticas'"""
+        with self._lock:
+            return {
+                'tiempo_activo_s': round(time.time() - self.inicio, 1),
+                'conexiones': {
+                    'activas': self.conexiones_activas,
+                    'totales': self.conexiones_totales
+                },
+                'bytes': {
+                    'recibidos': self.bytes_recibidos,
+                    'enviados': self.bytes_enviados
+                },
+                'acciones': {
+                    accion: dict(
+                        self.latencias[accion].resumen(),
+                        solicitudes=cantidad,
+                        errores=self.errores.get(accion, 0))
+                    for accion, cantidad in sorted(self.solicitudes.items())
+                },
+                'cache': {
+                    'aciertos': self.cache_aciertos,
+                    'fallos': self.cache_fallos
+                },
+                'espera_lock': self.espera_lock.resumen(),
+                'persistencia': self.persistencia.resumen()
+            }
+
+    def texto_prometheus(self, medidores=None):
+        """Métricas en el formato de texto de Prometheus
+
+        'medidores' agrega valores instantáneos, p. ej. {'equipos': 120}.
+        """
+        lineas = []
+
+        def encabezado(nombre, tipo, ayuda):
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+
+        with self._lock:
+            encabezado('inventario_solicitudes_total', 'counter',
+                       'Solicitudes atendidas por acción')
+            for accion, cantidad in sorted(self.solicitudes.items()):
+                lineas.append(
+                    f'inventario_solicitudes_total{{accion="{accion}"}} {cantidad}')
+            encabezado('inventario_errores_total', 'counter',
+                       'Respuestas con error por acción')
+            for accion in sorted(self.solicitudes):
+                lineas.append(
+                    f'inventario_errores_total{{accion="{accion}"}} {self.errores.get(accion, 0)}')
+            encabezado('inventario_latencia_segundos', 'histogram',
+                       'Duración de las solicitudes por acción')
+            for accion, histograma in sorted(self.latencias.items()):
+                lineas.extend(histograma.lineas_prometheus(
+                    'inventario_latencia_segundos', f'accion="{accion}"'))
+            encabezado('inventario_espera_lock_segundos', 'histogram',
+                       'Espera para tomar el lock de escritura')
+            lineas.extend(self.espera_lock.lineas_prometheus(
+                'inventario_espera_lock_segundos'))
+            encabezado('inventario_persistencia_segundos', 'histogram',
+                       'Duración de las escrituras a disco')
+            lineas.extend(self.persistencia.lineas_prometheus(
+                'inventario_persistencia_segundos'))
+            encabezado('inventario_bytes_recibidos_total', 'counter',
+                       'Bytes de mensajes recibidos')
+            lineas.append(f'inventario_bytes_recibidos_total {self.bytes_recibidos}')
+            encabezado('inventario_bytes_enviados_total', 'counter',
+                       'Bytes de mensajes enviados')
+            lineas.append(f'inventario_bytes_enviados_total {self.bytes_enviados}')
+            encabezado('inventario_conexiones_activas', 'gauge',
+                       'Conexiones abiertas')
+            lineas.append(f'inventario_conexiones_activas {self.conexiones_activas}')
+            encabezado('inventario_conexiones_total', 'counter',
+                       'Conexiones aceptadas')
+            lineas.append(f'inventario_conexiones_total {self.conexiones_totales}')
+            encabezado('inventario_cache_aciertos_total', 'counter',
+                       'Respuestas enviadas desde la caché')
+            lineas.append(f'inventario_cache_aciertos_total {self.cache_aciertos}')
+            encabezado('inventario_cache_fallos_total', 'counter',
+                       'Respuestas que no estaban en la caché')
+            lineas.append(f'inventario_cache_fallos_total {self.cache_fallos}')
+
+        for nombre, valor in (medidores or {}).items():
+            encabezado(f'inventario_{nombre}', 'gauge', nombre.capitalize())
+            lineas.append(f'inventario_{nombre} {valor}')
+        return '\n'.join(lineas) + '\n'
+
+
+class LockMedido:
+    """Envuelve un lock y registra cuánto se espera para tomarlo"""
+
+    def __init__(self, lock, metricas):
+        self._lock = lock
+        self._metricas = metricas
+
+    def acquire(self, blocking=True, timeout=-1):
+        inicio = time.perf_counter()
+        tomado = self._lock.acquire(blocking, timeout)
+        self._metricas.observar_espera_lock(time.perf_counter() - inicio)
+        return tomado
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def iniciar_servidor_metricas(host, puerto, generar_texto):
+    """Sirve GET /metrics por HTTP en un hilo aparte y devuelve el servidor"""
+
+    class ManejadorMetricas(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            cuerpo = generar_texto().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass  # Sin una línea de log por cada consulta de Prometheus
+
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    logging.info(
+        f"Métricas de Prometheus en http://{host}:{servidor.server_address[1]}/metrics")
+    return servidor
@@ -0,0 +1,227 @@
+"""
+Protocolo de mensajes entre cliente y servidor
+
+Cada mensaje viaja precedido por una cabecera de 4 bytes (big-endian)
+con la longitud del contenido, de modo que respuestas grandes y
+solicitudes enviadas una tras otra se reciben completas y separadas.
+
+El contenido es JSON en UTF-8. Con la acción 'negociar' una conexión
+puede pasar a un formato compacto (listas de equipos por columnas) y a
+comprimir los mensajes grandes; en ese caso cada mensaje empieza con un
+byte que indica si viene comprimido.
+"""
+
+import asyncio
+import json
+import struct
+import zlib
+from collections.abc import Mapping
+
+try:
+    import msgpack  # Opcional: formato binario
+except ImportError:
+    msgpack = None
+
+CABECERA = struct.Struct('!I')
+TAMANO_MAXIMO_MENSAJE = 64 * 1024 * 1024  # 64 MB
+TAMANO_LECTURA = 65536
+FORMATOS = ['json', 'compacto'] + (['msgpack'] if msgpack is not None else [])
+UMBRAL_COMPRESION = 8192  # Solo se comprimen mensajes desde este tamaño
+SIN_COMPRIMIR = b'\x00'
+COMPRIMIDO = b'\x01'
+
+
+class MensajeInvalidoError(ValueError):
+    """El contenido de un mensaje no se puede decodificar"""
+
+
+def a_serializable(objeto):
+    """Convierte en dict los registros que se leen como diccionarios
+
+    El servidor guarda los equipos como registros compactos (ver
+    almacenamiento.Equipo); recién aquí se pasan a dict para codificarlos.
+    """
+    a_dict = getattr(objeto, 'a_dict', None)
+    if a_dict is not None:
+        return a_dict()
+    if isinstance(objeto, Mapping):
+        return dict(objeto)
+    raise TypeError(f"Objeto de tipo {type(objeto).__name__} no serializable")
+
+
+# Codificadores reutilizados: json.dumps con opciones arma uno por mensaje
+JSON_PLANO = json.JSONEncoder(ensure_ascii=False, default=a_serializable)
+JSON_COMPACTO = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'),
+                                 default=a_serializable)
+
+
+def a_columnas(equipos):
+    """Convierte una lista de equipos en columnas y filas"""
+    equipos = [equipo if type(equipo) is dict else a_serializable(equipo)
+               for equipo in equipos]
+    columnas = list(dict.fromkeys(
+        campo for equipo in equipos for campo in equipo))
+    filas = [[equipo.get(campo) for campo in columnas] for equipo in equipos]
+    return {'columnas': columnas, 'filas': filas}
+
+
+def desde_columnas(tabla):
+    """Reconstruye la lista de equipos a partir de columnas y filas"""
+    columnas = tabla['columnas']
+    return [
+        {campo: valor for campo, valor in zip(columnas, fila)
+         if valor is not None}
+        for fila in tabla['filas']
+    ]
+
+
+def transformar_equipos(mensaje, funcion, tipo):
+    """Aplica la función a las listas de equipos del mensaje y sus respuestas"""
+    if not isinstance(mensaje, dict):
+        return mensaje
+    cambios = {}
+    if isinstance(mensaje.get('equipos'), tipo):
+        cambios['equipos'] = funcion(mensaje['equipos'])
+    if isinstance(mensaje.get('respuestas'), list):
+        # Respuestas de un lote
+        cambios['respuestas'] = [
+            transformar_equipos(respuesta, funcion, tipo)
+            for respuesta in mensaje['respuestas']]
+    return dict(mensaje, **cambios) if cambios else mensaje
+
+
+class Codificador:
+    """Convierte mensajes en bytes y viceversa según el formato negociado
+
+    Sin negociar ('json' sin compresión) el contenido es JSON plano, como
+    lo esperan los clientes anteriores.
+    """
+
+    def __init__(self, formato='json', comprimir=False):
+        if formato not in FORMATOS:
+            raise ValueError(
+                f"Formato inválido. Debe ser uno de: {', '.join(FORMATOS)}")
+        self.formato = formato
+        self.comprimir = comprimir
+        # Todo formato negociado lleva el byte de compresión
+        self.con_bandera = formato != 'json' or comprimir
+
+    def codificar(self, mensaje):
+        """Devuelve los bytes del mensaje"""
+        if self.formato == 'json':
+            datos = JSON_PLANO.encode(mensaje).encode('utf-8')
+        else:
+            mensaje = transformar_equipos(mensaje, a_columnas, list)
+            if self.formato == 'msgpack':
+                datos = msgpack.packb(mensaje, use_bin_type=True,
+                                      default=a_serializable)
+            else:
+                datos = JSON_COMPACTO.encode(mensaje).encode('utf-8')
+
+        if not self.con_bandera:
+            return datos
+        if self.comprimir and len(datos) >= UMBRAL_COMPRESION:
+            return COMPRIMIDO + zlib.compress(datos, 1)
+        return SIN_COMPRIMIR + datos
+
+    def decodificar(self, datos):
+        """Devuelve el mensaje contenido en los bytes"""
+        try:
+            if self.con_bandera:
+                bandera, datos = datos[:1], datos[1:]
+                if bandera == COMPRIMIDO:
+                    datos = zlib.decompress(datos)
+                elif bandera != SIN_COMPRIMIR:
+                    raise MensajeInvalidoError("Bandera de compresión inválida")
+
+            if self.formato == 'json':
+                return json.loads(datos.decode('utf-8'))
+            if self.formato == 'msgpack':
+                mensaje = msgpack.unpackb(datos, raw=False)
+            else:
+                mensaje = json.loads(datos.decode('utf-8'))
+            return transformar_equipos(mensaje, desde_columnas, dict)
+        except MensajeInvalidoError:
+            raise
+        except Exception as e:
+            raise MensajeInvalidoError(str(e))
+
+    def resumir(self, datos):
+        """Texto corto del mensaje para el log"""
+        if not self.con_bandera:
+            return datos[:100].decode('utf-8', 'replace') + '...'
+        return f"{len(datos)} bytes ({self.formato})"
+
+
+def empaquetar_mensaje(datos):
+    """Antepone la cabecera de longitud a los bytes del mensaje"""
+    if len(datos) > TAMANO_MAXIMO_MENSAJE:
+        raise ValueError(
+            f"Mensaje de {len(datos)} bytes excede el máximo permitido")
+    return CABECERA.pack(len(datos)) + datos
+
+
+def enviar_mensaje(sock, datos):
+    """Envía un mensaje completo por el socket"""
+    sock.sendall(empaquetar_mensaje(datos))
+
+
+class LectorMensajes:
+    """Lee mensajes completos de un socket usando un buffer interno"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def leer(self):
+        """Devuelve el siguiente mensaje, o None si la conexión se cerró"""
+        while True:
+            mensaje = self.extraer_mensaje()
+            if mensaje is not None:
+                return mensaje
+
+            data = self.sock.recv(TAMANO_LECTURA)
+            if not data:
+                if self.buffer:
+                    raise ConnectionError(
+                        "Conexión cerrada con un mensaje incompleto")
+                return None
+            self.buffer += data
+
+    def extraer_mensaje(self):
+        """Extrae un mensaje del buffer si ya llegó completo"""
+        if len(self.buffer) < CABECERA.size:
+            return None
+
+        (longitud,) = CABECERA.unpack_from(self.buffer)
+        if longitud > TAMANO_MAXIMO_MENSAJE:
+            raise ValueError(
+                f"Mensaje de {longitud} bytes excede el máximo permitido")
+
+        fin = CABECERA.size + longitud
+        if len(self.buffer) < fin:
+            return None
+
+        mensaje = bytes(self.buffer[CABECERA.size:fin])
+        del self.buffer[:fin]
+        return mensaje
+
+
+async def leer_mensaje_async(reader):
+    """Lee un mensaje completo de un asyncio.StreamReader (None al cerrar)"""
+    try:
+        cabecera = await reader.readexactly(CABECERA.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("Conexión cerrada con un mensaje incompleto")
+        return None
+
+    (longitud,) = CABECERA.unpack(cabecera)
+    if longitud > TAMANO_MAXIMO_MENSAJE:
+        raise ValueError(
+            f"Mensaje de {longitud} bytes excede el máximo permitido")
+
+    try:
+        return await reader.readexactly(longitud)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Conexión cerrada con un mensaje incompleto")
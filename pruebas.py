@@ -3,8 +3,31 @@ Script de prueba automática para el sistema de inventario
 Ejecuta pruebas unitarias de las funciones del servidor
 """
 
-from servidor import ServidorInventario
+from servidor import ServidorInventario, ServidorMultiproceso
+from almacenamiento import (AlmacenamientoJSON, AlmacenamientoMemoria, Equipo,
+                            con_cambios, segundos_de_fecha)
+from eventos import PublicadorEventos
+from cliente import (ClienteInventario, ConexionInventario, ErrorComunicacion,
+                     PoolConexiones)
+from cliente_async import ClienteInventarioAsync
+from cache import CacheRespuestas
+from importacion import MAXIMO_REGISTRO_CSV, Importacion
+from transferencia import exportar_archivo, importar_archivo
+from benchmark import comparar, parsear_mezcla, resumir
+from protocolo import Codificador, LectorMensajes, enviar_mensaje
+from registro import (ManejadorCola, MuestreoAcciones, configurar_registro,
+                      detener_registro, parsear_muestreo)
+import asyncio
+import glob
+import logging
+import queue
 import json
+import signal
+import socket
+import threading
+import time
+import tracemalloc
+import urllib.request
 import sys
 import os
 
@@ -286,6 +309,2038 @@ def prueba_protocolo():
         os.remove('test_inventario.json')
 
 
+def prueba_indice_codigos():
+    """Prueba el índice de códigos del servidor"""
+    print("=== PRUEBA 7: Índice de Códigos ===")
+
+    # Crear archivo con un código en minúsculas (datos antiguos)
+    with open('test_inventario.json', 'w', encoding='utf-8') as f:
+        json.dump([{
+            'codigo': 'idx01',
+            'nombre': 'Fuente de Poder',
+            'tipo': 'Fuente',
+            'estado': 'disponible'
+        }], f)
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json')
+
+    # Prueba 1: El índice se construye al cargar
+    print(f"✓ Índice cargado con {len(servidor.almacen.indice_codigos)} códigos")
+    assert len(servidor.almacen.indice_codigos) == len(servidor.inventario)
+    assert servidor.buscar_equipo('IDX01')['resultado'] == 'ok'
+
+    # Prueba 2: Duplicado detectado aunque el archivo tenga minúsculas
+    respuesta = servidor.registrar_equipo({
+        'codigo': 'Idx01',
+        'nombre': 'Duplicado',
+        'tipo': 'Fuente',
+        'estado': 'disponible'
+    })
+    print(f"✓ Duplicado por índice: {respuesta['resultado']}")
+    assert respuesta['resultado'] == 'error'
+
+    # Prueba 3: El índice apunta al mismo registro que el inventario
+    servidor.registrar_equipo({
+        'codigo': 'IDX02',
+        'nombre': 'Generador de Señales',
+        'tipo': 'Generador',
+        'estado': 'disponible'
+    })
+    servidor.actualizar_estado('idx02', 'en mantenimiento')
+    print(
+        f"✓ Estado vía índice: {servidor.inventario[1]['estado']}")
+    assert servidor.almacen.indice_codigos['IDX02'] is servidor.inventario[1]
+    assert servidor.inventario[1]['estado'] == 'en mantenimiento'
+
+    print("✅ Todas las pruebas del índice pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_journal():
+    """Prueba el modo de persistencia con journal"""
+    print("=== PRUEBA 8: Persistencia con Journal ===")
+
+    # Limpiar archivos de prueba si existen
+    for archivo in ('test_inventario.json', 'test_inventario.json.journal'):
+        if os.path.exists(archivo):
+            os.remove(archivo)
+
+    servidor1 = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json',
+        modo_persistencia='journal', compactar_cada=3)
+    servidor1.registrar_equipo({
+        'codigo': 'JRN01',
+        'nombre': 'Analizador de Espectro',
+        'tipo': 'Instrumento de medición',
+        'estado': 'disponible'
+    })
+    servidor1.actualizar_estado('JRN01', 'en uso')
+
+    # Prueba 1: Los cambios van al journal, no al archivo principal
+    print(f"✓ Cambios en journal: {servidor1.almacen.cambios_en_journal}")
+    assert servidor1.almacen.cambios_en_journal == 2
+    assert os.path.exists('test_inventario.json.journal')
+    assert not os.path.exists('test_inventario.json')
+
+    # Prueba 2: Un reinicio sin cerrar (caída) reproduce el journal
+    servidor2 = ServidorInventario(
+        puerto=5557, archivo_datos='test_inventario.json',
+        modo_persistencia='journal', compactar_cada=3)
+    print(
+        f"✓ Journal reproducido: {servidor2.inventario[0]['codigo']} en estado '{servidor2.inventario[0]['estado']}'")
+    assert len(servidor2.inventario) == 1
+    assert servidor2.inventario[0]['estado'] == 'en uso'
+
+    # Prueba 3: Al alcanzar el umbral se compacta en el archivo principal
+    servidor2.registrar_equipo({
+        'codigo': 'JRN02',
+        'nombre': 'Cautín',
+        'tipo': 'Herramienta',
+        'estado': 'disponible'
+    })
+    print(f"✓ Compactación: {servidor2.almacen.cambios_en_journal} cambios pendientes")
+    assert servidor2.almacen.cambios_en_journal == 0
+    assert not os.path.exists('test_inventario.json.journal')
+    with open('test_inventario.json', 'r', encoding='utf-8') as f:
+        assert len(json.load(f)) == 2
+    servidor2.cerrar()
+
+    print("✅ Todas las pruebas de journal pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in ('test_inventario.json', 'test_inventario.json.journal'):
+        if os.path.exists(archivo):
+            os.remove(archivo)
+
+
+def iniciar_servidor_prueba(**opciones):
+    """Inicia un servidor en un hilo sobre un puerto libre"""
+    servidor = ServidorInventario(
+        host='127.0.0.1', puerto=0, archivo_datos='test_inventario.json',
+        **opciones)
+    hilo = threading.Thread(target=servidor.iniciar, daemon=True)
+    hilo.start()
+    assert servidor.listo.wait(5), "El servidor no inició a tiempo"
+    return servidor, hilo
+
+
+def prueba_mensajes_enmarcados():
+    """Prueba el envío de mensajes con prefijo de longitud"""
+    print("=== PRUEBA 9: Mensajes Enmarcados ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba()
+
+    # Registrar suficientes equipos para superar el antiguo límite de 4096 bytes
+    for i in range(200):
+        servidor.registrar_equipo({
+            'codigo': f'FRM{i:03d}',
+            'nombre': f'Multímetro de banco número {i}',
+            'tipo': 'Instrumento de medición',
+            'estado': 'disponible'
+        })
+
+    cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+    assert cliente.conectar()
+
+    # Prueba 1: Respuesta grande recibida completa
+    respuesta = cliente.enviar_solicitud({'accion': 'consultar'})
+    print(f"✓ Consulta grande: {len(respuesta['equipos'])} equipos")
+    assert len(respuesta['equipos']) == 200
+
+    # Prueba 2: Solicitudes enviadas una tras otra sin esperar respuesta
+    for codigo in ('FRM000', 'FRM001', 'NOEXISTE'):
+        enviar_mensaje(cliente.socket, json.dumps(
+            {'accion': 'buscar', 'codigo': codigo}).encode('utf-8'))
+    resultados = [json.loads(cliente.lector.leer())['resultado']
+                  for _ in range(3)]
+    print(f"✓ Solicitudes en cadena: {resultados}")
+    assert resultados == ['ok', 'ok', 'error']
+
+    cliente.desconectar()
+    servidor.detener()
+    hilo.join(5)
+
+    # Prueba 3: Mensaje recibido en fragmentos
+    a, b = socket.socketpair()
+    datos = json.dumps({'accion': 'consultar'}).encode('utf-8')
+    lector = LectorMensajes(b)
+    paquete = len(datos).to_bytes(4, 'big') + datos
+    a.sendall(paquete[:3])
+    a.sendall(paquete[3:])
+    a.close()
+    print(f"✓ Mensaje fragmentado reconstruido")
+    assert lector.leer() == datos
+    assert lector.leer() is None
+    b.close()
+
+    print("✅ Todas las pruebas de mensajes enmarcados pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_servidor_asyncio():
+    """Prueba el modo de servidor basado en asyncio"""
+    print("=== PRUEBA 10: Servidor asyncio ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba(
+        modo_servidor='asyncio', backlog=512)
+
+    # Prueba 1: Muchas conexiones abiertas a la vez en un solo hilo
+    clientes = []
+    for _ in range(200):
+        cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+        assert cliente.conectar()
+        clientes.append(cliente)
+    print(f"✓ Conexiones simultáneas: {len(clientes)}")
+
+    # Prueba 2: Todas las conexiones reciben respuesta
+    respuesta = clientes[0].enviar_solicitud({
+        'accion': 'registrar',
+        'codigo': 'ASY01',
+        'nombre': 'Fuente Variable',
+        'tipo': 'Fuente',
+        'estado': 'disponible'
+    })
+    assert respuesta['resultado'] == 'ok'
+    encontrados = sum(
+        1 for cliente in clientes
+        if cliente.enviar_solicitud({'accion': 'buscar', 'codigo': 'ASY01'})['resultado'] == 'ok')
+    print(f"✓ Respuestas recibidas: {encontrados}")
+    assert encontrados == len(clientes)
+
+    for cliente in clientes:
+        cliente.desconectar()
+
+    # Prueba 3: El servidor se detiene limpiamente
+    servidor.detener()
+    hilo.join(5)
+    print(f"✓ Servidor detenido: {not hilo.is_alive()}")
+    assert not hilo.is_alive()
+
+    print("✅ Todas las pruebas del servidor asyncio pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_lote():
+    """Prueba la acción de lote"""
+    print("=== PRUEBA 11: Solicitudes en Lote ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json')
+
+    # Contar las escrituras del inventario durante el lote
+    escrituras = []
+    guardar_original = servidor.almacen.guardar_inventario
+
+    def guardar_contando(inventario=None):
+        escrituras.append(1)
+        return guardar_original(inventario)
+
+    servidor.almacen.guardar_inventario = guardar_contando
+
+    solicitudes = [
+        {'accion': 'registrar', 'codigo': f'LOT{i:02d}', 'nombre': f'Protoboard {i}',
+         'tipo': 'Componente', 'estado': 'disponible'}
+        for i in range(5)
+    ]
+    solicitudes.append({'accion': 'actualizar',
+                       'codigo': 'LOT00', 'estado': 'en uso'})
+    solicitudes.append({'accion': 'buscar', 'codigo': 'NOEXISTE'})
+    solicitudes.append({'accion': 'lote', 'solicitudes': []})
+
+    # Prueba 1: Cada subsolicitud recibe su respuesta en orden
+    respuesta = servidor.procesar_solicitud(json.dumps({
+        'accion': 'lote',
+        'solicitudes': solicitudes
+    }))
+    resultados = [r['resultado'] for r in respuesta['respuestas']]
+    print(f"✓ Lote procesado: {resultados}")
+    assert respuesta['resultado'] == 'ok'
+    assert resultados == ['ok'] * 6 + ['error', 'error']
+    assert len(servidor.inventario) == 5
+
+    # Prueba 2: Una sola escritura para todo el lote
+    print(f"✓ Escrituras en disco: {len(escrituras)}")
+    assert len(escrituras) == 1
+
+    # Prueba 3: Lote inválido
+    respuesta = servidor.procesar_solicitud(json.dumps({
+        'accion': 'lote',
+        'solicitudes': 'no es una lista'
+    }))
+    print(f"✓ Lote inválido: {respuesta['resultado']} - {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+
+    print("✅ Todas las pruebas de lote pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_lecturas_sin_bloqueo():
+    """Prueba que las consultas no esperan a los escritores"""
+    print("=== PRUEBA 12: Lecturas sin Bloqueo ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json')
+    servidor.registrar_equipo({
+        'codigo': 'RW01',
+        'nombre': 'Termómetro Infrarrojo',
+        'tipo': 'Sensor',
+        'estado': 'disponible'
+    })
+    consulta_anterior = servidor.consultar_equipos()['equipos']
+
+    # Prueba 1: Con el lock de escritura tomado, las lecturas terminan
+    resultados = []
+
+    def leer():
+        resultados.append(servidor.buscar_equipo('RW01')['resultado'])
+        resultados.append(servidor.consultar_equipos()['resultado'])
+
+    with servidor.lock:
+        lector = threading.Thread(target=leer)
+        lector.start()
+        lector.join(2)
+        bloqueado = lector.is_alive()
+    print(f"✓ Lecturas con escritor activo: {resultados}")
+    assert not bloqueado
+    assert resultados == ['ok', 'ok']
+
+    # Prueba 2: Una actualización no modifica lo que ya se entregó
+    servidor.actualizar_estado('RW01', 'en uso')
+    print(
+        f"✓ Consulta previa intacta: '{consulta_anterior[0]['estado']}'")
+    assert consulta_anterior[0]['estado'] == 'disponible'
+
+    # Prueba 3: Las lecturas nuevas ven el cambio
+    estado = servidor.consultar_equipos()['equipos'][0]['estado']
+    print(f"✓ Consulta posterior: '{estado}'")
+    assert estado == 'en uso'
+    assert servidor.buscar_equipo('RW01')['equipo']['estado'] == 'en uso'
+
+    print("✅ Todas las pruebas de lecturas sin bloqueo pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_paginacion_y_flujo():
+    """Prueba la consulta paginada y la consulta en flujo"""
+    print("=== PRUEBA 13: Paginación y Flujo ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba()
+    servidor.procesar_lote([
+        {'accion': 'registrar', 'codigo': f'PAG{i:03d}', 'nombre': f'Resistencia {i}',
+         'tipo': 'Componente', 'estado': 'disponible'}
+        for i in range(25)
+    ])
+
+    # Prueba 1: Recorrer todas las páginas con el cursor
+    codigos = []
+    cursor = None
+    paginas = 0
+    while True:
+        respuesta = servidor.consultar_equipos(limite=10, cursor=cursor)
+        assert respuesta['resultado'] == 'ok'
+        codigos.extend(equipo['codigo'] for equipo in respuesta['equipos'])
+        paginas += 1
+        cursor = respuesta['siguiente_cursor']
+        if cursor is None:
+            break
+    print(f"✓ Paginación: {len(codigos)} equipos en {paginas} páginas")
+    assert paginas == 3
+    assert codigos == [f'PAG{i:03d}' for i in range(25)]
+
+    # Prueba 2: Parámetros inválidos
+    respuesta = servidor.procesar_solicitud(json.dumps(
+        {'accion': 'consultar', 'limite': 0}))
+    print(f"✓ Límite inválido: {respuesta['resultado']} - {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+
+    # Prueba 3: Consulta en flujo por la red
+    cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+    assert cliente.conectar()
+    bloques = list(cliente.consultar_en_flujo(tamano_bloque=10))
+    recibidos = sum(len(bloque['equipos']) for bloque in bloques)
+    print(f"✓ Flujo: {recibidos} equipos en {len(bloques)} bloques")
+    assert [bloque['fin'] for bloque in bloques] == [False, False, True]
+    assert recibidos == 25
+
+    # Prueba 4: La conexión sigue sincronizada después del flujo
+    respuesta = cliente.enviar_solicitud({'accion': 'buscar', 'codigo': 'PAG024'})
+    print(f"✓ Solicitud posterior al flujo: {respuesta['resultado']}")
+    assert respuesta['resultado'] == 'ok'
+
+    cliente.desconectar()
+    servidor.detener()
+    hilo.join(5)
+
+    print("✅ Todas las pruebas de paginación y flujo pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_filtrar():
+    """Prueba el filtrado por estado, tipo y fecha de registro"""
+    print("=== PRUEBA 14: Filtrado de Equipos ===")
+
+    # Crear inventario con fechas de registro conocidas
+    with open('test_inventario.json', 'w', encoding='utf-8') as f:
+        json.dump([
+            {'codigo': 'FIL01', 'nombre': 'Multímetro', 'tipo': 'Instrumento de medición',
+             'estado': 'disponible', 'fecha_registro': '2025-01-10 09:00:00'},
+            {'codigo': 'FIL02', 'nombre': 'Osciloscopio', 'tipo': 'Instrumento de medición',
+             'estado': 'en mantenimiento', 'fecha_registro': '2025-02-15 14:30:00'},
+            {'codigo': 'FIL03', 'nombre': 'Computador', 'tipo': 'Equipo de cómputo',
+             'estado': 'en mantenimiento', 'fecha_registro': '2025-02-15 18:00:00'},
+            {'codigo': 'FIL04', 'nombre': 'Arduino', 'tipo': 'Microcontrolador',
+             'estado': 'en uso', 'fecha_registro': '2025-03-01 08:00:00'}
+        ], f)
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json')
+
+    def codigos(respuesta):
+        return [equipo['codigo'] for equipo in respuesta['equipos']]
+
+    # Prueba 1: Filtrar por estado
+    respuesta = servidor.filtrar_equipos(estado='en mantenimiento')
+    print(f"✓ Por estado: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['FIL02', 'FIL03']
+
+    # Prueba 2: Filtros combinados (tipo sin distinguir mayúsculas)
+    respuesta = servidor.filtrar_equipos(
+        estado='en mantenimiento', tipo='INSTRUMENTO DE MEDICIÓN')
+    print(f"✓ Estado y tipo: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['FIL02']
+
+    # Prueba 3: Rango de fechas (una fecha sin hora incluye todo el día)
+    respuesta = servidor.filtrar_equipos(
+        fecha_desde='2025-02-01', fecha_hasta='2025-02-15')
+    print(f"✓ Rango de fechas: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['FIL02', 'FIL03']
+
+    # Prueba 4: Los índices se actualizan con actualizar_estado
+    servidor.actualizar_estado('FIL02', 'disponible')
+    respuesta = servidor.procesar_solicitud(json.dumps(
+        {'accion': 'filtrar', 'estado': 'disponible'}))
+    print(f"✓ Índice tras actualizar: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['FIL01', 'FIL02']
+    assert codigos(servidor.filtrar_equipos(
+        estado='en mantenimiento')) == ['FIL03']
+
+    # Prueba 5: Filtros inválidos
+    respuesta = servidor.filtrar_equipos()
+    print(f"✓ Sin filtros: {respuesta['resultado']} - {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+    assert servidor.filtrar_equipos(
+        fecha_desde='15/02/2025')['resultado'] == 'error'
+
+    print("✅ Todas las pruebas de filtrado pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_buscar_texto():
+    """Prueba la búsqueda por texto en nombre y tipo"""
+    print("=== PRUEBA 15: Búsqueda por Texto ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.json')
+    servidor.procesar_lote([
+        {'accion': 'registrar', 'codigo': 'TXT01', 'nombre': 'Multímetro Fluke 87V',
+         'tipo': 'Instrumento de medición', 'estado': 'disponible'},
+        {'accion': 'registrar', 'codigo': 'TXT02', 'nombre': 'Osciloscopio Tektronix TDS2014C',
+         'tipo': 'Instrumento de medición', 'estado': 'disponible'},
+        {'accion': 'registrar', 'codigo': 'TXT03', 'nombre': 'Kit de medición',
+         'tipo': 'Herramienta', 'estado': 'disponible'},
+    ])
+
+    def codigos(respuesta):
+        return [equipo['codigo'] for equipo in respuesta['equipos']]
+
+    # Prueba 1: Sin distinguir mayúsculas ni tildes
+    respuesta = servidor.buscar_texto('MULTIMETRO')
+    print(f"✓ Sin tildes: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['TXT01']
+
+    # Prueba 2: Búsqueda por prefijo y con varias palabras
+    respuesta = servidor.buscar_texto('tek osci')
+    print(f"✓ Prefijos: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['TXT02']
+
+    # Prueba 3: Una coincidencia en el nombre pesa más que en el tipo
+    respuesta = servidor.buscar_texto('medición')
+    print(f"✓ Ranking: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['TXT03', 'TXT01', 'TXT02']
+    assert respuesta['total'] == 3
+
+    # Prueba 4: El índice se actualiza al registrar
+    servidor.registrar_equipo({
+        'codigo': 'TXT04',
+        'nombre': 'Multímetro UNI-T',
+        'tipo': 'Instrumento de medición',
+        'estado': 'disponible'
+    })
+    respuesta = servidor.procesar_solicitud(json.dumps(
+        {'accion': 'buscar_texto', 'texto': 'multímetro', 'limite': 5}))
+    print(f"✓ Tras registrar: {codigos(respuesta)}")
+    assert codigos(respuesta) == ['TXT01', 'TXT04']
+
+    # Prueba 5: Sin coincidencias y texto vacío
+    assert servidor.buscar_texto('microscopio')['total'] == 0
+    respuesta = servidor.buscar_texto('  ')
+    print(f"✓ Texto vacío: {respuesta['resultado']} - {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+
+    print("✅ Todas las pruebas de búsqueda por texto pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def limpiar_base_prueba():
+    """Elimina la base SQLite de prueba y sus archivos WAL"""
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists('test_inventario.db' + sufijo):
+            os.remove('test_inventario.db' + sufijo)
+
+
+def prueba_almacenamiento_sqlite():
+    """Prueba el servidor con el almacenamiento SQLite"""
+    print("=== PRUEBA 16: Almacenamiento SQLite ===")
+
+    limpiar_base_prueba()
+
+    servidor = ServidorInventario(
+        puerto=5556, archivo_datos='test_inventario.db', almacenamiento='sqlite')
+    respuesta = servidor.procesar_lote([
+        {'accion': 'registrar', 'codigo': f'SQL{i:02d}', 'nombre': f'Multímetro {i}',
+         'tipo': 'Instrumento de medición', 'estado': 'disponible'}
+        for i in range(5)
+    ] + [{'accion': 'actualizar', 'codigo': 'sql01', 'estado': 'en uso'}])
+
+    # Prueba 1: Registro, búsqueda y actualización dentro de un lote
+    resultados = [r['resultado'] for r in respuesta['respuestas']]
+    print(f"✓ Lote en una transacción: {resultados}")
+    assert resultados == ['ok'] * 6
+    assert servidor.buscar_equipo('SQL01')['equipo']['estado'] == 'en uso'
+
+    # Prueba 2: Códigos duplicados
+    respuesta = servidor.registrar_equipo({
+        'codigo': 'sql00',
+        'nombre': 'Otro',
+        'tipo': 'Otro',
+        'estado': 'disponible'
+    })
+    print(f"✓ Código duplicado: {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+
+    # Prueba 3: Paginación, filtros y texto consultan la base
+    pagina = servidor.consultar_equipos(limite=2)
+    codigos = [e['codigo'] for e in pagina['equipos']]
+    siguiente = servidor.consultar_equipos(limite=2, cursor=pagina['siguiente_cursor'])
+    codigos += [e['codigo'] for e in siguiente['equipos']]
+    print(f"✓ Páginas: {codigos}")
+    assert codigos == ['SQL00', 'SQL01', 'SQL02', 'SQL03']
+    assert pagina['total'] == 5
+
+    filtrados = servidor.filtrar_equipos(estado='disponible', tipo='INSTRUMENTO DE MEDICIÓN')
+    print(f"✓ Filtrados: {filtrados['total']}")
+    assert filtrados['total'] == 4
+
+    encontrados = servidor.buscar_texto('multimetro 3')
+    print(f"✓ Búsqueda por texto: {[e['codigo'] for e in encontrados['equipos']]}")
+    assert [e['codigo'] for e in encontrados['equipos']] == ['SQL03']
+
+    # Prueba 4: Los datos sobreviven al reinicio
+    servidor.cerrar()
+    servidor2 = ServidorInventario(
+        puerto=5557, archivo_datos='test_inventario.db', almacenamiento='sqlite')
+    print(f"✓ Equipos tras reiniciar: {servidor2.almacen.total()}")
+    assert servidor2.almacen.total() == 5
+    assert servidor2.buscar_equipo('SQL01')['equipo']['estado'] == 'en uso'
+    servidor2.cerrar()
+
+    print("✅ Todas las pruebas de almacenamiento SQLite pasaron\n")
+
+    # Limpiar base de prueba
+    limpiar_base_prueba()
+
+
+def prueba_formato_negociado():
+    """Prueba el formato compacto y la compresión negociados por conexión"""
+    print("=== PRUEBA 17: Formato Negociado ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba(modo_persistencia='journal')
+    servidor.procesar_lote([
+        {'accion': 'registrar', 'codigo': f'FMT{i:03d}', 'nombre': f'Sensor de temperatura {i}',
+         'tipo': 'Sensor', 'estado': 'disponible'}
+        for i in range(300)
+    ] + [{'accion': 'actualizar', 'codigo': 'FMT007', 'estado': 'en uso'}])
+
+    # Prueba 1: Las listas de equipos viajan por columnas y comprimidas
+    codificador = Codificador('compacto', comprimir=True)
+    respuesta = servidor.consultar_equipos()
+    datos = codificador.codificar(respuesta)
+    datos_json = Codificador().codificar(respuesta)
+    print(f"✓ Tamaño: {len(datos_json)} bytes en JSON, {len(datos)} compacto")
+    assert len(datos) * 5 < len(datos_json)
+    assert codificador.decodificar(datos) == respuesta
+
+    # Prueba 2: Un cliente que negocia recibe los mismos datos
+    cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+    assert cliente.conectar()
+    assert cliente.negociar('compacto', comprimir=True)
+    respuesta = cliente.enviar_solicitud({'accion': 'consultar'})
+    print(f"✓ Consulta compacta: {len(respuesta['equipos'])} equipos")
+    assert respuesta['equipos'] == servidor.consultar_equipos()['equipos']
+    assert 'ultima_actualizacion' not in respuesta['equipos'][0]
+    assert respuesta['equipos'][7]['estado'] == 'en uso'
+    bloques = list(cliente.consultar_en_flujo(tamano_bloque=100))
+    assert sum(len(bloque['equipos']) for bloque in bloques) == 300
+    lote = cliente.enviar_lote([{'accion': 'filtrar', 'estado': 'en uso'}])
+    assert lote[0]['equipos'][0]['codigo'] == 'FMT007'
+
+    # Prueba 3: Un cliente sin negociar sigue usando JSON
+    cliente_json = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+    assert cliente_json.conectar()
+    respuesta = cliente_json.enviar_solicitud({'accion': 'buscar', 'codigo': 'FMT001'})
+    print(f"✓ Cliente JSON: {respuesta['resultado']}")
+    assert respuesta['resultado'] == 'ok'
+
+    # Prueba 4: Formato desconocido
+    assert not cliente_json.negociar('xml')
+    respuesta = cliente_json.enviar_solicitud({'accion': 'negociar', 'formato': 'xml'})
+    print(f"✓ Formato desconocido: {respuesta['mensaje']}")
+    assert respuesta['resultado'] == 'error'
+
+    cliente.desconectar()
+    cliente_json.desconectar()
+    servidor.detener()
+    hilo.join(5)
+
+    print("✅ Todas las pruebas de formato negociado pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_pool_conexiones():
+    """Prueba el cliente con pool de conexiones compartido entre hilos"""
+    print("=== PRUEBA 18: Pool de Conexiones ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba(modo_servidor='asyncio')
+    pool = PoolConexiones(host='127.0.0.1', puerto=servidor.puerto,
+                          tamano=2, timeout=5)
+
+    # Prueba 1: Varios hilos comparten dos conexiones
+    errores = []
+    abiertas = []
+    conexion_original = ConexionInventario.abrir
+
+    def abrir_contando(conexion):
+        abiertas.append(1)
+        conexion_original(conexion)
+
+    ConexionInventario.abrir = abrir_contando
+
+    def trabajador(n):
+        try:
+            for i in range(20):
+                respuesta = pool.registrar(f'POOL{n}-{i}', f'Sensor {i}', 'Sensor')
+                assert respuesta['resultado'] == 'ok', respuesta
+                assert pool.buscar(f'pool{n}-{i}')['equipo']['codigo'] == f'POOL{n}-{i}'
+        except Exception as e:
+            errores.append(e)
+
+    try:
+        hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(8)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+    finally:
+        ConexionInventario.abrir = conexion_original
+    print(f"✓ 320 solicitudes desde 8 hilos con {len(abiertas)} conexiones")
+    assert not errores, errores
+    assert len(abiertas) <= 2
+    assert pool.consultar(limite=1)['total'] == 160
+
+    # Prueba 2: Reconexión automática tras reiniciar el servidor
+    puerto = servidor.puerto
+    servidor.detener()
+    hilo.join(5)
+    servidor = ServidorInventario(
+        host='127.0.0.1', puerto=puerto, archivo_datos='test_inventario.json',
+        modo_servidor='asyncio')
+    hilo = threading.Thread(target=servidor.iniciar, daemon=True)
+    hilo.start()
+    assert servidor.listo.wait(5)
+    respuesta = pool.buscar('POOL0-0')
+    print(f"✓ Reconexión: {respuesta['resultado']}")
+    assert respuesta['resultado'] == 'ok'
+
+    # Prueba 3: Las lecturas se reintentan si la conexión del pool estaba
+    # muerta aunque la solicitud ya se hubiera enviado
+    for solicitud in ({'accion': 'buscar', 'codigo': 'POOL0-0'},
+                      {'accion': 'cambios_desde', 'version': 0, 'limite': 1},
+                      {'accion': 'historial'}, {'accion': 'utilizacion'},
+                      {'accion': 'estadisticas'}):
+        for conexion in list(pool._libres.queue):
+            # El envío funciona, pero la lectura ve la conexión cerrada
+            conexion.socket.shutdown(socket.SHUT_RD)
+        respuesta = pool.solicitar(solicitud)
+        assert respuesta['resultado'] == 'ok', (solicitud, respuesta)
+    print("✓ Lecturas reintentadas tras una conexión muerta")
+
+    # Prueba 4: Sin servidor se lanza ErrorComunicacion
+    pool.cerrar()
+    servidor.detener()
+    hilo.join(5)
+    pool = PoolConexiones(host='127.0.0.1', puerto=puerto, timeout=1)
+    try:
+        pool.buscar('POOL0-0')
+        assert False, "Debió fallar sin servidor"
+    except ErrorComunicacion as e:
+        print(f"✓ Sin servidor: {e}")
+    pool.cerrar()
+
+    print("✅ Todas las pruebas del pool de conexiones pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_cliente_async():
+    """Prueba el cliente asyncio con muchas solicitudes en vuelo"""
+    print("=== PRUEBA 19: Cliente asyncio ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba(modo_servidor='asyncio')
+
+    async def ejecutar():
+        async with ClienteInventarioAsync(host='127.0.0.1', puerto=servidor.puerto,
+                                          conexiones=2, timeout=10) as cliente:
+            # Prueba 1: Registros concurrentes
+            respuestas = await asyncio.gather(*(
+                cliente.registrar(f'ASY{i:03d}', f'Fuente {i}', 'Fuente de poder')
+                for i in range(50)))
+            print(f"✓ Registros concurrentes: {len(respuestas)}")
+            assert all(r['resultado'] == 'ok' for r in respuestas)
+
+            # Prueba 2: Cada respuesta llega a su solicitud
+            respuestas = await asyncio.gather(*(
+                cliente.buscar(f'asy{i % 50:03d}') for i in range(1000)))
+            print(f"✓ 1000 búsquedas en vuelo sobre {len(cliente.conexiones)} conexiones")
+            assert all(r['equipo']['codigo'] == f'ASY{i % 50:03d}'
+                       for i, r in enumerate(respuestas))
+
+            # Prueba 3: Errores de validación y otras acciones
+            respuesta = await cliente.actualizar('ASY001', 'en uso')
+            assert respuesta['resultado'] == 'ok'
+            respuesta = await cliente.actualizar('NOEXISTE', 'en uso')
+            print(f"✓ Error en la respuesta: {respuesta['mensaje']}")
+            assert respuesta['resultado'] == 'error'
+            pagina = await cliente.consultar(limite=10)
+            assert pagina['total'] == 50 and len(pagina['equipos']) == 10
+
+        # Prueba 4: Sin servidor se lanza ErrorComunicacion
+        servidor.detener()
+        hilo.join(5)
+        try:
+            async with ClienteInventarioAsync(host='127.0.0.1', puerto=servidor.puerto):
+                pass
+            assert False, "Debió fallar sin servidor"
+        except ErrorComunicacion as e:
+            print(f"✓ Sin servidor: {e}")
+
+    asyncio.run(ejecutar())
+
+    print("✅ Todas las pruebas del cliente asyncio pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_benchmark():
+    """Prueba los cálculos del benchmark de carga"""
+    print("=== PRUEBA 20: Benchmark ===")
+
+    # Prueba 1: Mezcla de operaciones
+    pesos = parsear_mezcla('buscar=70, registrar=30')
+    print(f"✓ Mezcla: {pesos}")
+    assert pesos == {'buscar': 70.0, 'registrar': 30.0}
+    try:
+        parsear_mezcla('borrar=10')
+        assert False, "Debió rechazar la operación"
+    except ValueError:
+        pass
+
+    # Prueba 2: Percentiles por rango más cercano
+    latencias = [float(i) for i in range(1, 1001)]
+    resumen = resumir(latencias, 2, 10)
+    print(f"✓ Percentiles: p50={resumen['p50_ms']} p99={resumen['p99_ms']} p999={resumen['p999_ms']}")
+    assert (resumen['p50_ms'], resumen['p99_ms'], resumen['p999_ms']) == (500.0, 990.0, 999.0)
+    assert resumen['ops_s'] == 100.0 and resumen['errores'] == 2
+
+    # Prueba 3: Comparación con una ejecución anterior
+    base = {'resultados': {'buscar': {'ops_s': 1000.0, 'p99_ms': 1.0}}}
+    actual = {'resultados': {'buscar': {'ops_s': 950.0, 'p99_ms': 1.5}}}
+    regresiones = comparar(actual, base, tolerancia=10)
+    print(f"✓ Regresiones detectadas: {regresiones}")
+    assert regresiones == ['buscar: p99_ms +50.0%']
+
+    print("✅ Todas las pruebas del benchmark pasaron\n")
+
+
+def prueba_metricas():
+    """Prueba la acción estadisticas y el endpoint de Prometheus"""
+    print("=== PRUEBA 21: Métricas ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    servidor, hilo = iniciar_servidor_prueba(puerto_metricas=0)
+    cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+    assert cliente.conectar()
+    cliente.enviar_solicitud({'accion': 'registrar', 'codigo': 'MET01', 'nombre': 'Sensor',
+                              'tipo': 'Sensor', 'estado': 'disponible'})
+    for _ in range(3):
+        cliente.enviar_solicitud({'accion': 'buscar', 'codigo': 'MET01'})
+    cliente.enviar_solicitud({'accion': 'buscar', 'codigo': 'NOEXISTE'})
+    cliente.enviar_solicitud({'accion': 'inventada'})
+
+    # Prueba 1: Conteos y latencias por acción
+    estadisticas = cliente.enviar_solicitud({'accion': 'estadisticas'})['estadisticas']
+    acciones = estadisticas['acciones']
+    print(f"✓ Solicitudes por acción: { {a: d['solicitudes'] for a, d in acciones.items()} }")
+    assert acciones['buscar']['solicitudes'] == 4
+    assert acciones['buscar']['errores'] == 1
+    assert acciones['buscar']['cantidad'] == 4
+    assert acciones['desconocida']['solicitudes'] == 1
+    assert 'inventada' not in acciones
+
+    # Prueba 2: Lock, persistencia, bytes y conexiones
+    print(f"✓ Escrituras a disco: {estadisticas['persistencia']['cantidad']}, "
+          f"esperas por el lock: {estadisticas['espera_lock']['cantidad']}")
+    assert estadisticas['persistencia']['cantidad'] == 1
+    assert estadisticas['espera_lock']['cantidad'] >= 1
+    assert estadisticas['bytes']['recibidos'] > 0
+    assert estadisticas['bytes']['enviados'] > 0
+    assert estadisticas['conexiones']['activas'] == 1
+    assert estadisticas['equipos'] == 1
+
+    # Prueba 3: Formato de texto de Prometheus por HTTP
+    with urllib.request.urlopen(
+            f'http://127.0.0.1:{servidor.puerto_metricas}/metrics', timeout=5) as r:
+        texto = r.read().decode('utf-8')
+    print(f"✓ Endpoint de Prometheus: {len(texto.splitlines())} líneas")
+    assert 'inventario_solicitudes_total{accion="buscar"} 4' in texto
+    assert 'inventario_latencia_segundos_count{accion="buscar"} 4' in texto
+    assert 'inventario_equipos 1' in texto
+
+    cliente.desconectar()
+    servidor.detener()
+    hilo.join(5)
+
+    print("✅ Todas las pruebas de métricas pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_registro_asincrono():
+    """Prueba el log por cola, el muestreo por acción y la rotación"""
+    print("=== PRUEBA 22: Log Asíncrono ===")
+
+    def limpiar():
+        for archivo in glob.glob('test_inventario.json') + glob.glob('test_servidor.log*'):
+            os.remove(archivo)
+
+    limpiar()
+    raiz = logging.getLogger()
+    nivel_original = raiz.level
+
+    # Prueba 1: Muestreo de una de cada N solicitudes
+    muestreo = MuestreoAcciones(parsear_muestreo('buscar=3, consultar=0'))
+    assert [muestreo.registrar('buscar') for _ in range(6)] == [True, False, False] * 2
+    assert not muestreo.registrar('consultar')
+    assert muestreo.registrar('registrar')
+    assert not MuestreoAcciones({'*': 0}).registrar('registrar')
+    for texto in ('buscar', 'buscar=-1', '=5'):
+        try:
+            parsear_muestreo(texto)
+            assert False, f"'{texto}' debió rechazarse"
+        except ValueError:
+            pass
+    print("✓ Muestreo por acción correcto")
+
+    # Prueba 2: Con la cola llena se descarta en lugar de bloquear
+    manejador = ManejadorCola(queue.Queue(2))
+    for i in range(5):
+        manejador.handle(logging.makeLogRecord({'msg': f'linea {i}'}))
+    assert manejador.descartados == 3
+    print(f"✓ Registros descartados con la cola llena: {manejador.descartados}")
+
+    # Prueba 3: Las solicitudes muestreadas no llegan al archivo
+    escritor = configurar_registro('test_servidor.log', 'INFO', consola=False)
+    try:
+        servidor, hilo = iniciar_servidor_prueba(muestreo_log={'buscar': 0})
+        cliente = ClienteInventario(host='127.0.0.1', puerto=servidor.puerto)
+        assert cliente.conectar()
+        cliente.enviar_solicitud({'accion': 'registrar', 'codigo': 'LOG01', 'nombre': 'Fuente',
+                                  'tipo': 'Fuente', 'estado': 'disponible'})
+        for _ in range(5):
+            cliente.enviar_solicitud({'accion': 'buscar', 'codigo': 'LOG01'})
+        cliente.desconectar()
+        servidor.detener()
+        hilo.join(5)
+    finally:
+        detener_registro(escritor)
+    assert not any(isinstance(m, ManejadorCola) for m in raiz.handlers)
+
+    with open('test_servidor.log', encoding='utf-8') as f:
+        contenido = f.read()
+    print(f"✓ Líneas en el log: {len(contenido.splitlines())}")
+    assert 'Equipo registrado: LOG01' in contenido
+    assert '"accion": "registrar"' in contenido and '-> ok en' in contenido
+    assert '"accion": "buscar"' not in contenido
+
+    # Prueba 4: Rotación por tamaño
+    escritor = configurar_registro('test_servidor.log', 'INFO', tamano_maximo=2000,
+                                   respaldos=2, consola=False)
+    try:
+        for i in range(200):
+            logging.info(f"Línea de relleno {i:04d}")
+        logging.debug("No debe escribirse")
+    finally:
+        detener_registro(escritor)
+    rotados = sorted(glob.glob('test_servidor.log*'))
+    print(f"✓ Archivos tras rotar: {rotados}")
+    assert rotados == ['test_servidor.log', 'test_servidor.log.1', 'test_servidor.log.2']
+    with open('test_servidor.log', encoding='utf-8') as f:
+        contenido = f.read()
+    assert 'Línea de relleno 0199' in contenido
+    assert 'No debe escribirse' not in contenido
+
+    raiz.setLevel(nivel_original)
+    print("✅ Todas las pruebas del log asíncrono pasaron\n")
+
+    # Limpiar archivos de prueba
+    limpiar()
+
+
+def prueba_escritura_agrupada():
+    """Prueba la escritura agrupada y los modos de durabilidad"""
+    print("=== PRUEBA 23: Escritura Agrupada ===")
+
+    def limpiar():
+        for archivo in glob.glob('test_inventario.json*'):
+            os.remove(archivo)
+
+    def equipos_en_disco():
+        with open('test_inventario.json', encoding='utf-8') as f:
+            return {e['codigo'] for e in json.load(f)}
+
+    limpiar()
+
+    # Prueba 1: Varios cambios concurrentes en pocas escrituras
+    almacen = AlmacenamientoJSON('test_inventario.json', durabilidad='disco', ventana_ms=50)
+    almacen.cargar()
+    escrituras = []
+    guardar_original = almacen.guardar_inventario
+
+    def guardar_contando(inventario=None):
+        escrituras.append(len(inventario))
+        return guardar_original(inventario)
+
+    almacen.guardar_inventario = guardar_contando
+    lock = threading.Lock()
+    marcas = []
+
+    def registrar(i):
+        with lock:  # El servidor llama a las escrituras con su lock tomado
+            almacen.insertar({'codigo': f'GC{i:02d}', 'nombre': 'Sonda', 'tipo': 'Sonda',
+                              'estado': 'disponible', 'fecha_registro': '2024-01-01 00:00:00'})
+            marca = almacen.marca_persistencia()
+        assert almacen.esperar_persistencia(marca, timeout=5)
+        marcas.append(marca)
+        assert f'GC{i:02d}' in equipos_en_disco()  # Confirmado solo tras escribir
+
+    hilos = [threading.Thread(target=registrar, args=(i,)) for i in range(20)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    print(f"✓ 20 cambios en {len(escrituras)} escrituras: {escrituras}")
+    assert len(marcas) == 20 and len(escrituras) < 20
+    assert len(equipos_en_disco()) == 20
+    almacen.cerrar()
+    assert not os.path.exists('test_inventario.json.tmp')
+
+    # Prueba 2: 'memoria' confirma sin esperar y cerrar escribe lo pendiente
+    limpiar()
+    almacen = AlmacenamientoJSON('test_inventario.json', modo_persistencia='journal',
+                                 durabilidad='memoria', ventana_ms=10000)
+    almacen.cargar()
+    almacen.insertar({'codigo': 'MEM01', 'nombre': 'Sonda', 'tipo': 'Sonda',
+                      'estado': 'disponible', 'fecha_registro': '2024-01-01 00:00:00'})
+    assert almacen.marca_persistencia() == 0
+    assert not os.path.exists('test_inventario.json.journal')
+    almacen.cerrar()
+    print("✓ Durabilidad 'memoria': lo pendiente se escribe al cerrar")
+    assert equipos_en_disco() == {'MEM01'}
+
+    # Prueba 3: El servidor responde después de escribir, en ambos modos
+    for modo in ('hilos', 'asyncio'):
+        limpiar()
+        servidor, hilo = iniciar_servidor_prueba(
+            modo_servidor=modo, durabilidad='disco', ventana_ms=20)
+        with PoolConexiones('127.0.0.1', servidor.puerto, tamano=2) as pool:
+            assert pool.registrar('DUR01', 'Fuente', 'Fuente')['resultado'] == 'ok'
+            assert 'DUR01' in equipos_en_disco()
+            assert pool.actualizar('DUR01', 'en uso')['resultado'] == 'ok'
+        with open('test_inventario.json', encoding='utf-8') as f:
+            assert json.load(f)[0]['estado'] == 'en uso'
+        servidor.detener()
+        hilo.join(5)
+        print(f"✓ Respuestas tras la escritura en modo {modo}")
+
+    # Prueba 4: El escritor no guarda un cambio antes que su transición,
+    # aunque su ventana venza en medio de un lote
+    limpiar()
+    almacen = AlmacenamientoJSON('test_inventario.json', durabilidad='memoria',
+                                 ventana_ms=200)
+    almacen.cargar()
+    almacen.insertar({'codigo': 'LT01', 'nombre': 'Sonda', 'tipo': 'Sonda',
+                      'estado': 'disponible', 'fecha_registro': '2024-01-01 00:00:00'})
+    almacen.iniciar_lote()
+    almacen.actualizar(con_cambios(almacen.obtener('LT01'), estado='en uso',
+                                   ultima_actualizacion='2024-01-01 01:00:00'))
+    time.sleep(0.4)  # Vence la ventana del escritor con el lote abierto
+    if os.path.exists('test_inventario.json'):
+        with open('test_inventario.json', encoding='utf-8') as f:
+            assert json.load(f)[0]['estado'] == 'disponible'
+    almacen.terminar_lote()
+    almacen.cerrar()
+    with open('test_inventario.json', encoding='utf-8') as f:
+        assert json.load(f)[0]['estado'] == 'en uso'
+    with open('test_inventario.json.historial', encoding='utf-8') as f:
+        assert [json.loads(linea)['estado'] for linea in f] == ['en uso']
+    print("✓ Ningún cambio llega al disco antes que su transición")
+
+    # Prueba 5: Durabilidad inválida
+    try:
+        AlmacenamientoJSON('test_inventario.json', durabilidad='nunca')
+        assert False, "Debió rechazar la durabilidad"
+    except ValueError as e:
+        print(f"✓ Durabilidad inválida: {e}")
+
+    print("✅ Todas las pruebas de escritura agrupada pasaron\n")
+
+    # Limpiar archivos de prueba
+    limpiar()
+
+
+def prueba_multiproceso():
+    """Prueba varios procesos aceptando en el mismo puerto con SQLite compartido"""
+    print("=== PRUEBA 24: Servidor Multiproceso ===")
+
+    limpiar_base_prueba()
+
+    # Prueba 1: Solo con un almacenamiento compartido entre procesos
+    try:
+        ServidorMultiproceso(2, almacenamiento='json')
+        assert False, "Debió rechazar el almacenamiento JSON"
+    except ValueError as e:
+        print(f"✓ Almacenamiento JSON rechazado: {e}")
+
+    servidor = ServidorMultiproceso(
+        2, host='127.0.0.1', puerto=0, archivo_datos='test_inventario.db')
+    hilo = threading.Thread(target=servidor.iniciar, daemon=True)
+    hilo.start()
+    assert servidor.listo.wait(60), "Los procesos no iniciaron a tiempo"
+
+    try:
+        # Prueba 2: Las conexiones se reparten entre los procesos
+        pids = set()
+        for i in range(30):
+            conexion = ConexionInventario('127.0.0.1', servidor.puerto)
+            conexion.abrir()
+            respuesta = conexion.solicitar({
+                'accion': 'registrar', 'codigo': f'MP{i:02d}', 'nombre': 'Osciloscopio',
+                'tipo': 'Instrumento', 'estado': 'disponible'})
+            assert respuesta['resultado'] == 'ok'
+            pids.add(conexion.solicitar({'accion': 'estadisticas'})['estadisticas']['proceso'])
+            conexion.cerrar()
+        print(f"✓ 30 conexiones atendidas por {len(pids)} procesos")
+        assert pids == set(servidor.pids.values())
+
+        # Prueba 3: Todos ven el mismo inventario
+        with PoolConexiones('127.0.0.1', servidor.puerto, tamano=4) as pool:
+            totales = {pool.consultar(limite=1)['total'] for _ in range(8)}
+            duplicado = pool.registrar('mp00', 'Otro', 'Otro')
+        print(f"✓ Total visto desde cualquier proceso: {totales}")
+        assert totales == {30}
+        assert duplicado['resultado'] == 'error'
+
+        # Prueba 4: Un proceso que muere se reemplaza
+        pid_caido = servidor.pids[0]
+        os.kill(pid_caido, signal.SIGKILL)
+        limite = time.time() + 60
+        while servidor.pids.get(0) in (None, pid_caido) and time.time() < limite:
+            time.sleep(0.1)
+        print(f"✓ Proceso {pid_caido} reemplazado por {servidor.pids.get(0)}")
+        assert servidor.pids.get(0) not in (None, pid_caido)
+        with PoolConexiones('127.0.0.1', servidor.puerto, tamano=4) as pool:
+            assert all(pool.buscar('MP29')['resultado'] == 'ok' for _ in range(8))
+    finally:
+        servidor.detener()
+        hilo.join(30)
+
+    # Prueba 5: Cierre ordenado de todos los procesos
+    codigos = [p.exitcode for p in servidor.trabajadores.values()]
+    print(f"✓ Códigos de salida: {codigos}")
+    assert codigos == [0, 0]
+
+    print("✅ Todas las pruebas del servidor multiproceso pasaron\n")
+
+    limpiar_base_prueba()
+
+
+def prueba_suscripciones():
+    """Prueba la acción suscribir y el envío de eventos de cambios"""
+    print("=== PRUEBA 25: Suscripciones ===")
+
+    # Limpiar archivo de prueba si existe
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+    # Prueba 1: Filtros y desborde de la cola de una suscripción
+    publicador = PublicadorEventos()
+    mantenimiento = publicador.suscribir(estado='en mantenimiento', capacidad=2)
+    osciloscopios = publicador.suscribir(tipo='OSCILOSCOPIO')
+    equipo = {'codigo': 'F1', 'tipo': 'Osciloscopio', 'estado': 'disponible'}
+    publicador.publicar('registrado', equipo)
+    publicador.publicar('actualizado', dict(equipo, estado='en mantenimiento'), 'disponible')
+    publicador.publicar('actualizado', equipo, 'en mantenimiento')  # Sale del estado
+    publicador.publicar('registrado', {'codigo': 'F2', 'tipo': 'Fuente', 'estado': 'disponible'})
+    assert len(osciloscopios.tomar_pendientes()) == 3
+    assert len(mantenimiento.pendientes) == 2 and not mantenimiento.desbordada
+    publicador.publicar('actualizado', dict(equipo, estado='en mantenimiento'), 'disponible')
+    assert mantenimiento.desbordada and mantenimiento.cerrada
+    assert publicador.total() == 1
+    print("✓ Filtros por estado y tipo; suscripción desbordada cerrada")
+
+    for modo in ('hilos', 'asyncio'):
+        if os.path.exists('test_inventario.json'):
+            os.remove('test_inventario.json')
+        servidor = ServidorInventario(host='127.0.0.1', puerto=0,
+                                      archivo_datos='test_inventario.json', modo_servidor=modo)
+        servidor.intervalo_latido = 0.2
+        hilo = threading.Thread(target=servidor.iniciar, daemon=True)
+        hilo.start()
+        assert servidor.listo.wait(5)
+
+        # Prueba 2: Un suscriptor sin filtros y otro por estado
+        todos = ConexionInventario('127.0.0.1', servidor.puerto)
+        assert todos.suscribir()['resultado'] == 'ok'
+        filtrado = ConexionInventario('127.0.0.1', servidor.puerto)
+        respuesta = filtrado.suscribir(estado='En mantenimiento')
+        assert respuesta['filtros'] == {'estado': 'en mantenimiento', 'tipo': None}
+
+        with PoolConexiones('127.0.0.1', servidor.puerto, tamano=1) as pool:
+            assert pool.solicitar({'accion': 'estadisticas'})['estadisticas']['suscripciones'] == 2
+            pool.registrar('EV01', 'Osciloscopio', 'Osciloscopio')
+            pool.actualizar('EV01', 'en mantenimiento')
+            pool.actualizar('EV01', 'disponible')
+            pool.lote([{'accion': 'registrar', 'codigo': 'EV02', 'nombre': 'Fuente',
+                        'tipo': 'Fuente', 'estado': 'disponible'}])
+
+            # Prueba 3: Suscribir no se admite dentro de un lote ni con estado inválido
+            anidada = pool.lote([{'accion': 'suscribir'}])['respuestas'][0]
+            assert anidada['resultado'] == 'error'
+            assert pool.solicitar({'accion': 'suscribir', 'estado': 'roto'})['resultado'] == 'error'
+
+        eventos = todos.eventos()
+        recibidos = [(e['evento'], e['equipo']['codigo'], e['equipo']['estado'])
+                     for e in (next(eventos) for _ in range(4))]
+        print(f"✓ Eventos en orden ({modo}): {recibidos}")
+        assert recibidos == [('registrado', 'EV01', 'disponible'),
+                             ('actualizado', 'EV01', 'en mantenimiento'),
+                             ('actualizado', 'EV01', 'disponible'),
+                             ('registrado', 'EV02', 'disponible')]
+        eventos = filtrado.eventos()
+        estados_anteriores = [next(eventos)['estado_anterior'] for _ in range(2)]
+        assert estados_anteriores == ['disponible', 'en mantenimiento']
+
+        # Prueba 4: Latidos mientras no hay cambios
+        assert todos.recibir() == {'evento': 'latido'}
+
+        # Prueba 5: Al detener el servidor se cierran las suscripciones
+        servidor.detener()
+        hilo.join(5)
+        try:
+            todos.recibir()
+            todos.recibir()
+            assert False, "La suscripción debió cerrarse"
+        except ErrorComunicacion:
+            print(f"✓ Suscripción cerrada al detener el servidor ({modo})")
+        todos.cerrar()
+        filtrado.cerrar()
+
+    # Prueba 6: Con varios procesos sobre la misma base el suscriptor
+    # recibe también los cambios de los demás, sin repetir los propios
+    limpiar_base_prueba()
+    servidores = []
+    for _ in range(2):
+        servidor = ServidorInventario(host='127.0.0.1', puerto=0,
+                                      archivo_datos='test_inventario.db',
+                                      almacenamiento='sqlite', reutilizar_puerto=True)
+        servidor.intervalo_latido = 0.5
+        hilo = threading.Thread(target=servidor.iniciar, daemon=True)
+        hilo.start()
+        assert servidor.listo.wait(5)
+        servidores.append((servidor, hilo))
+    (propio, _), (otro, _) = servidores
+    suscriptor = ConexionInventario('127.0.0.1', propio.puerto)
+    assert suscriptor.suscribir()['resultado'] == 'ok'
+    with PoolConexiones('127.0.0.1', otro.puerto, tamano=1) as pool:
+        pool.registrar('MP01', 'Fuente', 'Fuente')
+        time.sleep(0.2)
+        pool.actualizar('MP01', 'en uso')
+    time.sleep(0.2)
+    with PoolConexiones('127.0.0.1', propio.puerto, tamano=1) as pool:
+        pool.actualizar('MP01', 'disponible')
+    recibidos = []
+    for _ in range(10):  # Sin los eventos de otro proceso solo llegarían latidos
+        evento = suscriptor.recibir()
+        if evento['evento'] != 'latido':
+            recibidos.append((evento['evento'], evento['equipo']['estado'],
+                              evento.get('estado_anterior')))
+        if len(recibidos) == 3:
+            break
+    assert recibidos == [('registrado', 'disponible', None),
+                         ('actualizado', 'en uso', 'disponible'),
+                         ('actualizado', 'disponible', 'en uso')], recibidos
+    assert suscriptor.recibir() == {'evento': 'latido'}
+    suscriptor.cerrar()
+    for servidor, hilo in servidores:
+        servidor.detener()
+        hilo.join(5)
+    limpiar_base_prueba()
+    print("✓ Eventos de los cambios hechos en otro proceso")
+
+    print("✅ Todas las pruebas de suscripciones pasaron\n")
+
+    # Limpiar archivo de prueba
+    if os.path.exists('test_inventario.json'):
+        os.remove('test_inventario.json')
+
+
+def prueba_cambios_desde():
+    """Prueba las versiones de los cambios y la acción cambios_desde"""
+    print("=== PRUEBA 26: Cambios desde una versión ===")
+
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+    for archivo_datos, almacenamiento in (('test_inventario.json', 'json'),
+                                          ('test_inventario.db', 'sqlite')):
+        servidor = ServidorInventario(
+            puerto=5556, archivo_datos=archivo_datos, almacenamiento=almacenamiento)
+        servidor.registrar_equipo({'codigo': 'V01', 'nombre': 'Osciloscopio',
+                                   'tipo': 'Osciloscopio', 'estado': 'disponible'})
+        servidor.registrar_equipo({'codigo': 'V02', 'nombre': 'Fuente',
+                                   'tipo': 'Fuente', 'estado': 'disponible'})
+
+        # Prueba 1: Cada cambio lleva una versión mayor
+        consulta = servidor.consultar_equipos()
+        assert consulta['version'] == 2
+        assert [e['version'] for e in consulta['equipos']] == [1, 2]
+        respuesta = servidor.actualizar_estado('V01', 'en uso')
+        assert respuesta['equipo']['version'] == 3
+
+        # Prueba 2: Solo vuelven los equipos cambiados, una vez cada uno
+        servidor.actualizar_estado('V01', 'disponible')
+        cambios = servidor.cambios_desde(consulta['version'])
+        assert [e['codigo'] for e in cambios['equipos']] == ['V01']
+        assert cambios['equipos'][0]['estado'] == 'disponible'
+        assert cambios['version'] == 4 and not cambios['mas']
+        assert servidor.cambios_desde(4)['equipos'] == []
+
+        # Prueba 3: Con límite se avanza por partes hasta 'mas' falso
+        servidor.registrar_equipo({'codigo': 'V03', 'nombre': 'Multímetro',
+                                   'tipo': 'Multímetro', 'estado': 'disponible'})
+        parte = servidor.cambios_desde(0, limite=2)
+        assert [e['codigo'] for e in parte['equipos']] == ['V02', 'V01']
+        assert parte['mas'] and parte['version'] == 4
+        parte = servidor.cambios_desde(parte['version'], limite=2)
+        assert [e['codigo'] for e in parte['equipos']] == ['V03']
+        assert parte['version'] == 5 and not parte['mas']
+
+        # Prueba 4: Una versión futura o inválida es un error
+        assert servidor.cambios_desde(6)['resultado'] == 'error'
+        assert servidor.cambios_desde('x')['resultado'] == 'error'
+        assert servidor.despachar({'accion': 'cambios_desde', 'version': 5})['resultado'] == 'ok'
+        servidor.almacen.cerrar()
+
+        # Prueba 5: Las versiones se conservan al reiniciar
+        servidor = ServidorInventario(
+            puerto=5556, archivo_datos=archivo_datos, almacenamiento=almacenamiento)
+        assert servidor.cambios_desde(3)['version'] == 5
+        assert [e['codigo'] for e in servidor.cambios_desde(3)['equipos']] == ['V01', 'V03']
+        assert servidor.actualizar_estado('V02', 'en uso')['equipo']['version'] == 6
+        servidor.almacen.cerrar()
+        print(f"✓ Versiones y cambios_desde con almacenamiento {almacenamiento}")
+
+    # Prueba 6: Si el registro de cambios ya descartó la versión, se recorre el inventario
+    almacen = AlmacenamientoJSON('test_inventario.json', capacidad_cambios=2)
+    almacen.cargar()
+    for estado in ('en uso', 'disponible', 'en uso'):
+        almacen.actualizar(dict(almacen.obtener('V03'), estado=estado))
+    assert almacen._piso_registro == 7
+    equipos, hasta, mas = almacen.cambios_desde(5, 10)
+    assert [e['codigo'] for e in equipos] == ['V02', 'V03'] and hasta == 9
+    equipos, _, _ = almacen.cambios_desde(7, 10)
+    assert [(e['codigo'], e['version']) for e in equipos] == [('V03', 9)]
+    almacen.cerrar()
+    print("✓ Registro de cambios acotado con respaldo por recorrido")
+
+    print("✅ Todas las pruebas de cambios desde una versión pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+
+def prueba_registros_compactos():
+    """Prueba la representación de los equipos en memoria con __slots__"""
+    print("=== PRUEBA 27: Registros compactos en memoria ===")
+
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+
+    # Prueba 1: El registro se lee como diccionario y vuelve a dict sin pérdidas
+    datos = {'codigo': 'REG01', 'nombre': 'Osciloscopio', 'tipo': 'Osciloscopio',
+             'estado': 'en uso', 'fecha_registro': '2024-03-05 08:09:10',
+             'ultima_actualizacion': '2024-03-06 17:00:00', 'version': 4,
+             'ubicacion': 'Lab 2'}
+    equipo = Equipo.desde_dict(datos)
+    assert not hasattr(equipo, '__dict__')
+    assert equipo.registro == 20240305080910
+    assert equipo['fecha_registro'] == '2024-03-05 08:09:10'
+    assert equipo.a_dict() == datos and dict(equipo) == datos and equipo == datos
+    assert equipo.get('ultima_actualizacion') and 'ubicacion' in equipo
+    assert Equipo.desde_dict({'codigo': 'X', 'nombre': 'X', 'tipo': 'X', 'estado': 'disponible',
+                              'fecha_registro': '05/03/2024'})['fecha_registro'] == '05/03/2024'
+    copia = equipo.reemplazar(estado='disponible', ultima_actualizacion='2024-03-07 09:00:00')
+    assert copia['estado'] == 'disponible' and equipo['estado'] == 'en uso'
+    assert copia.actualizacion == 20240307090000 and copia.otros == {'ubicacion': 'Lab 2'}
+    print("✓ Conversión entre registro y diccionario sin pérdidas")
+
+    # Prueba 2: Tipo y estado se comparten entre equipos; ocupa menos que un dict
+    almacen = AlmacenamientoMemoria()
+    equipos = [{'codigo': f'REG{i:04d}', 'nombre': f'Fuente {i}',
+                'tipo': ''.join(['Fuente', ' de poder']), 'estado': 'DISPONIBLE'.lower(),
+                'fecha_registro': f'2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}',
+                'version': i + 1}
+               for i in range(2000)]
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    registros = [Equipo.desde_dict(equipo) for equipo in equipos]
+    con_registros = tracemalloc.get_traced_memory()[0] - antes
+    diccionarios = [equipo.a_dict() for equipo in registros]
+    con_diccionarios = tracemalloc.get_traced_memory()[0] - antes - con_registros
+    tracemalloc.stop()
+    print(f"✓ 2000 equipos: {con_registros // 1024} KiB como registros, "
+          f"{con_diccionarios // 1024} KiB como diccionarios")
+    assert con_registros * 2 < con_diccionarios
+    for equipo in diccionarios:
+        almacen.insertar(equipo)
+    primero, ultimo = almacen.obtener('REG0000'), almacen.obtener('REG1999')
+    assert primero.tipo is ultimo.tipo and primero.estado is ultimo.estado
+
+    # Prueba 3: El filtro por fecha usa las fechas enteras
+    total, _ = almacen.filtrar(fecha_desde='2024-01-01 00:01:00', fecha_hasta='2024-01-01 00:01:59')
+    assert total == 60
+    assert almacen.filtrar(fecha_hasta='2024-01-01')[0] == 2000
+    assert almacen.filtrar(fecha_desde='2024-01-02')[0] == 0
+    print("✓ Filtro por fecha sobre fechas enteras")
+
+    # Prueba 4: Las respuestas y el archivo JSON llevan diccionarios normales
+    servidor = ServidorInventario(puerto=5556, archivo_datos='test_inventario.json')
+    servidor.registrar_equipo({'codigo': 'REG01', 'nombre': 'Osciloscopio',
+                               'tipo': 'Osciloscopio', 'estado': 'disponible'})
+    respuesta = servidor.actualizar_estado('REG01', 'en uso')
+    assert isinstance(respuesta['equipo'], Equipo)
+    for formato in ('json', 'compacto'):
+        codificador = Codificador(formato)
+        recibida = codificador.decodificar(codificador.codificar(servidor.consultar_equipos()))
+        assert recibida['equipos'][0]['estado'] == 'en uso'
+        assert recibida['equipos'][0]['fecha_registro'] == respuesta['equipo']['fecha_registro']
+    with open('test_inventario.json', 'r', encoding='utf-8') as f:
+        guardado = json.load(f)
+    assert guardado[0]['ultima_actualizacion'] == respuesta['equipo']['ultima_actualizacion']
+    print("✓ Respuestas y archivo JSON con los campos de siempre")
+
+    print("✅ Todas las pruebas de registros compactos pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+
+
+def prueba_carga_diferida():
+    """Prueba el arranque desde el volcado mientras el inventario se carga"""
+    print("=== PRUEBA 28: Carga diferida ===")
+
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+
+    # Prueba 1: Al compactar el journal se escribe el volcado
+    almacen = AlmacenamientoJSON('test_inventario.json', modo_persistencia='journal',
+                                 compactar_cada=500, carga_diferida=True)
+    almacen.cargar()
+    for i in range(500):
+        almacen.insertar({'codigo': f'CD{i:03d}', 'nombre': f'Sensor {i}', 'tipo': 'Sensor',
+                          'estado': 'disponible', 'fecha_registro': '2024-05-01 10:00:00'})
+    assert os.path.exists('test_inventario.json.volcado')
+    # Cambios posteriores quedan solo en el journal; luego una "caída"
+    almacen.actualizar(dict(almacen.obtener('CD007'), estado='en uso'))
+    almacen.insertar({'codigo': 'CD500', 'nombre': 'Fuente', 'tipo': 'Fuente',
+                      'estado': 'disponible', 'fecha_registro': '2024-05-02 10:00:00'})
+    version = almacen.version_actual()
+    almacen._journal.close()
+    print("✓ Volcado escrito al compactar el journal")
+
+    # Prueba 2: Se atiende desde el volcado, con el journal superpuesto
+    continuar = threading.Event()
+    almacen = AlmacenamientoJSON('test_inventario.json', modo_persistencia='journal',
+                                 compactar_cada=500, carga_diferida=True)
+    completar = almacen.completar_carga
+    almacen.completar_carga = lambda: (continuar.wait(5), completar())
+    almacen.cargar()
+    assert not almacen.esperar_carga(0)
+    assert almacen.total() == 501 and almacen.version_actual() == version
+    assert almacen.obtener('cd007')['estado'] == 'en uso'
+    assert almacen.obtener('CD499')['nombre'] == 'Sensor 499'
+    assert almacen.obtener('CD500')['tipo'] == 'Fuente' and almacen.obtener('XX') is None
+    equipos, siguiente, total = almacen.pagina('499', 10)
+    assert [e['codigo'] for e in equipos] == ['CD499', 'CD500'] and siguiente is None
+    assert [e['estado'] for e in almacen.pagina('6', 2)[0]] == ['disponible', 'en uso']
+    print("✓ Lecturas atendidas desde el volcado mientras se carga")
+
+    # Prueba 3: Las escrituras esperan a que termine la carga
+    resultado = []
+    escritor = threading.Thread(target=lambda: resultado.append(almacen.insertar(
+        {'codigo': 'CD501', 'nombre': 'Carga', 'tipo': 'Carga', 'estado': 'disponible'})))
+    escritor.start()
+    escritor.join(0.2)
+    assert escritor.is_alive() and not resultado
+    continuar.set()
+    escritor.join(5)
+    assert almacen.esperar_carga(0) and resultado[0]['version'] == version + 1
+    assert almacen.filtrar(estado='en uso')[0] == 1
+    assert almacen.cambios_desde(version, 10)[0][0]['codigo'] == 'CD501'
+    almacen.cerrar()
+    print("✓ Escrituras después de la carga; índices completos")
+
+    # Prueba 4: Si el JSON cambió después del volcado, se carga el JSON
+    almacen = AlmacenamientoJSON('test_inventario.json', carga_diferida=True)
+    almacen.cargar()
+    almacen.actualizar(dict(almacen.obtener('CD000'), estado='fuera de servicio'))
+    almacen.cerrar()  # Escribe un volcado nuevo
+    with open('test_inventario.json', 'a', encoding='utf-8') as f:
+        f.write('\n')
+    almacen = AlmacenamientoJSON('test_inventario.json', carga_diferida=True)
+    almacen.cargar()
+    assert almacen.esperar_carga(0) and almacen.total() == 502
+    assert almacen.obtener('CD000')['estado'] == 'fuera de servicio'
+    almacen.cerrar()
+    print("✓ Volcado desactualizado ignorado")
+
+    # Prueba 5: El servidor responde mientras carga
+    servidor = ServidorInventario(puerto=5556, archivo_datos='test_inventario.json',
+                                  carga_diferida=True)
+    consulta = servidor.consultar_equipos(limite=5)
+    assert consulta['total'] == 502 and len(consulta['equipos']) == 5
+    assert servidor.buscar_equipo('CD500')['resultado'] == 'ok'
+    servidor.almacen.esperar_carga()
+    assert servidor.obtener_estadisticas()['estadisticas']['cargando'] is False
+    servidor.almacen.cerrar()
+    print("✓ Servidor con carga diferida")
+
+    # Prueba 6: En modo asyncio lo que espera la carga no frena a las
+    # demás conexiones
+    servidor, hilo = iniciar_servidor_prueba(modo_servidor='asyncio', carga_diferida=True)
+    servidor.almacen.esperar_carga()
+    servidor.almacen._cargado.clear()  # Como si la carga siguiera en curso
+    respuestas = {}
+
+    def solicitar(solicitud):
+        conexion = ConexionInventario('127.0.0.1', servidor.puerto, timeout=5)
+        try:
+            respuestas[solicitud['accion']] = conexion.solicitar(solicitud)
+        finally:
+            conexion.cerrar()
+
+    hilos = [threading.Thread(target=solicitar, args=(solicitud,)) for solicitud in (
+        {'accion': 'filtrar', 'estado': 'en uso'},
+        {'accion': 'registrar', 'codigo': 'CD502', 'nombre': 'Carga', 'tipo': 'Carga',
+         'estado': 'disponible'})]
+    for hilo_cliente in hilos:
+        hilo_cliente.start()
+    time.sleep(0.2)
+    solicitar({'accion': 'buscar', 'codigo': 'CD500'})
+    assert set(respuestas) == {'buscar'} and respuestas['buscar']['resultado'] == 'ok'
+    servidor.almacen._cargado.set()
+    for hilo_cliente in hilos:
+        hilo_cliente.join(5)
+    assert respuestas['filtrar']['resultado'] == 'ok'
+    assert respuestas['registrar']['resultado'] == 'ok'
+    servidor.detener()
+    hilo.join(5)
+    print("✓ El bucle de eventos sigue atendiendo mientras se carga")
+
+    print("✅ Todas las pruebas de carga diferida pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+
+
+def prueba_cache_respuestas():
+    """Prueba la caché de respuestas codificadas de consultar y buscar"""
+    print("=== PRUEBA 29: Caché de respuestas ===")
+
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+    # Prueba 1: LRU acotada en bytes con invalidación por código
+    cache = CacheRespuestas(capacidad=100)
+    cache.guardar(('buscar', 'A'), b'a' * 30, cache.generacion, 'A')
+    cache.guardar(('buscar', 'B'), b'b' * 30, cache.generacion, 'B')
+    cache.guardar(('consultar',), b'c' * 30, cache.generacion)
+    assert cache.obtener(('buscar', 'A')) == b'a' * 30  # A pasa a ser la más reciente
+    cache.guardar(('buscar', 'C'), b'x' * 30, cache.generacion, 'C')
+    assert cache.obtener(('buscar', 'B')) is None and cache.ocupado == 90
+    cache.guardar(('grande',), b'g' * 51, cache.generacion)
+    assert cache.obtener(('grande',)) is None  # Más de la mitad de la capacidad
+    cache.invalidar('A')
+    assert cache.obtener(('buscar', 'A')) is None and cache.obtener(('consultar',)) is None
+    assert cache.obtener(('buscar', 'C')) == b'x' * 30
+    # Una respuesta armada antes de una invalidación no se guarda
+    generacion = cache.generacion
+    cache.invalidar('D')
+    cache.guardar(('buscar', 'D'), b'd', generacion, 'D')
+    assert cache.obtener(('buscar', 'D')) is None and cache.total() == 1
+    print("✓ LRU acotada en bytes e invalidación por código")
+
+    for archivo_datos, almacenamiento in (('test_inventario.json', 'json'),
+                                          ('test_inventario.db', 'sqlite')):
+        servidor = ServidorInventario(
+            puerto=5556, archivo_datos=archivo_datos, almacenamiento=almacenamiento)
+        for codigo in ('K01', 'K02'):
+            servidor.registrar_equipo({'codigo': codigo, 'nombre': 'Osciloscopio',
+                                       'tipo': 'Osciloscopio', 'estado': 'disponible'})
+        conexion = {'codificador': Codificador()}
+
+        def responder(solicitud):
+            mensaje = conexion['codificador'].codificar(solicitud)
+            return list(servidor.generar_respuestas(mensaje, conexion))
+
+        # Prueba 2: La segunda consulta sale de la caché con los mismos bytes
+        primera = responder({'accion': 'consultar'})
+        assert isinstance(primera[0], bytes)
+        assert responder({'accion': 'consultar'}) == primera
+        cache = servidor.obtener_estadisticas()['estadisticas']['cache']
+        assert cache['aciertos'] == 1 and cache['fallos'] == 1 and cache['respuestas'] == 1
+        assert json.loads(primera[0])['version'] == 2
+
+        # Prueba 3: Actualizar un equipo invalida su búsqueda y las consultas, no las demás
+        responder({'accion': 'buscar', 'codigo': 'k01'})
+        responder({'accion': 'buscar', 'codigo': 'K02'})
+        servidor.actualizar_estado('K01', 'en uso')
+        assert json.loads(responder({'accion': 'buscar', 'codigo': 'K01'})[0])['equipo']['estado'] == 'en uso'
+        assert json.loads(responder({'accion': 'consultar'})[0])['version'] == 3
+        antes = servidor.metricas.cache_aciertos
+        responder({'accion': 'buscar', 'codigo': 'K02'})
+        assert servidor.metricas.cache_aciertos == antes + 1
+
+        # Prueba 4: Los errores no se guardan y registrar invalida el código nuevo
+        assert responder({'accion': 'buscar', 'codigo': 'K03'})[0]['resultado'] == 'error'
+        assert servidor.cache.total() == 3
+        servidor.registrar_equipo({'codigo': 'K03', 'nombre': 'Fuente',
+                                   'tipo': 'Fuente', 'estado': 'disponible'})
+        assert json.loads(responder({'accion': 'buscar', 'codigo': 'K03'})[0])['resultado'] == 'ok'
+        consulta = json.loads(responder({'accion': 'consultar', 'limite': 2})[0])
+        assert len(consulta['equipos']) == 2 and consulta['total'] == 3
+
+        # Prueba 5: Cada formato negociado tiene su propia entrada
+        en_json = responder({'accion': 'buscar', 'codigo': 'K02'})[0]
+        conexion['codificador'] = Codificador('compacto', True)
+        fallos = servidor.metricas.cache_fallos
+        datos = responder({'accion': 'buscar', 'codigo': 'K02'})[0]
+        assert datos != en_json and servidor.metricas.cache_fallos == fallos + 1
+        assert conexion['codificador'].decodificar(datos)['equipo']['codigo'] == 'K02'
+        assert responder({'accion': 'buscar', 'codigo': 'K02'})[0] == datos
+        servidor.almacen.cerrar()
+        print(f"✓ Consultas y búsquedas desde la caché con almacenamiento {almacenamiento}")
+
+    # Prueba 6: Por la red, en ambos modos, y desactivable
+    for modo in ('hilos', 'asyncio'):
+        for archivo in glob.glob('test_inventario.json*'):
+            os.remove(archivo)
+        servidor = ServidorInventario(host='127.0.0.1', puerto=0, modo_servidor=modo,
+                                      archivo_datos='test_inventario.json')
+        threading.Thread(target=servidor.iniciar, daemon=True).start()
+        assert servidor.listo.wait(5)
+        with PoolConexiones('127.0.0.1', servidor.puerto, tamano=1) as pool:
+            pool.registrar('R01', 'Balanza', 'Balanza')
+            assert pool.buscar('R01')['equipo']['estado'] == 'disponible'
+            assert pool.buscar('R01')['equipo']['estado'] == 'disponible'
+            pool.actualizar('R01', 'en mantenimiento')
+            assert pool.buscar('R01')['equipo']['estado'] == 'en mantenimiento'
+            assert pool.consultar()['equipos'][0]['estado'] == 'en mantenimiento'
+        assert servidor.metricas.cache_aciertos == 1
+        assert 'inventario_cache_aciertos_total 1' in servidor.texto_metricas()
+        servidor.detener()
+    print("✓ Caché en los modos de hilos y asyncio")
+
+    servidor = ServidorInventario(puerto=5556, archivo_datos='test_inventario.json',
+                                  cache_respuestas=0)
+    conexion = {'codificador': Codificador()}
+    respuesta = list(servidor.generar_respuestas(b'{"accion": "consultar"}', conexion))[0]
+    assert isinstance(respuesta, dict) and servidor.cache.total() == 0
+    servidor.almacen.cerrar()
+    print("✓ Caché desactivada con capacidad 0")
+
+    print("✅ Todas las pruebas de caché de respuestas pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+
+def prueba_importacion():
+    """Prueba la importación y exportación masiva del inventario"""
+    print("=== PRUEBA 30: Importación y exportación ===")
+
+    for archivo in glob.glob('test_inventario.json*') + glob.glob('test_exportado.*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+    # Prueba 1: Errores por fila con su número de línea
+    validar = ServidorInventario(puerto=5556, archivo_datos='test_exportado.json',
+                                 almacenamiento='memoria').validar_equipo
+    importacion = Importacion('csv', validar)
+    importacion.agregar('Codigo,nombre,tipo,estado\n'
+                        'C1,Balanza,Balanza,disponible\n'
+                        '\n'
+                        'C2,Fuente,Fuente,rota\n'
+                        'C3,Fuente\n')
+    importacion.agregar('"C4","Fuente, 30 V",Fuente,En uso\n')
+    resumen = importacion.resumen()
+    assert resumen['filas'] == 6 and resumen['validas'] == 2 and resumen['errores'] == 2
+    assert [e['fila'] for e in resumen['detalle_errores']] == [4, 5]
+    assert [datos['nombre'] for _, datos in importacion.filas_validas()] == ['Balanza', 'Fuente, 30 V']
+    importacion.cerrar()
+    importacion = Importacion('jsonl', validar)
+    importacion.agregar('{"codigo": "J1", "nombre": "A", "tipo": "T", "estado": "disponible"}\n'
+                        '[1, 2]\n{no es json\n'
+                        '{"codigo": 7, "nombre": "A", "tipo": "T", "estado": "disponible"}\n'
+                        '{"codigo": "J2", "nombre": "A", "tipo": "T", "estado": "disponible", '
+                        '"fecha_registro": "ayer"}\n')
+    assert importacion.validas == 1 and importacion.errores == 4
+    importacion.cerrar()
+    importacion = Importacion('csv', validar)
+    importacion.agregar('codigo,nombre,tipo,estado\nC1,"Balanza\n')
+    importacion.agregar('doble",Balanza,disponible\nC2,"Sin cerrar,Fuente,disponible\n')
+    importacion.terminar()
+    assert [datos['nombre'] for _, datos in importacion.filas_validas()] == ['Balanza\ndoble']
+    assert importacion.resumen()['detalle_errores'] == [
+        {'fila': 4, 'mensaje': 'Campo entre comillas sin cerrar'}]
+    importacion.cerrar()
+    # Una comilla en medio de un campo sin comillas no abre nada; una
+    # que sí queda abierta solo se lleva su fila
+    importacion = Importacion('csv', validar)
+    importacion.agregar('codigo,nombre,tipo,estado\n'
+                        'M01,Monitor 27",Monitor,disponible\n'
+                        'M02,"Monitor ""32""" curvo,Monitor,disponible\n')
+    importacion.agregar('M03,"Sin cerrar,Monitor,disponible\n'
+                        'M04,Monitor,Monitor,disponible\n'
+                        'M05,Monitor,Monitor,disponible')
+    importacion.terminar()
+    resumen = importacion.resumen()
+    assert [datos['nombre'] for _, datos in importacion.filas_validas()] == [
+        'Monitor 27"', 'Monitor "32" curvo', 'Monitor', 'Monitor']
+    assert resumen['filas'] == 6 and resumen['detalle_errores'] == [
+        {'fila': 4, 'mensaje': 'Campo entre comillas sin cerrar'}]
+    importacion.cerrar()
+    # Un registro abierto no acumula más de MAXIMO_REGISTRO_CSV
+    importacion = Importacion('csv', validar)
+    importacion.agregar('codigo,nombre,tipo,estado\nX1,"Sin cerrar,Monitor,disponible\n' + ''.join(
+        f'F{i:04d},{"Monitor " * 100},Monitor,disponible\n' for i in range(1500)))
+    assert len(importacion._pendiente) <= MAXIMO_REGISTRO_CSV
+    importacion.terminar()
+    resumen = importacion.resumen()
+    assert resumen['filas'] == 1502 and resumen['validas'] == 1500
+    assert resumen['detalle_errores'] == [{'fila': 2, 'mensaje': 'Campo entre comillas sin cerrar'}]
+    importacion.cerrar()
+    try:
+        Importacion('csv', None).agregar('codigo,nombre\n')
+        assert False, "Se esperaba un error por el encabezado"
+    except ValueError:
+        pass
+    print("✓ Validación por fila con errores numerados")
+
+    for archivo_datos, almacenamiento in (('test_inventario.json', 'json'),
+                                          ('test_inventario.db', 'sqlite')):
+        opciones = {'modo_persistencia': 'journal', 'compactar_cada': 5} if almacenamiento == 'json' else {}
+        servidor = ServidorInventario(puerto=5556, archivo_datos=archivo_datos,
+                                      almacenamiento=almacenamiento, **opciones)
+        servidor.registrar_equipo({'codigo': 'I0002', 'nombre': 'Fuente',
+                                   'tipo': 'Fuente', 'estado': 'disponible'})
+        conexion = {'codificador': Codificador()}
+
+        def responder(solicitud):
+            mensaje = conexion['codificador'].codificar(solicitud)
+            return list(servidor.generar_respuestas(mensaje, conexion))
+
+        # Prueba 2: Varios bloques, duplicados y una sola escritura al final
+        lineas = [json.dumps({'codigo': f'I{i:04d}', 'nombre': f'Equipo {i}',
+                              'tipo': 'Osciloscopio', 'estado': 'disponible'}) + '\n'
+                  for i in range(20)]
+        respuesta = responder({'accion': 'importar', 'formato': 'jsonl',
+                               'datos': ''.join(lineas[:10])})[0]
+        assert respuesta['resultado'] == 'ok' and respuesta['filas'] == 10
+        assert servidor.almacen.total() == 1  # Nada se inserta antes de 'fin'
+        escrituras = servidor.metricas.persistencia.cantidad
+        respuesta = responder({'accion': 'importar', 'datos': ''.join(lineas[10:]) + lineas[5],
+                               'fin': True})[0]
+        assert respuesta['importados'] == 19 and respuesta['errores'] == 2
+        assert [e['fila'] for e in respuesta['detalle_errores']] == [3, 21]
+        assert servidor.metricas.persistencia.cantidad == escrituras + 1
+        assert servidor.almacen.total() == 20 and 'importacion' not in conexion
+        assert servidor.buscar_equipo('i0007')['equipo']['nombre'] == 'Equipo 7'
+
+        # Prueba 3: Exportar en bloques y volver a importar conserva los datos
+        servidor.actualizar_estado('I0003', 'en mantenimiento')
+        bloques = responder({'accion': 'exportar', 'formato': 'csv', 'tamano_bloque': 8})
+        assert [b['fin'] for b in bloques] == [False, False, True]
+        texto = ''.join(b['datos'] for b in bloques)
+        assert texto.startswith('codigo,nombre,tipo,estado,fecha_registro,ultima_actualizacion\n')
+        assert len(texto.splitlines()) == 21
+        assert responder({'accion': 'exportar', 'formato': 'xml'})[0]['resultado'] == 'error'
+        assert servidor.despachar({'accion': 'importar'})['resultado'] == 'error'
+        servidor.almacen.cerrar()
+
+        destino = ServidorInventario(puerto=5556, archivo_datos='test_exportado.json',
+                                     almacenamiento='memoria')
+        conexion = {'codificador': Codificador()}
+        respuesta = list(destino.generar_respuestas(json.dumps(
+            {'accion': 'importar', 'formato': 'csv', 'datos': texto, 'fin': True}).encode(),
+            conexion))[0]
+        assert respuesta['importados'] == 20 and respuesta['errores'] == 0
+        copia = destino.buscar_equipo('I0003')['equipo']
+        original = ServidorInventario(puerto=5556, archivo_datos=archivo_datos,
+                                      almacenamiento=almacenamiento)
+        assert original.almacen.total() == 20  # La importación quedó en disco
+        for campo in ('estado', 'fecha_registro', 'ultima_actualizacion'):
+            assert copia[campo] == original.buscar_equipo('I0003')['equipo'][campo]
+        original.almacen.cerrar()
+        print(f"✓ Importación en un solo paso y exportación con almacenamiento {almacenamiento}")
+
+    # Prueba 4: Desde el cliente, con el formato de datos_ejemplo.txt
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    servidor = ServidorInventario(host='127.0.0.1', puerto=0,
+                                  archivo_datos='test_inventario.json')
+    threading.Thread(target=servidor.iniciar, daemon=True).start()
+    assert servidor.listo.wait(5)
+    conexion = ConexionInventario('127.0.0.1', servidor.puerto)
+    respuesta = importar_archivo(conexion, 'datos_ejemplo.txt', filas_por_bloque=4)
+    assert respuesta['importados'] == 21 and respuesta['errores'] == 0
+    assert exportar_archivo(conexion, 'test_exportado.jsonl')['total'] == 21
+    respuesta = importar_archivo(conexion, 'test_exportado.jsonl')
+    assert respuesta['importados'] == 0 and respuesta['errores'] == 21
+    servidor.registrar_equipo({'codigo': 'R1', 'nombre': 'Osciloscopio\ncanal 2',
+                               'tipo': 'Osciloscopio', 'estado': 'disponible'})
+    servidor.registrar_equipo({'codigo': 'R2', 'nombre': 'Sensor\u2028linea',
+                               'tipo': 'Sensor "ext"\r', 'estado': 'en uso'})
+    for extension in ('csv', 'jsonl'):
+        exportar_archivo(conexion, f'test_exportado.{extension}')
+        destino = ServidorInventario(host='127.0.0.1', puerto=0,
+                                     archivo_datos='test_exportado.json',
+                                     almacenamiento='memoria')
+        threading.Thread(target=destino.iniciar, daemon=True).start()
+        assert destino.listo.wait(5)
+        otra = ConexionInventario('127.0.0.1', destino.puerto)
+        # Un registro por bloque: el de varias líneas queda repartido
+        respuesta = importar_archivo(otra, f'test_exportado.{extension}', filas_por_bloque=1)
+        assert respuesta['importados'] == 23 and respuesta['errores'] == 0, respuesta
+        for codigo in ('R1', 'R2', 'MM01'):
+            copia = destino.buscar_equipo(codigo)['equipo']
+            original = servidor.buscar_equipo(codigo)['equipo']
+            for campo in ('nombre', 'tipo', 'estado', 'fecha_registro'):
+                assert copia[campo] == original[campo], (extension, campo, copia[campo])
+        otra.cerrar()
+        destino.detener()
+    conexion.cerrar()
+    servidor.detener()
+    print("✓ Importación y exportación de archivos desde el cliente")
+
+    print("✅ Todas las pruebas de importación y exportación pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*') + glob.glob('test_exportado.*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+
+def prueba_historial():
+    """Prueba el historial de estados y la utilización por estado"""
+    print("=== PRUEBA 31: Historial de estados y utilización ===")
+
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+    ahora = segundos_de_fecha('2024-03-04 08:00:00')
+    hora = 3600
+
+    for archivo_datos, almacenamiento in (('test_inventario.json', 'memoria'),
+                                          ('test_inventario.json', 'json'),
+                                          ('test_inventario.db', 'sqlite')):
+        opciones = {'modo_persistencia': 'journal'} if almacenamiento == 'json' else {}
+        servidor = ServidorInventario(puerto=5556, archivo_datos=archivo_datos,
+                                      almacenamiento=almacenamiento, **opciones)
+        almacen = servidor.almacen
+        for codigo in ('H1', 'H2'):
+            almacen.insertar({'codigo': codigo, 'nombre': 'Fuente', 'tipo': 'Fuente',
+                              'estado': 'disponible', 'fecha_registro': '2024-03-01 08:00:00'})
+
+        def cambiar(codigo, estado, fecha):
+            almacen.actualizar(con_cambios(almacen.obtener(codigo), estado=estado,
+                                           ultima_actualizacion=fecha))
+
+        # Prueba 1: Solo los cambios de estado quedan en el historial
+        cambiar('H1', 'en uso', '2024-03-01 10:00:00')
+        cambiar('H2', 'en mantenimiento', '2024-03-02 08:00:00')
+        cambiar('H1', 'en uso', '2024-03-02 09:00:00')  # Mismo estado: no es transición
+        cambiar('H1', 'disponible', '2024-03-03 08:00:00')
+        respuesta = servidor.despachar({'accion': 'historial', 'codigo': 'h1'})
+        assert respuesta['resultado'] == 'ok'
+        assert [(t['estado_anterior'], t['estado']) for t in respuesta['transiciones']] == [
+            ('disponible', 'en uso'), ('en uso', 'disponible')]
+        assert respuesta['transiciones'][1]['fecha'] == '2024-03-03 08:00:00'
+        respuesta = servidor.despachar({'accion': 'historial', 'fecha_desde': '2024-03-02',
+                                        'fecha_hasta': '2024-03-02 23:59:59'})
+        assert [t['codigo'] for t in respuesta['transiciones']] == ['H2']
+
+        # Prueba 2: Paginación con cursor
+        respuesta = servidor.despachar({'accion': 'historial', 'limite': 2})
+        assert [t['codigo'] for t in respuesta['transiciones']] == ['H1', 'H2']
+        respuesta = servidor.despachar({'accion': 'historial', 'limite': 2,
+                                        'cursor': respuesta['siguiente_cursor']})
+        assert [t['codigo'] for t in respuesta['transiciones']] == ['H1']
+        assert respuesta['siguiente_cursor'] is None
+        print(f"✓ Historial por código, por fecha y paginado ({almacenamiento})")
+
+        # Prueba 3: Utilización acumulada, por rango y de todo el inventario
+        assert almacen.utilizacion('H1', ahora=ahora) == {
+            'disponible': 2 * hora + 24 * hora, 'en uso': 46 * hora}
+        desde = segundos_de_fecha('2024-03-01 09:00:00')
+        hasta = segundos_de_fecha('2024-03-01 10:59:59')
+        assert almacen.utilizacion('H1', desde, hasta, ahora=ahora) == {
+            'disponible': hora, 'en uso': hora}
+        totales = almacen.utilizacion_estados(ahora)
+        assert totales['disponible'] == (26 * hora + 24 * hora, 1)
+        assert totales['en uso'] == (46 * hora, 0)
+        assert totales['en mantenimiento'] == (48 * hora, 1)
+        servidor.actualizar_estado('H2', 'disponible')
+        respuesta = servidor.despachar({'accion': 'utilizacion'})
+        assert respuesta['estados']['disponible']['equipos'] == 2
+        respuesta = servidor.despachar({'accion': 'utilizacion', 'codigo': 'H1',
+                                        'fecha_desde': '2024-03-01'})
+        assert respuesta['resultado'] == 'ok' and respuesta['segundos']['en uso'] == 46 * hora
+        assert sum(respuesta['porcentajes'].values()) > 99
+        print(f"✓ Utilización incremental por equipo y por estado ({almacenamiento})")
+        almacen.cerrar()
+
+        if almacenamiento == 'memoria':
+            continue
+        # Prueba 4: El historial y la utilización sobreviven al reinicio
+        reabierto = ServidorInventario(puerto=5556, archivo_datos=archivo_datos,
+                                       almacenamiento=almacenamiento, **opciones)
+        assert len(reabierto.despachar({'accion': 'historial'})['transiciones']) == 4
+        assert reabierto.almacen.utilizacion('H1', ahora=ahora) == {
+            'disponible': 26 * hora, 'en uso': 46 * hora}
+        assert reabierto.almacen.utilizacion_estados(ahora)['disponible'][1] == 2
+        reabierto.almacen.cerrar()
+        print(f"✓ Historial persistente al reiniciar ({almacenamiento})")
+
+    # Prueba 5: Reinicio tras una caída con cada modo del JSON: no se
+    # pierde la transición de un cambio guardado (del journal si falta en
+    # el historial) y se descarta la de uno que no llegó a guardarse
+    fantasma = ('{"codigo":"J1","fecha":"2024-03-01 12:30:00","estado_anterior":"disponible",'
+                '"estado":"fuera de servicio","version":99}\n{"codigo":"J')
+    for opciones in ({'modo_persistencia': 'completo'},
+                     {'modo_persistencia': 'journal'},
+                     {'modo_persistencia': 'journal', 'carga_diferida': True}):
+        for archivo in glob.glob('test_inventario.json*'):
+            os.remove(archivo)
+        almacen = AlmacenamientoJSON('test_inventario.json', **opciones)
+        almacen.cargar()
+        almacen.insertar({'codigo': 'J1', 'nombre': 'Fuente', 'tipo': 'Fuente',
+                          'estado': 'disponible', 'fecha_registro': '2024-03-01 08:00:00'})
+        if opciones.get('carga_diferida'):
+            almacen.cerrar()  # Deja el volcado para la carga diferida
+            almacen = AlmacenamientoJSON('test_inventario.json', **opciones)
+            almacen.cargar()
+            almacen.esperar_carga()
+        for estado, fecha in (('en uso', '2024-03-01 09:00:00'),
+                              ('disponible', '2024-03-01 12:00:00')):
+            almacen.actualizar(con_cambios(almacen.obtener('J1'), estado=estado,
+                                           ultima_actualizacion=fecha))
+        for archivo in (almacen._journal, almacen._historial):
+            if archivo is not None:
+                archivo.close()  # Simula una caída: sin compactar ni cerrar
+        with open('test_inventario.json.historial', encoding='utf-8') as f:
+            lineas = f.readlines()
+        if opciones['modo_persistencia'] == 'journal':
+            lineas.pop()  # La última transición solo quedó en el journal
+        with open('test_inventario.json.historial', 'w', encoding='utf-8') as f:
+            f.write(''.join(lineas) + fantasma)
+
+        almacen = AlmacenamientoJSON('test_inventario.json', **opciones)
+        almacen.cargar()
+        if opciones.get('carga_diferida'):
+            assert almacen._cargador is not None  # Arrancó desde el volcado
+        transiciones, _ = almacen.historial('J1')
+        assert [t['version'] for t in transiciones] == [2, 3], (opciones, transiciones)
+        assert almacen.utilizacion('J1', ahora=segundos_de_fecha('2024-03-01 13:00:00')) == {
+            'disponible': 2 * hora, 'en uso': 3 * hora}
+        almacen.actualizar(con_cambios(almacen.obtener('J1'), estado='en uso',
+                                       ultima_actualizacion='2024-03-01 14:00:00'))
+        almacen.cerrar()
+        with open('test_inventario.json.historial', encoding='utf-8') as f:
+            assert [json.loads(linea)['version'] for linea in f] == [2, 3, 4]
+    print("✓ Historial completo al reiniciar tras una caída (completo, journal, carga diferida)")
+
+    # Prueba 6: Con el inventario dañado la versión no es confiable: el
+    # historial no se borra, se aparta
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    almacen = AlmacenamientoJSON('test_inventario.json')
+    almacen.cargar()
+    almacen.insertar({'codigo': 'A1', 'nombre': 'Fuente', 'tipo': 'Fuente',
+                      'estado': 'disponible', 'fecha_registro': '2024-03-01 08:00:00'})
+    for estado in ('en uso', 'disponible'):
+        almacen.actualizar(con_cambios(almacen.obtener('A1'), estado=estado,
+                                       ultima_actualizacion='2024-03-01 09:00:00'))
+    almacen.cerrar()
+    with open('test_inventario.json.historial', 'rb') as f:
+        historial = f.read()
+    with open('test_inventario.json', 'w', encoding='utf-8') as f:
+        f.write('[{"codigo": ')
+    almacen = AlmacenamientoJSON('test_inventario.json')
+    almacen.cargar()
+    almacen.cerrar()
+    with open('test_inventario.json.historial.apartado', 'rb') as f:
+        assert f.read() == historial and len(historial.splitlines()) == 2
+    print("✓ Un inventario dañado no borra el historial")
+
+    # Prueba 7: Errores
+    servidor = ServidorInventario(puerto=5556, archivo_datos='test_inventario.json',
+                                  almacenamiento='memoria')
+    servidor.registrar_equipo({'codigo': 'E1', 'nombre': 'Fuente', 'tipo': 'Fuente',
+                               'estado': 'disponible'})
+    for solicitud in ({'accion': 'historial', 'codigo': 'NO-EXISTE'},
+                      {'accion': 'historial', 'fecha_desde': '2024-02-30'},
+                      {'accion': 'historial', 'cursor': 'x'},
+                      {'accion': 'historial', 'limite': 0},
+                      {'accion': 'utilizacion', 'fecha_desde': '2024-03-01'},
+                      {'accion': 'utilizacion', 'codigo': 'NO-EXISTE'}):
+        assert servidor.despachar(solicitud)['resultado'] == 'error', solicitud
+    for solicitud in ({'accion': 'historial', 'codigo': 5},
+                      {'accion': 'utilizacion', 'codigo': 5}):
+        assert servidor.despachar(solicitud) == {
+            'resultado': 'error', 'mensaje': "Campo 'codigo' debe ser texto"}, solicitud
+    respuesta = servidor.despachar({'accion': 'utilizacion', 'codigo': 'E1'})
+    assert set(respuesta['segundos']) <= {'disponible'}
+    print("✓ Validación de fechas, cursor y códigos")
+
+    print("✅ Todas las pruebas de historial de estados pasaron\n")
+
+    # Limpiar archivos de prueba
+    for archivo in glob.glob('test_inventario.json*'):
+        os.remove(archivo)
+    limpiar_base_prueba()
+
+
 def main():
     """Ejecuta todas las pruebas"""
     print("\n" + "="*60)
@@ -299,6 +2354,31 @@ def main():
         prueba_actualizacion()
         prueba_persistencia()
         prueba_protocolo()
+        prueba_indice_codigos()
+        prueba_journal()
+        prueba_mensajes_enmarcados()
+        prueba_servidor_asyncio()
+        prueba_lote()
+        prueba_lecturas_sin_bloqueo()
+        prueba_paginacion_y_flujo()
+        prueba_filtrar()
+        prueba_buscar_texto()
+        prueba_almacenamiento_sqlite()
+        prueba_formato_negociado()
+        prueba_pool_conexiones()
+        prueba_cliente_async()
+        prueba_benchmark()
+        prueba_metricas()
+        prueba_registro_asincrono()
+        prueba_escritura_agrupada()
+        prueba_multiproceso()
+        prueba_suscripciones()
+        prueba_cambios_desde()
+        prueba_registros_compactos()
+        prueba_carga_diferida()
+        prueba_cache_respuestas()
+        prueba_importacion()
+        prueba_historial()
 
         print("="*60)
         print("✅ TODAS LAS PRUEBAS PASARON EXITOSAMENTE")
@@ -0,0 +1,126 @@
+"""
+Registro (log) del servidor fuera del camino de las solicitudes
+
+Los hilos que atienden solicitudes solo ponen cada registro en una cola
+acotada; un hilo escritor lo formatea y lo escribe en un archivo con
+rotación y en la consola. Las líneas por solicitud se pueden muestrear
+por acción para que el log no crezca al ritmo del tráfico.
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+
+FORMATO_LOG = '%(asctime)s - %(levelname)s - %(message)s'
+NIVELES_LOG = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+TAMANO_MAXIMO_LOG = 10 * 1024 * 1024  # Bytes antes de rotar el archivo
+RESPALDOS_LOG = 5  # Archivos rotados que se conservan
+CAPACIDAD_COLA_LOG = 10000
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """Encola registros sin bloquear; si la cola está llena los descarta"""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def enqueue(self, record):
+        """Pone el registro en la cola o lo cuenta como descartado"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class MuestreoAcciones:
+    """Decide qué solicitudes se registran: una de cada N por acción
+
+    N = 1 registra todas y N = 0 ninguna; la clave '*' fija el valor
+    para las acciones que no aparecen (1 si no se indica).
+    """
+
+    def __init__(self, cada=None):
+        self.cada = dict(cada or {})
+        self._contadores = {}
+
+    def registrar(self, accion):
+        """Indica si esta solicitud de la acción debe ir al log"""
+        cada = self.cada.get(accion, self.cada.get('*', 1))
+        if cada <= 1:
+            return cada == 1
+        contador = self._contadores.get(accion)
+        if contador is None:
+            contador = self._contadores.setdefault(accion, itertools.count())
+        return next(contador) % cada == 0  # next() es atómico con el GIL
+
+
+def parsear_muestreo(texto):
+    """Convierte 'buscar=100,consultar=0' en {'buscar': 100, 'consultar': 0}"""
+    cada = {}
+    for parte in texto.split(','):
+        accion, _, valor = parte.partition('=')
+        accion = accion.strip().lower()
+        try:
+            cada[accion] = int(valor)
+        except ValueError:
+            cada[accion] = -1
+        if not accion or cada[accion] < 0:
+            raise ValueError(
+                f"Muestreo inválido '{parte.strip()}'. Use accion=N con N >= 0")
+    return cada
+
+
+def configurar_registro(archivo='servidor.log', nivel='INFO',
+                        tamano_maximo=TAMANO_MAXIMO_LOG, respaldos=RESPALDOS_LOG,
+                        consola=True, capacidad=CAPACIDAD_COLA_LOG, cola=None):
+    """Envía el log raíz a una cola y arranca el hilo escritor
+
+    'cola' puede ser una multiprocessing.Queue para que otros procesos
+    escriban en el mismo archivo (ver conectar_registro). Devuelve el
+    QueueListener, que debe pasarse a detener_registro() para vaciar la
+    cola al terminar.
+    """
+    formato = logging.Formatter(FORMATO_LOG)
+    manejadores = []
+    if archivo:
+        manejadores.append(logging.handlers.RotatingFileHandler(
+            archivo, maxBytes=tamano_maximo, backupCount=respaldos,
+            encoding='utf-8'))
+    if consola:
+        manejadores.append(logging.StreamHandler())
+    for manejador in manejadores:
+        manejador.setFormatter(formato)
+
+    if cola is None:
+        cola = queue.Queue(capacidad)
+    conectar_registro(cola, nivel)
+
+    escritor = logging.handlers.QueueListener(
+        cola, *manejadores, respect_handler_level=True)
+    escritor.start()
+    return escritor
+
+
+def conectar_registro(cola, nivel='INFO'):
+    """Envía el log raíz a la cola de un escritor, quizá de otro proceso"""
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    raiz.addHandler(ManejadorCola(cola))
+    raiz.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+
+
+def detener_registro(escritor):
+    """Escribe lo pendiente en la cola y cierra los manejadores"""
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        if isinstance(manejador, ManejadorCola) and manejador.queue is escritor.queue:
+            raiz.removeHandler(manejador)
+            if manejador.descartados:
+                logging.warning(
+                    f"Se descartaron {manejador.descartados} registros por cola llena")
+    escritor.stop()
+    for manejador in escritor.handlers:
+        manejador.close()
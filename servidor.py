@@ -1,60 +1,159 @@
 import socket
 import threading
+import asyncio
+import argparse
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
+import re
+import signal
+import sys
+import time
 import logging
 from datetime import datetime
 
-# Configuración de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('servidor.log'),
-        logging.StreamHandler()
-    ]
-)
+from protocolo import (FORMATOS, Codificador, LectorMensajes,
+                       empaquetar_mensaje, enviar_mensaje, leer_mensaje_async)
+from almacenamiento import (ALMACENAMIENTOS, MODOS_DURABILIDAD, MODOS_PERSISTENCIA,
+                            CodigoDuplicadoError, CursorInvalidoError, con_cambios,
+                            crear_almacenamiento, extraer_palabras, limite_fecha,
+                            normalizar_codigo, normalizar_tipo, segundos_de_fecha)
+from cache import TAMANO_CACHE_RESPUESTAS, CacheRespuestas
+from eventos import PublicadorEventos
+from importacion import (FILAS_POR_BLOQUE, FORMATOS_IMPORTACION, Importacion,
+                         texto_exportacion)
+from metricas import LockMedido, Metricas, iniciar_servidor_metricas
+from registro import (CAPACIDAD_COLA_LOG, NIVELES_LOG, MuestreoAcciones,
+                      conectar_registro, configurar_registro, detener_registro,
+                      parsear_muestreo)
+
+try:
+    import resource  # No disponible en Windows
+except ImportError:
+    resource = None
+
+
+ESTADOS_VALIDOS = ['disponible', 'en uso',
+                   'en mantenimiento', 'fuera de servicio']
+FORMATO_FECHA_FILTRO = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?$')
+LIMITE_BUSQUEDA_TEXTO = 20
+MODOS_SERVIDOR = ['hilos', 'asyncio']
+ACCIONES = ['registrar', 'consultar', 'buscar', 'actualizar', 'filtrar',
+            'buscar_texto', 'lote', 'negociar', 'estadisticas', 'suscribir',
+            'cambios_desde', 'importar', 'exportar', 'historial', 'utilizacion']
+# En modo asyncio se atienden en un hilo aparte: las escrituras pueden
+# esperar el lock o el disco, y las que usan índices esperan la carga diferida
+ACCIONES_ESCRITURA = {'registrar', 'actualizar', 'lote', 'importar'}
+ACCIONES_CON_INDICES = ACCIONES_ESCRITURA | {
+    'filtrar', 'buscar_texto', 'cambios_desde', 'historial', 'utilizacion'}
+MAXIMO_SOLICITUDES_LOTE = 10000
+MAXIMO_LIMITE_CONSULTA = 10000  # Equipos por página o por bloque
+TAMANO_BLOQUE_FLUJO = 500
+INTERVALO_LATIDO = 5  # Segundos sin eventos antes de enviar un latido
+INTERVALO_SONDEO_EVENTOS = 0.05  # Segundos entre lecturas de cambios con varios procesos
+
+
+def ampliar_limite_descriptores():
+    """Sube el límite de archivos abiertos al máximo permitido al proceso"""
+    if resource is None:
+        return None
+    try:
+        _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+        return maximo
+    except (ValueError, OSError) as e:
+        logging.warning(f"No se pudo ampliar el límite de descriptores: {e}")
+        return None
 
 
 class ServidorInventario:
-    def __init__(self, host='0.0.0.0', puerto=5555, archivo_datos='inventario.json'):
+    def __init__(self, host='0.0.0.0', puerto=5555, archivo_datos=None,
+                 modo_persistencia='completo', compactar_cada=1000,
+                 modo_servidor='hilos', backlog=128, almacenamiento='json',
+                 puerto_metricas=None, muestreo_log=None,
+                 durabilidad='sincrona', ventana_ms=0, agrupar_cada=100,
+                 reutilizar_puerto=False, carga_diferida=False,
+                 cache_respuestas=TAMANO_CACHE_RESPUESTAS):
+        if modo_servidor not in MODOS_SERVIDOR:
+            raise ValueError(
+                f"Modo de servidor inválido. Debe ser uno de: {', '.join(MODOS_SERVIDOR)}")
+
         self.host = host
         self.puerto = puerto
-        self.archivo_datos = archivo_datos
-        self.inventario = []
-        self.lock = threading.Lock()  # Para sincronización de hilos
-        self.cargar_inventario()
+        # 'hilos' crea un hilo por conexión; 'asyncio' atiende todas las
+        # conexiones en un único bucle de eventos
+        self.modo_servidor = modo_servidor
+        self.backlog = backlog  # Conexiones pendientes de aceptar
+        # SO_REUSEPORT: varios procesos escuchan en el mismo puerto y el
+        # sistema reparte las conexiones entre ellos
+        self.reutilizar_puerto = reutilizar_puerto
+        # Dónde se guardan los equipos: un nombre de ALMACENAMIENTOS o un
+        # objeto con la misma interfaz
+        if isinstance(almacenamiento, str):
+            opciones = {}
+            if almacenamiento == 'json':
+                opciones = {'modo_persistencia': modo_persistencia,
+                            'compactar_cada': compactar_cada,
+                            'durabilidad': durabilidad,
+                            'ventana_ms': ventana_ms,
+                            'agrupar_cada': agrupar_cada,
+                            'carga_diferida': carga_diferida}
+            almacenamiento = crear_almacenamiento(
+                almacenamiento, archivo_datos, **opciones)
+        self.almacen = almacenamiento
+        self.metricas = Metricas()
+        self.almacen.metricas = self.metricas
+        # Puerto HTTP para Prometheus (None lo desactiva, 0 elige uno libre)
+        self.puerto_metricas = puerto_metricas
+        self.servidor_metricas = None
+        # Cambios enviados a los clientes suscritos; con varios procesos
+        # salen del almacenamiento compartido (publicar_cambios_compartidos)
+        self.eventos = PublicadorEventos()
+        self._fin_sondeo = threading.Event()
+        # Bytes de respuestas de consultar y buscar ya codificadas (0 la desactiva)
+        self.cache = CacheRespuestas(cache_respuestas, self.metricas)
+        self.intervalo_latido = INTERVALO_LATIDO
+        # Una de cada N solicitudes por acción va al log, p. ej. {'buscar': 100}
+        self.muestreo = MuestreoAcciones(muestreo_log)
+        # Reentrante para que un lote pueda ejecutar varias operaciones
+        # dentro de una sola adquisición; se mide la espera por tomarlo
+        self.lock = LockMedido(threading.RLock(), self.metricas)
+        self.listo = threading.Event()  # Se activa cuando el servidor escucha
+        # Marca de persistencia que la respuesta en curso de cada hilo debe
+        # esperar antes de enviarse (durabilidad 'disco')
+        self._local = threading.local()
+        self.servidor_socket = None
+        self._bucle = None
+        self._evento_detener = None
+        self._conexiones_async = {}  # writer -> tarea que lo atiende
+        self.almacen.cargar()
 
-    def cargar_inventario(self):
-        """Carga el inventario desde el archivo JSON"""
-        try:
-            if os.path.exists(self.archivo_datos):
-                with open(self.archivo_datos, 'r', encoding='utf-8') as f:
-                    self.inventario = json.load(f)
-                logging.info(
-                    f"Inventario cargado: {len(self.inventario)} equipos")
-            else:
-                self.inventario = []
-                logging.info(
-                    "Archivo de inventario no existe. Iniciando con inventario vacío.")
-        except Exception as e:
-            logging.error(f"Error al cargar inventario: {e}")
-            self.inventario = []
+    @property
+    def inventario(self):
+        """Lista de equipos en el orden en que se registraron"""
+        return self.almacen.inventario
 
-    def guardar_inventario(self):
-        """Guarda el inventario en el archivo JSON"""
-        try:
-            with open(self.archivo_datos, 'w', encoding='utf-8') as f:
-                json.dump(self.inventario, f, indent=4, ensure_ascii=False)
-            logging.info("Inventario guardado correctamente")
-        except Exception as e:
-            logging.error(f"Error al guardar inventario: {e}")
+    def cerrar(self):
+        """Libera los recursos de persistencia del servidor"""
+        with self.lock:
+            self.almacen.cerrar()
+
+    def anotar_persistencia(self, marca):
+        """Recuerda la escritura a disco que debe esperar la respuesta en curso"""
+        if marca > getattr(self._local, 'marca', 0):
+            self._local.marca = marca
+
+    def tomar_marca_persistencia(self):
+        """Devuelve y olvida la marca anotada por la respuesta en curso"""
+        marca = getattr(self._local, 'marca', 0)
+        self._local.marca = 0
+        return marca
 
     def validar_equipo(self, equipo):
         """Valida que los campos del equipo sean correctos"""
         campos_requeridos = ['codigo', 'nombre', 'tipo', 'estado']
-        estados_validos = ['disponible', 'en uso',
-                           'en mantenimiento', 'fuera de servicio']
+        estados_validos = ESTADOS_VALIDOS
 
         for campo in campos_requeridos:
             if campo not in equipo or not equipo[campo]:
@@ -73,22 +172,23 @@ class ServidorInventario:
             if not es_valido:
                 return {"resultado": "error", "mensaje": mensaje}
 
-            # Verificar si el código ya existe
+            # Agregar equipo; el almacenamiento rechaza códigos repetidos
+            nuevo_equipo = {
+                'codigo': normalizar_codigo(datos['codigo']),
+                'nombre': datos['nombre'],
+                'tipo': datos['tipo'],
+                'estado': datos['estado'].lower(),
+                'fecha_registro': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
             with self.lock:
-                for equipo in self.inventario:
-                    if equipo['codigo'].upper() == datos['codigo'].upper():
-                        return {"resultado": "error", "mensaje": "El código ya existe en el inventario"}
-
-                # Agregar equipo
-                nuevo_equipo = {
-                    'codigo': datos['codigo'].upper(),
-                    'nombre': datos['nombre'],
-                    'tipo': datos['tipo'],
-                    'estado': datos['estado'].lower(),
-                    'fecha_registro': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                self.inventario.append(nuevo_equipo)
-                self.guardar_inventario()
+                try:
+                    nuevo_equipo = self.almacen.insertar(nuevo_equipo)
+                except CodigoDuplicadoError:
+                    return {"resultado": "error", "mensaje": "El código ya existe en el inventario"}
+                self.anotar_persistencia(self.almacen.marca_persistencia())
+                self.cache.invalidar(nuevo_equipo['codigo'])
+                # Con el lock tomado: los eventos salen en el orden de los cambios
+                self.publicar_evento('registrado', nuevo_equipo)
 
             logging.info(f"Equipo registrado: {nuevo_equipo['codigo']}")
             return {"resultado": "ok", "mensaje": "Equipo registrado correctamente", "equipo": nuevo_equipo}
@@ -97,32 +197,282 @@ class ServidorInventario:
             logging.error(f"Error al registrar equipo: {e}")
             return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
 
-    def consultar_equipos(self):
-        """Devuelve la lista completa de equipos"""
+    @staticmethod
+    def validar_entero(valor, nombre, minimo, maximo):
+        """Convierte un parámetro numérico y verifica su rango"""
         try:
-            with self.lock:
+            numero = int(valor)
+        except (TypeError, ValueError):
+            return None, f"'{nombre}' debe ser un número entero"
+        if numero < minimo or numero > maximo:
+            return None, f"'{nombre}' debe estar entre {minimo} y {maximo}"
+        return numero, None
+
+    def consultar_equipos(self, limite=None, cursor=None):
+        """Devuelve la lista de equipos, completa o paginada"""
+        try:
+            # Sin lock: el almacenamiento atiende lecturas concurrentes. La
+            # versión se lee antes que los equipos: si un cambio se cuela,
+            # cambios_desde(version) lo vuelve a entregar, nunca lo pierde
+            version = self.almacen.version_actual()
+            if limite is None and cursor is None:
+                equipos = self.almacen.inventario
                 return {
                     "resultado": "ok",
-                    "mensaje": f"Total de equipos: {len(self.inventario)}",
-                    "equipos": self.inventario.copy()
+                    "mensaje": f"Total de equipos: {len(equipos)}",
+                    "equipos": list(equipos),
+                    "version": version
                 }
+
+            limite, error = self.validar_entero(
+                limite if limite is not None else MAXIMO_LIMITE_CONSULTA,
+                'limite', 1, MAXIMO_LIMITE_CONSULTA)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            try:
+                equipos, siguiente, total = self.almacen.pagina(cursor, limite)
+            except CursorInvalidoError as e:
+                return {"resultado": "error", "mensaje": str(e)}
+
+            return {
+                "resultado": "ok",
+                "mensaje": f"Total de equipos: {total}",
+                "total": total,
+                "equipos": equipos,
+                "siguiente_cursor": siguiente,
+                "version": version
+            }
         except Exception as e:
             logging.error(f"Error al consultar equipos: {e}")
             return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
 
+    def consultar_en_flujo(self, tamano_bloque=None):
+        """Genera la consulta completa en bloques, uno por mensaje"""
+        tamano_bloque, error = self.validar_entero(
+            tamano_bloque if tamano_bloque is not None else TAMANO_BLOQUE_FLUJO,
+            'tamano_bloque', 1, MAXIMO_LIMITE_CONSULTA)
+        if error:
+            yield {"resultado": "error", "mensaje": error, "fin": True}
+            return
+
+        version = self.almacen.version_actual()
+        bloque = None
+        for total, equipos in self.almacen.bloques(tamano_bloque):
+            # Se retrasa un bloque para poder marcar el último con 'fin'
+            if bloque is not None:
+                yield dict(bloque, fin=False)
+            bloque = {
+                "resultado": "ok",
+                "mensaje": f"Total de equipos: {total}",
+                "total": total,
+                "equipos": equipos,
+                "version": version
+            }
+        yield dict(bloque, fin=True)
+
+    def cambios_desde(self, version, limite=None):
+        """Devuelve los equipos creados o modificados después de una versión"""
+        try:
+            actual = self.almacen.version_actual()
+            version, error = self.validar_entero(version, 'version', 0, actual)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            limite, error = self.validar_entero(
+                limite if limite is not None else MAXIMO_LIMITE_CONSULTA,
+                'limite', 1, MAXIMO_LIMITE_CONSULTA)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+
+            equipos, hasta, mas = self.almacen.cambios_desde(version, limite)
+            return {
+                "resultado": "ok",
+                "mensaje": f"Equipos cambiados: {len(equipos)}",
+                "equipos": equipos,
+                "version": hasta,
+                "mas": mas
+            }
+
+        except Exception as e:
+            logging.error(f"Error al consultar cambios: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+
+    def filtrar_equipos(self, estado=None, tipo=None, fecha_desde=None,
+                        fecha_hasta=None, limite=None, cursor=None):
+        """Devuelve los equipos que cumplen todos los filtros indicados"""
+        try:
+            if estado is None and tipo is None and fecha_desde is None and fecha_hasta is None:
+                return {"resultado": "error", "mensaje": "Debe indicar al menos un filtro"}
+            if estado is not None:
+                estado = str(estado).lower()
+                if estado not in ESTADOS_VALIDOS:
+                    return {
+                        "resultado": "error",
+                        "mensaje": f"Estado inválido. Debe ser uno de: {', '.join(ESTADOS_VALIDOS)}"
+                    }
+            for fecha in (fecha_desde, fecha_hasta):
+                if fecha is not None and not FORMATO_FECHA_FILTRO.match(str(fecha)):
+                    return {
+                        "resultado": "error",
+                        "mensaje": "Fecha inválida. Use 'AAAA-MM-DD' o 'AAAA-MM-DD HH:MM:SS'"
+                    }
+            if tipo is not None:
+                tipo = normalizar_tipo(str(tipo))
+
+            inicio, error = self.validar_entero(
+                cursor if cursor is not None else 0, 'cursor', 0, self.almacen.total())
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            limite, error = self.validar_entero(
+                limite if limite is not None else MAXIMO_LIMITE_CONSULTA,
+                'limite', 1, MAXIMO_LIMITE_CONSULTA)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+
+            total, equipos = self.almacen.filtrar(
+                estado, tipo, fecha_desde, fecha_hasta, inicio, limite)
+            if inicio > total:
+                return {"resultado": "error", "mensaje": f"'cursor' debe estar entre 0 y {total}"}
+            fin = inicio + len(equipos)
+
+            return {
+                "resultado": "ok",
+                "mensaje": f"Equipos encontrados: {total}",
+                "total": total,
+                "equipos": equipos,
+                "siguiente_cursor": str(fin) if fin < total else None
+            }
+
+        except Exception as e:
+            logging.error(f"Error al filtrar equipos: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+
+    def buscar_texto(self, texto, limite=None):
+        """Busca equipos por palabras o prefijos de su nombre y tipo"""
+        try:
+            palabras = extraer_palabras(str(texto or ''))
+            if not palabras:
+                return {"resultado": "error", "mensaje": "Texto de búsqueda no proporcionado"}
+            limite, error = self.validar_entero(
+                limite if limite is not None else LIMITE_BUSQUEDA_TEXTO,
+                'limite', 1, MAXIMO_LIMITE_CONSULTA)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+
+            total, equipos = self.almacen.buscar_texto(palabras, limite)
+            return {
+                "resultado": "ok",
+                "mensaje": f"Equipos encontrados: {total}",
+                "total": total,
+                "equipos": equipos
+            }
+
+        except Exception as e:
+            logging.error(f"Error al buscar texto: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+
+    @staticmethod
+    def rango_de_fechas(fecha_desde, fecha_hasta):
+        """Convierte los límites de un rango a segundos: (desde, hasta, error)
+
+        Una fecha sin hora en fecha_hasta incluye todo ese día.
+        """
+        limites = []
+        for fecha, hora in ((fecha_desde, '00:00:00'), (fecha_hasta, '23:59:59')):
+            segundos = None
+            if fecha is not None:
+                if FORMATO_FECHA_FILTRO.match(str(fecha)):
+                    segundos = segundos_de_fecha(limite_fecha(str(fecha), hora))
+                if segundos is None:
+                    return None, None, "Fecha inválida. Use 'AAAA-MM-DD' o 'AAAA-MM-DD HH:MM:SS'"
+            limites.append(segundos)
+        return limites[0], limites[1], None
+
+    def consultar_historial(self, codigo=None, fecha_desde=None, fecha_hasta=None,
+                            limite=None, cursor=None):
+        """Devuelve los cambios de estado, de un equipo o de todos, en orden de fecha"""
+        try:
+            desde, hasta, error = self.rango_de_fechas(fecha_desde, fecha_hasta)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            if codigo is not None and not isinstance(codigo, str):
+                return {"resultado": "error", "mensaje": "Campo 'codigo' debe ser texto"}
+            if codigo is not None and self.almacen.obtener(codigo) is None:
+                return {"resultado": "error", "mensaje": "Equipo no encontrado"}
+            limite, error = self.validar_entero(
+                limite if limite is not None else MAXIMO_LIMITE_CONSULTA,
+                'limite', 1, MAXIMO_LIMITE_CONSULTA)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            try:
+                transiciones, siguiente = self.almacen.historial(
+                    codigo, desde, hasta, cursor, limite)
+            except CursorInvalidoError as e:
+                return {"resultado": "error", "mensaje": str(e)}
+
+            return {
+                "resultado": "ok",
+                "mensaje": f"Cambios de estado: {len(transiciones)}",
+                "transiciones": transiciones,
+                "siguiente_cursor": siguiente
+            }
+
+        except Exception as e:
+            logging.error(f"Error al consultar historial: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+
+    def consultar_utilizacion(self, codigo=None, fecha_desde=None, fecha_hasta=None):
+        """Devuelve los segundos en cada estado de un equipo, o de todos sumados"""
+        try:
+            desde, hasta, error = self.rango_de_fechas(fecha_desde, fecha_hasta)
+            if error:
+                return {"resultado": "error", "mensaje": error}
+            if codigo is not None and not isinstance(codigo, str):
+                return {"resultado": "error", "mensaje": "Campo 'codigo' debe ser texto"}
+
+            if codigo is None:
+                if desde is not None or hasta is not None:
+                    return {"resultado": "error", "mensaje": "El rango de fechas requiere un código"}
+                estados = {
+                    estado: {"segundos": segundos, "equipos": equipos}
+                    for estado, (segundos, equipos)
+                    in sorted(self.almacen.utilizacion_estados().items())
+                }
+                return {
+                    "resultado": "ok",
+                    "mensaje": f"Utilización de {len(estados)} estados",
+                    "estados": estados
+                }
+
+            segundos = self.almacen.utilizacion(codigo, desde, hasta)
+            if segundos is None:
+                return {"resultado": "error", "mensaje": "Equipo no encontrado"}
+            total = sum(segundos.values())
+            return {
+                "resultado": "ok",
+                "mensaje": f"Utilización de {normalizar_codigo(codigo)}",
+                "codigo": normalizar_codigo(codigo),
+                "segundos": segundos,
+                "porcentajes": {estado: round(100 * valor / total, 2)
+                                for estado, valor in segundos.items()} if total else {}
+            }
+
+        except Exception as e:
+            logging.error(f"Error al consultar utilización: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+
     def buscar_equipo(self, codigo):
         """Busca un equipo por su código"""
         try:
-            with self.lock:
-                for equipo in self.inventario:
-                    if equipo['codigo'].upper() == codigo.upper():
-                        return {
-                            "resultado": "ok",
-                            "mensaje": "Equipo encontrado",
-                            "equipo": equipo
-                        }
+            # Sin lock: el equipo publicado es inmutable
+            equipo = self.almacen.obtener(codigo)
+            if equipo is not None:
+                return {
+                    "resultado": "ok",
+                    "mensaje": "Equipo encontrado",
+                    "equipo": equipo
+                }
 
-                return {"resultado": "error", "mensaje": "Equipo no encontrado"}
+            return {"resultado": "error", "mensaje": "Equipo no encontrado"}
 
         except Exception as e:
             logging.error(f"Error al buscar equipo: {e}")
@@ -131,8 +481,7 @@ class ServidorInventario:
     def actualizar_estado(self, codigo, nuevo_estado):
         """Actualiza el estado de un equipo"""
         try:
-            estados_validos = ['disponible', 'en uso',
-                               'en mantenimiento', 'fuera de servicio']
+            estados_validos = ESTADOS_VALIDOS
 
             if nuevo_estado.lower() not in estados_validos:
                 return {
@@ -141,33 +490,447 @@ class ServidorInventario:
                 }
 
             with self.lock:
-                for equipo in self.inventario:
-                    if equipo['codigo'].upper() == codigo.upper():
-                        estado_anterior = equipo['estado']
-                        equipo['estado'] = nuevo_estado.lower()
-                        equipo['ultima_actualizacion'] = datetime.now().strftime(
-                            '%Y-%m-%d %H:%M:%S')
-                        self.guardar_inventario()
-
-                        logging.info(
-                            f"Estado actualizado para {codigo}: {estado_anterior} -> {nuevo_estado}")
-                        return {
-                            "resultado": "ok",
-                            "mensaje": f"Estado actualizado de '{estado_anterior}' a '{nuevo_estado}'",
-                            "equipo": equipo
-                        }
+                equipo = self.almacen.obtener(codigo)
+                if equipo is None:
+                    return {"resultado": "error", "mensaje": "Equipo no encontrado"}
 
-                return {"resultado": "error", "mensaje": "Equipo no encontrado"}
+                estado_anterior = equipo['estado']
+                equipo = con_cambios(
+                    equipo,
+                    estado=nuevo_estado.lower(),
+                    ultima_actualizacion=datetime.now().strftime(
+                        '%Y-%m-%d %H:%M:%S'))
+                equipo = self.almacen.actualizar(equipo)
+                self.anotar_persistencia(self.almacen.marca_persistencia())
+                self.cache.invalidar(equipo['codigo'])
+                self.publicar_evento('actualizado', equipo, estado_anterior)
+
+            logging.info(
+                f"Estado actualizado para {codigo}: {estado_anterior} -> {nuevo_estado}")
+            return {
+                "resultado": "ok",
+                "mensaje": f"Estado actualizado de '{estado_anterior}' a '{nuevo_estado}'",
+                "equipo": equipo
+            }
 
         except Exception as e:
             logging.error(f"Error al actualizar estado: {e}")
             return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
 
+    def importar(self, solicitud, conexion):
+        """Recibe un bloque de una importación; con 'fin' inserta las filas válidas
+
+        La importación en curso se guarda en la conexión, así cada bloque
+        se valida al llegar y solo las filas válidas esperan en disco.
+        """
+        importacion = conexion.get('importacion')
+        if importacion is None:
+            try:
+                importacion = Importacion(
+                    str(solicitud.get('formato') or 'jsonl').lower(), self.validar_equipo)
+            except ValueError as e:
+                return {"resultado": "error", "mensaje": str(e)}
+            conexion['importacion'] = importacion
+
+        datos = solicitud.get('datos', '')
+        if not isinstance(datos, str):
+            error = "'datos' debe ser texto con líneas completas"
+        else:
+            try:
+                importacion.agregar(datos)
+                error = None
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            # La importación se cancela: no queda nada a medias
+            del conexion['importacion']
+            importacion.cerrar()
+            return {"resultado": "error", "mensaje": error}
+
+        if not solicitud.get('fin'):
+            return dict({"resultado": "ok",
+                         "mensaje": f"Filas recibidas: {importacion.filas}"},
+                        **importacion.resumen())
+
+        del conexion['importacion']
+        try:
+            importacion.terminar()
+            importados = self.confirmar_importacion(importacion)
+        except Exception as e:
+            logging.error(f"Error al importar: {e}")
+            return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
+        finally:
+            importacion.cerrar()
+        logging.info(
+            f"Importación terminada: {importados} equipos, "
+            f"{importacion.errores} filas con errores")
+        return dict({"resultado": "ok",
+                     "mensaje": f"Equipos importados: {importados}; filas con errores: {importacion.errores}",
+                     "importados": importados},
+                    **importacion.resumen())
+
+    def confirmar_importacion(self, importacion):
+        """Inserta en un solo lote las filas válidas; devuelve cuántas entraron"""
+        importados = 0
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            self.almacen.iniciar_lote()
+            try:
+                for fila, datos in importacion.filas_validas():
+                    equipo = dict(datos, codigo=normalizar_codigo(datos['codigo']),
+                                  estado=datos['estado'].lower())
+                    equipo.setdefault('fecha_registro', fecha)
+                    try:
+                        equipo = self.almacen.insertar(equipo)
+                    except CodigoDuplicadoError:
+                        importacion.anotar_error(fila, "El código ya existe en el inventario")
+                        continue
+                    importados += 1
+                    self.cache.invalidar(equipo['codigo'])
+                    self.publicar_evento('registrado', equipo)
+            finally:
+                self.almacen.terminar_lote()
+                self.anotar_persistencia(self.almacen.marca_persistencia())
+        return importados
+
+    def exportar(self, formato=None, tamano_bloque=None):
+        """Genera el inventario como texto JSON por líneas o CSV, un bloque por mensaje"""
+        formato = str(formato or 'jsonl').lower()
+        if formato not in FORMATOS_IMPORTACION:
+            yield {"resultado": "error", "fin": True,
+                   "mensaje": f"Formato inválido. Debe ser uno de: {', '.join(FORMATOS_IMPORTACION)}"}
+            return
+        tamano_bloque, error = self.validar_entero(
+            tamano_bloque if tamano_bloque is not None else FILAS_POR_BLOQUE,
+            'tamano_bloque', 1, MAXIMO_LIMITE_CONSULTA)
+        if error:
+            yield {"resultado": "error", "mensaje": error, "fin": True}
+            return
+
+        bloque = None
+        for total, equipos in self.almacen.bloques(tamano_bloque):
+            # Como en consultar_en_flujo, se retrasa un bloque para marcar el último
+            if bloque is not None:
+                yield dict(bloque, fin=False)
+            bloque = {
+                "resultado": "ok",
+                "mensaje": f"Total de equipos: {total}",
+                "total": total,
+                "formato": formato,
+                "datos": texto_exportacion(equipos, formato, encabezado=bloque is None)
+            }
+        yield dict(bloque, fin=True)
+
+    def procesar_lote(self, solicitudes):
+        """Procesa varias solicitudes con un solo bloqueo y una sola escritura"""
+        if not isinstance(solicitudes, list):
+            return {"resultado": "error", "mensaje": "El lote debe ser una lista de solicitudes"}
+        if len(solicitudes) > MAXIMO_SOLICITUDES_LOTE:
+            return {
+                "resultado": "error",
+                "mensaje": f"El lote excede el máximo de {MAXIMO_SOLICITUDES_LOTE} solicitudes"
+            }
+
+        respuestas = []
+        with self.lock:
+            # El almacenamiento difiere la persistencia hasta el final
+            self.almacen.iniciar_lote()
+            try:
+                for solicitud in solicitudes:
+                    if not isinstance(solicitud, dict):
+                        respuestas.append(
+                            {"resultado": "error", "mensaje": "Solicitud inválida"})
+                    elif str(solicitud.get('accion', '')).lower() == 'lote':
+                        respuestas.append(
+                            {"resultado": "error", "mensaje": "No se permiten lotes anidados"})
+                    else:
+                        respuestas.append(self.despachar(solicitud))
+            finally:
+                self.almacen.terminar_lote()
+                self.anotar_persistencia(self.almacen.marca_persistencia())
+
+        logging.info(f"Lote procesado: {len(respuestas)} solicitudes")
+        return {
+            "resultado": "ok",
+            "mensaje": f"Lote procesado: {len(respuestas)} solicitudes",
+            "respuestas": respuestas
+        }
+
+    def parsear_solicitud(self, mensaje, codificador=None):
+        """Convierte el mensaje recibido en un diccionario de solicitud"""
+        try:
+            if codificador is None:
+                solicitud = json.loads(mensaje)
+            else:
+                solicitud = codificador.decodificar(mensaje)
+        except ValueError:
+            return None, {"resultado": "error", "mensaje": "Mensaje JSON inválido"}
+        if not isinstance(solicitud, dict):
+            return None, {"resultado": "error", "mensaje": "Mensaje JSON inválido"}
+        return solicitud, None
+
     def procesar_solicitud(self, mensaje):
         """Procesa la solicitud del cliente y devuelve la respuesta"""
+        solicitud, error = self.parsear_solicitud(mensaje)
+        if error:
+            return error
+        return self.despachar(solicitud)
+
+    def negociar_formato(self, solicitud):
+        """Valida el formato pedido por el cliente para su conexión"""
+        formato = str(solicitud.get('formato', 'json')).lower()
+        if formato not in FORMATOS:
+            return {
+                "resultado": "error",
+                "mensaje": f"Formato no soportado. Debe ser uno de: {', '.join(FORMATOS)}",
+                "formatos": FORMATOS
+            }, None
+
+        comprimir = bool(solicitud.get('comprimir', False))
+        return {
+            "resultado": "ok",
+            "mensaje": f"Formato acordado: {formato}" + (" con compresión" if comprimir else ""),
+            "formato": formato,
+            "comprimir": comprimir,
+            "formatos": FORMATOS
+        }, Codificador(formato, comprimir)
+
+    def generar_respuestas(self, mensaje, conexion=None, parseada=None):
+        """Genera los mensajes de respuesta para una solicitud
+
+        Casi todas las acciones producen una sola respuesta; una consulta
+        con 'flujo' produce varias, que se envían a medida que se generan.
+        'conexion' es un diccionario con el codificador de la conexión,
+        que 'negociar' reemplaza, y la dirección del cliente. 'parseada'
+        es (solicitud, error) si quien llama ya parseó el mensaje. La
+        duración registrada en las métricas incluye el envío de las respuestas.
+        """
+        if conexion is None:
+            conexion = {'codificador': Codificador()}
+        codificador = conexion['codificador']  # El de la solicitud, antes de negociar
+        inicio = time.perf_counter()
+        etiqueta = 'invalida'  # Nombre de la acción en las métricas
+        exitosa = True
+        try:
+            solicitud, error = parseada or self.parsear_solicitud(
+                mensaje, conexion['codificador'])
+            if error:
+                exitosa = False
+                yield error
+                return
+
+            accion = str(solicitud.get('accion', '')).lower()
+            if accion == 'consultar' and solicitud.get('flujo'):
+                etiqueta = 'consultar_flujo'
+            elif accion in ACCIONES:
+                etiqueta = accion
+            else:
+                etiqueta = 'desconocida'  # Sin una serie por cada acción inventada
+            for respuesta in self.respuestas_de(solicitud, accion, conexion):
+                # Los bytes vienen de la caché, que solo guarda respuestas 'ok'
+                if not isinstance(respuesta, bytes):
+                    exitosa = exitosa and respuesta.get('resultado') == 'ok'
+                yield respuesta
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.metricas.registrar_solicitud(etiqueta, duracion, exitosa)
+            # El resumen del mensaje solo se arma si la línea se va a escribir
+            if (logging.getLogger().isEnabledFor(logging.INFO)
+                    and self.muestreo.registrar(etiqueta)):
+                logging.info(
+                    f"Solicitud de {conexion.get('addr')}: {codificador.resumir(mensaje)} "
+                    f"-> {'ok' if exitosa else 'error'} en {duracion * 1000:.2f} ms")
+
+    def respuestas_de(self, solicitud, accion, conexion):
+        """Genera las respuestas de una solicitud ya parseada"""
+        if accion == 'consultar' and solicitud.get('flujo'):
+            yield from self.consultar_en_flujo(solicitud.get('tamano_bloque'))
+        elif accion == 'negociar':
+            respuesta, codificador = self.negociar_formato(solicitud)
+            # La respuesta viaja en el formato anterior; el nuevo rige
+            # desde el siguiente mensaje
+            yield respuesta
+            if codificador is not None:
+                conexion['codificador'] = codificador
+                logging.info(f"Formato negociado: {respuesta['mensaje']}")
+        elif accion == 'suscribir':
+            respuesta, suscripcion = self.suscribir(solicitud, conexion.get('bucle'))
+            yield respuesta
+            if suscripcion is not None:
+                # El manejador de la conexión pasa a enviar los eventos
+                conexion['suscripcion'] = suscripcion
+        elif accion == 'importar':
+            yield self.importar(solicitud, conexion)
+        elif accion == 'exportar':
+            yield from self.exportar(solicitud.get('formato'), solicitud.get('tamano_bloque'))
+        elif accion in ('consultar', 'buscar') and self.cache.activa():
+            yield self.respuesta_con_cache(solicitud, accion, conexion['codificador'])
+        else:
+            yield self.despachar(solicitud)
+
+    def clave_cache(self, solicitud, accion):
+        """Clave de caché de una consulta o búsqueda y el código del que depende
+
+        Devuelve (None, None) si los parámetros no sirven de clave.
+        """
+        if accion == 'buscar':
+            codigo = solicitud.get('codigo')
+            if not isinstance(codigo, str) or not codigo:
+                return None, None
+            codigo = normalizar_codigo(codigo)
+            if self.reutilizar_puerto:
+                # Otros procesos escriben en el mismo almacenamiento sin
+                # invalidar esta caché: solo la versión revela sus cambios
+                return ('buscar', codigo, self.almacen.version_actual()), codigo
+            return ('buscar', codigo), codigo
+        limite, cursor = solicitud.get('limite'), solicitud.get('cursor')
+        if not all(valor is None or isinstance(valor, (str, int))
+                   for valor in (limite, cursor)):
+            return None, None
+        return ('consultar', limite, cursor, self.almacen.version_actual()), None
+
+    def respuesta_con_cache(self, solicitud, accion, codificador):
+        """Bytes de la respuesta desde la caché; si faltan se arma, codifica y guarda"""
+        clave, codigo = self.clave_cache(solicitud, accion)
+        if clave is None:
+            return self.despachar(solicitud)
+        clave = (codificador.formato, codificador.comprimir) + clave
+        datos = self.cache.obtener(clave)
+        if datos is not None:
+            return datos
+        generacion = self.cache.generacion  # Antes de leer el inventario
+        respuesta = self.despachar(solicitud)
+        if respuesta.get('resultado') != 'ok':
+            return respuesta
+        datos = codificador.codificar(respuesta)
+        self.cache.guardar(clave, datos, generacion, codigo)
+        return datos
+
+    def suscribir(self, solicitud, bucle=None):
+        """Crea una suscripción a los cambios; devuelve (respuesta, suscripción o None)"""
+        estado = solicitud.get('estado')
+        tipo = solicitud.get('tipo')
+        if estado is not None and str(estado).lower() not in ESTADOS_VALIDOS:
+            return {"resultado": "error", "mensaje": f"Estado inválido. Debe ser uno de: {', '.join(ESTADOS_VALIDOS)}"}, None
+        if tipo is not None and (not isinstance(tipo, str) or not tipo.strip()):
+            return {"resultado": "error", "mensaje": "Tipo inválido"}, None
+
+        suscripcion = self.eventos.suscribir(
+            str(estado) if estado else None, tipo, bucle=bucle)
+        logging.info(
+            f"Suscripción creada (estado={suscripcion.estado}, tipo={suscripcion.tipo})")
+        return {
+            "resultado": "ok",
+            "mensaje": "Suscripción activa: se enviarán los cambios del inventario",
+            "filtros": {"estado": suscripcion.estado, "tipo": suscripcion.tipo},
+            "latido_s": self.intervalo_latido
+        }, suscripcion
+
+    def publicar_evento(self, tipo_evento, equipo, estado_anterior=None):
+        """Publica un cambio hecho por este proceso a sus suscriptores"""
+        if not self.reutilizar_puerto:
+            # Con varios procesos lo publica publicar_cambios_compartidos,
+            # que ve también los cambios de los demás
+            self.eventos.publicar(tipo_evento, equipo, estado_anterior)
+
+    def publicar_cambios_compartidos(self):
+        """Hilo que publica los cambios de todos los procesos (con reutilizar_puerto)
+
+        Cada proceso solo ve sus propios cambios, pero la versión del
+        almacenamiento compartido los ordena todos: los eventos salen de
+        cambios_desde cada INTERVALO_SONDEO_EVENTOS. Varios cambios de un
+        equipo entre dos lecturas llegan como uno, con el estado anterior
+        al primero.
+        """
+        version = self.almacen.version_actual()
+        while not self._fin_sondeo.wait(INTERVALO_SONDEO_EVENTOS):
+            try:
+                if not self.eventos.total():
+                    version = self.almacen.version_actual()
+                    continue
+                mas = True
+                while mas:
+                    equipos, hasta, mas = self.almacen.cambios_desde(
+                        version, MAXIMO_LIMITE_CONSULTA)
+                    for equipo in equipos:
+                        if equipo.get('ultima_actualizacion'):
+                            anterior = self.almacen.estado_anterior(equipo['codigo'], version)
+                            self.eventos.publicar(
+                                'actualizado', equipo, anterior or equipo['estado'])
+                        else:
+                            self.eventos.publicar('registrado', equipo)
+                    version = hasta
+            except Exception as e:
+                logging.error(f"Error al leer los cambios de los demás procesos: {e}")
+
+    def mensajes_de_eventos(self, suscripcion, eventos):
+        """Mensajes a enviar en una vuelta de la suscripción"""
+        if suscripcion.desbordada:
+            eventos.append({
+                "evento": "desbordado",
+                "mensaje": "Demasiados eventos sin leer: vuelva a consultar y suscribirse"
+            })
+        elif not eventos and not suscripcion.cerrada:
+            eventos.append({"evento": "latido"})  # También detecta clientes caídos
+        return eventos
+
+    def enviar_eventos(self, conn, conexion):
+        """Envía los eventos de la suscripción de la conexión hasta que termine"""
+        suscripcion = conexion['suscripcion']
+        try:
+            while not suscripcion.cerrada:
+                eventos = suscripcion.esperar(self.intervalo_latido)
+                for mensaje in self.mensajes_de_eventos(suscripcion, eventos):
+                    datos = conexion['codificador'].codificar(mensaje)
+                    enviar_mensaje(conn, datos)
+                    self.metricas.sumar_bytes(enviados=len(datos))
+        except OSError as e:
+            logging.info(f"Suscriptor {conexion['addr']} desconectado: {e}")
+        finally:
+            self.eventos.cancelar(suscripcion)
+
+    async def enviar_eventos_async(self, writer, conexion):
+        """Como enviar_eventos(), dentro del bucle de eventos"""
+        suscripcion = conexion['suscripcion']
+        try:
+            while not suscripcion.cerrada:
+                eventos = await suscripcion.esperar_async(self.intervalo_latido)
+                for mensaje in self.mensajes_de_eventos(suscripcion, eventos):
+                    datos = conexion['codificador'].codificar(mensaje)
+                    writer.write(empaquetar_mensaje(datos))
+                    self.metricas.sumar_bytes(enviados=len(datos))
+                await writer.drain()
+        except OSError as e:
+            logging.info(f"Suscriptor {conexion['addr']} desconectado: {e}")
+        finally:
+            self.eventos.cancelar(suscripcion)
+
+    def obtener_estadisticas(self):
+        """Devuelve las métricas del servidor"""
+        estadisticas = self.metricas.resumen()
+        estadisticas['equipos'] = self.almacen.total()
+        estadisticas['proceso'] = os.getpid()  # Las métricas son de este proceso
+        estadisticas['suscripciones'] = self.eventos.total()
+        estadisticas['cargando'] = not self.almacen.esperar_carga(0)
+        estadisticas['cache']['respuestas'] = self.cache.total()
+        estadisticas['cache']['bytes'] = self.cache.ocupado
+        return {
+            "resultado": "ok",
+            "mensaje": "Estadísticas del servidor",
+            "estadisticas": estadisticas
+        }
+
+    def texto_metricas(self):
+        """Métricas en formato de texto de Prometheus"""
+        return self.metricas.texto_prometheus({
+            'equipos': self.almacen.total(),
+            'suscripciones': self.eventos.total(),
+            'cache_bytes': self.cache.ocupado
+        })
+
+    def despachar(self, solicitud):
+        """Ejecuta la acción indicada en una solicitud ya parseada"""
         try:
-            # Parsear el mensaje JSON
-            solicitud = json.loads(mensaje)
             accion = solicitud.get('accion', '').lower()
 
             # Procesar según la acción
@@ -175,7 +938,8 @@ class ServidorInventario:
                 return self.registrar_equipo(solicitud)
 
             elif accion == 'consultar':
-                return self.consultar_equipos()
+                return self.consultar_equipos(
+                    solicitud.get('limite'), solicitud.get('cursor'))
 
             elif accion == 'buscar':
                 codigo = solicitud.get('codigo', '')
@@ -190,11 +954,55 @@ class ServidorInventario:
                     return {"resultado": "error", "mensaje": "Código o estado no proporcionado"}
                 return self.actualizar_estado(codigo, estado)
 
+            elif accion == 'filtrar':
+                return self.filtrar_equipos(
+                    estado=solicitud.get('estado'),
+                    tipo=solicitud.get('tipo'),
+                    fecha_desde=solicitud.get('fecha_desde'),
+                    fecha_hasta=solicitud.get('fecha_hasta'),
+                    limite=solicitud.get('limite'),
+                    cursor=solicitud.get('cursor'))
+
+            elif accion == 'buscar_texto':
+                return self.buscar_texto(
+                    solicitud.get('texto'), solicitud.get('limite'))
+
+            elif accion == 'cambios_desde':
+                return self.cambios_desde(
+                    solicitud.get('version'), solicitud.get('limite'))
+
+            elif accion == 'historial':
+                return self.consultar_historial(
+                    codigo=solicitud.get('codigo'),
+                    fecha_desde=solicitud.get('fecha_desde'),
+                    fecha_hasta=solicitud.get('fecha_hasta'),
+                    limite=solicitud.get('limite'),
+                    cursor=solicitud.get('cursor'))
+
+            elif accion == 'utilizacion':
+                return self.consultar_utilizacion(
+                    codigo=solicitud.get('codigo'),
+                    fecha_desde=solicitud.get('fecha_desde'),
+                    fecha_hasta=solicitud.get('fecha_hasta'))
+
+            elif accion == 'lote':
+                return self.procesar_lote(solicitud.get('solicitudes'))
+
+            elif accion == 'negociar':
+                return {"resultado": "error", "mensaje": "La negociación debe enviarse como solicitud independiente"}
+
+            elif accion == 'estadisticas':
+                return self.obtener_estadisticas()
+
+            elif accion == 'suscribir':
+                return {"resultado": "error", "mensaje": "La suscripción debe enviarse como solicitud independiente"}
+
+            elif accion in ('importar', 'exportar'):
+                return {"resultado": "error", "mensaje": f"'{accion}' debe enviarse como solicitud independiente"}
+
             else:
                 return {"resultado": "error", "mensaje": f"Acción '{accion}' no reconocida"}
 
-        except json.JSONDecodeError:
-            return {"resultado": "error", "mensaje": "Mensaje JSON inválido"}
         except Exception as e:
             logging.error(f"Error al procesar solicitud: {e}")
             return {"resultado": "error", "mensaje": f"Error interno: {str(e)}"}
@@ -203,56 +1011,235 @@ class ServidorInventario:
         """Maneja la conexión de un cliente"""
         logging.info(f"Nueva conexión desde {addr}")
 
+        lector = LectorMensajes(conn)
+        # JSON hasta que se negocie
+        conexion = {'codificador': Codificador(), 'addr': addr}
+        self.metricas.conexion_abierta()
         try:
             while True:
-                # Recibir datos del cliente, hasta 4096 bytes
-                data = conn.recv(4096)
-                if not data:
+                # Recibir un mensaje completo del cliente
+                data = lector.leer()
+                if data is None:
                     break
+                self.metricas.sumar_bytes(recibidos=len(data))
 
-                mensaje = data.decode('utf-8')
-                logging.info(f"Solicitud de {addr}: {mensaje[:100]}...")
-
-                # Procesar solicitud
-                respuesta = self.procesar_solicitud(mensaje)
+                # Procesar solicitud y enviar cada respuesta apenas se genera
+                for respuesta in self.generar_respuestas(data, conexion):
+                    # Con durabilidad 'disco' no se confirma antes de escribir
+                    marca = self.tomar_marca_persistencia()
+                    if marca:
+                        self.almacen.esperar_persistencia(marca)
+                    datos = respuesta if isinstance(respuesta, bytes) else \
+                        conexion['codificador'].codificar(respuesta)
+                    enviar_mensaje(conn, datos)
+                    self.metricas.sumar_bytes(enviados=len(datos))
 
-                # Enviar respuesta
-                respuesta_json = json.dumps(respuesta, ensure_ascii=False)
-                conn.sendall(respuesta_json.encode('utf-8'))
-                logging.info(f"Respuesta enviada a {addr}")
+                if 'suscripcion' in conexion:
+                    # La conexión queda dedicada a la suscripción
+                    self.enviar_eventos(conn, conexion)
+                    break
 
         except Exception as e:
             logging.error(f"Error manejando cliente {addr}: {e}")
 
         finally:
+            self.metricas.conexion_cerrada()
+            if 'importacion' in conexion:
+                conexion['importacion'].cerrar()  # Importación sin 'fin': se descarta
             conn.close()
             logging.info(f"Conexión cerrada con {addr}")
 
+    async def manejar_cliente_async(self, reader, writer):
+        """Maneja la conexión de un cliente dentro del bucle de eventos"""
+        addr = writer.get_extra_info('peername')
+        logging.info(f"Nueva conexión desde {addr}")
+        self._conexiones_async[writer] = asyncio.current_task()
+        # JSON hasta que se negocie
+        conexion = {'codificador': Codificador(), 'addr': addr,
+                    'bucle': asyncio.get_running_loop()}
+        self.metricas.conexion_abierta()
+
+        try:
+            while True:
+                # Recibir un mensaje completo del cliente
+                data = await leer_mensaje_async(reader)
+                if data is None:
+                    break
+                self.metricas.sumar_bytes(recibidos=len(data))
+
+                # Procesar solicitud y enviar cada respuesta apenas se genera
+                solicitud, error = self.parsear_solicitud(data, conexion['codificador'])
+                respuestas = self.generar_respuestas(data, conexion, (solicitud, error))
+                if error is None and self.bloquearia_el_bucle(solicitud):
+                    # Las demás conexiones siguen atendidas mientras tanto
+                    respuestas = await asyncio.to_thread(
+                        self.respuestas_en_hilo, respuestas)
+                for respuesta in respuestas:
+                    # Con durabilidad 'disco' no se confirma antes de escribir;
+                    # la espera no bloquea el bucle de eventos
+                    marca = self.tomar_marca_persistencia()
+                    if marca:
+                        await asyncio.to_thread(
+                            self.almacen.esperar_persistencia, marca)
+                    datos = respuesta if isinstance(respuesta, bytes) else \
+                        conexion['codificador'].codificar(respuesta)
+                    writer.write(empaquetar_mensaje(datos))
+                    self.metricas.sumar_bytes(enviados=len(datos))
+                    await writer.drain()
+
+                if 'suscripcion' in conexion:
+                    # La conexión queda dedicada a la suscripción
+                    await self.enviar_eventos_async(writer, conexion)
+                    break
+
+        except Exception as e:
+            logging.error(f"Error manejando cliente {addr}: {e}")
+
+        finally:
+            self.metricas.conexion_cerrada()
+            if 'importacion' in conexion:
+                conexion['importacion'].cerrar()  # Importación sin 'fin': se descarta
+            del self._conexiones_async[writer]
+            writer.close()
+            logging.info(f"Conexión cerrada con {addr}")
+
+    def bloquearia_el_bucle(self, solicitud):
+        """Indica si la solicitud debe atenderse fuera del bucle de eventos"""
+        accion = str(solicitud.get('accion', '')).lower()
+        if accion in ACCIONES_ESCRITURA:
+            return True
+        return accion in ACCIONES_CON_INDICES and not self.almacen.esperar_carga(0)
+
+    def respuestas_en_hilo(self, respuestas):
+        """Genera las respuestas y espera su escritura a disco, desde un hilo aparte"""
+        respuestas = list(respuestas)
+        marca = self.tomar_marca_persistencia()  # La anotó este hilo
+        if marca:
+            self.almacen.esperar_persistencia(marca)
+        return respuestas
+
+    async def servir_async(self):
+        """Acepta conexiones en el bucle de eventos hasta que se detenga"""
+        self._bucle = asyncio.get_running_loop()
+        self._evento_detener = asyncio.Event()
+
+        servidor = await asyncio.start_server(
+            self.manejar_cliente_async, self.host, self.puerto,
+            backlog=self.backlog, reuse_address=True,
+            reuse_port=self.reutilizar_puerto or None)
+        self.puerto = servidor.sockets[0].getsockname()[1]
+
+        async with servidor:
+            self.listo.set()
+            self.mostrar_banner()
+            await self._evento_detener.wait()
+
+            # Cerrar las conexiones abiertas y esperar a que terminen
+            tareas = list(self._conexiones_async.values())
+            for writer in list(self._conexiones_async):
+                writer.close()
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+    def mostrar_banner(self):
+        """Muestra la configuración del servidor en consola"""
+        logging.info(f"Servidor escuchando en {self.host}:{self.puerto}")
+        print(f"\n{'='*60}")
+        print(f"SERVIDOR DE INVENTARIO DE EQUIPOS")
+        print(f"{'='*60}")
+        print(f"Escuchando en: {self.host}:{self.puerto}")
+        print(f"Modo: {self.modo_servidor} (backlog {self.backlog})")
+        print(f"Almacenamiento: {self.almacen.descripcion()}")
+        print(f"Equipos en inventario: {self.almacen.total()}")
+        if self.servidor_metricas is not None:
+            print(f"Métricas: http://{self.host}:{self.puerto_metricas}/metrics")
+        print(f"{'='*60}\n")
+
+    def detener(self):
+        """Detiene el servidor cerrando el socket de escucha"""
+        self.listo.clear()
+        self._fin_sondeo.set()
+        self.eventos.cerrar()  # Termina las conexiones suscritas
+        if self._bucle is not None and self._evento_detener is not None:
+            try:
+                self._bucle.call_soon_threadsafe(self._evento_detener.set)
+            except RuntimeError:
+                pass  # El bucle ya terminó
+        if self.servidor_socket is not None:
+            try:
+                # En Linux close() no despierta un accept() bloqueado
+                self.servidor_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.servidor_socket.close()
+
     def iniciar(self):
-        """Inicia el servidor"""
+        """Inicia el servidor en el modo configurado"""
+        if self.puerto_metricas is not None:
+            self.servidor_metricas = iniciar_servidor_metricas(
+                self.host, self.puerto_metricas, self.texto_metricas)
+            self.puerto_metricas = self.servidor_metricas.server_address[1]
+        if self.reutilizar_puerto:
+            self._fin_sondeo.clear()
+            threading.Thread(target=self.publicar_cambios_compartidos, daemon=True).start()
+        try:
+            if self.modo_servidor == 'asyncio':
+                self.iniciar_asyncio()
+            else:
+                self.iniciar_hilos()
+        finally:
+            if self.servidor_metricas is not None:
+                self.servidor_metricas.shutdown()
+                self.servidor_metricas.server_close()
+                self.servidor_metricas = None
+
+    def iniciar_asyncio(self):
+        """Inicia el servidor con un único bucle de eventos asyncio"""
+        ampliar_limite_descriptores()
+        try:
+            asyncio.run(self.servir_async())
+
+        except KeyboardInterrupt:
+            logging.info("Servidor detenido por el usuario")
+            print("\n\nServidor detenido.")
+
+        except Exception as e:
+            logging.error(f"Error en el servidor: {e}")
+            print(f"\nError: {e}")
+
+        finally:
+            self._bucle = None
+            self.cerrar()
+
+    def iniciar_hilos(self):
+        """Inicia el servidor con un hilo por cada conexión"""
+        servidor_socket = None
         try:
             # Crear socket
             servidor_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             servidor_socket.setsockopt(
                 socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reutilizar_puerto:
+                servidor_socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.servidor_socket = servidor_socket
 
-            # Enlazar al puerto
+            # Enlazar al puerto (con puerto 0 el sistema asigna uno libre)
             servidor_socket.bind((self.host, self.puerto))
+            self.puerto = servidor_socket.getsockname()[1]
 
             # Escuchar conexiones
-            servidor_socket.listen(5)
-            logging.info(f"Servidor escuchando en {self.host}:{self.puerto}")
-            print(f"\n{'='*60}")
-            print(f"SERVIDOR DE INVENTARIO DE EQUIPOS")
-            print(f"{'='*60}")
-            print(f"Escuchando en: {self.host}:{self.puerto}")
-            print(f"Archivo de datos: {self.archivo_datos}")
-            print(f"Equipos en inventario: {len(self.inventario)}")
-            print(f"{'='*60}\n")
+            servidor_socket.listen(self.backlog)
+            self.listo.set()
+            self.mostrar_banner()
 
             while True:
                 # Aceptar conexión
-                conn, addr = servidor_socket.accept()
+                try:
+                    conn, addr = servidor_socket.accept()
+                except OSError:
+                    if not self.listo.is_set():
+                        break  # Socket cerrado por detener()
+                    raise
 
                 # Crear hilo para manejar cliente
                 cliente_thread = threading.Thread(
@@ -271,14 +1258,247 @@ class ServidorInventario:
             print(f"\nError: {e}")
 
         finally:
-            servidor_socket.close()
+            if servidor_socket is not None:
+                servidor_socket.close()
+            self.cerrar()
+
+
+def ejecutar_trabajador(indice, opciones, cola_log, nivel_log, avisos):
+    """Proceso hijo de ServidorMultiproceso: un servidor en el puerto compartido"""
+    if cola_log is not None:
+        conectar_registro(cola_log, nivel_log)
+    sys.stdout = open(os.devnull, 'w')  # El banner lo muestra el proceso principal
+    servidor = ServidorInventario(reutilizar_puerto=True, **opciones)
+    # SIGTERM detiene el servidor de forma ordenada, como Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: servidor.detener())
+    threading.Thread(
+        target=lambda: avisos.put((indice, os.getpid() if servidor.listo.wait(30) else None)),
+        daemon=True).start()
+    servidor.iniciar()
+
+
+class ServidorMultiproceso:
+    """Varios procesos ServidorInventario aceptando en el mismo puerto
+
+    Cada proceso tiene su propio GIL, así que la decodificación y la
+    codificación de mensajes escalan con los núcleos. Los procesos
+    comparten el inventario a través de una base SQLite (en modo WAL los
+    lectores no esperan y las escrituras se serializan con transacciones).
+    Si un proceso termina de forma inesperada se inicia otro en su lugar.
+    """
+
+    def __init__(self, procesos=2, host='0.0.0.0', puerto=5555,
+                 almacenamiento='sqlite', archivo_datos=None, puerto_metricas=None,
+                 cola_log=None, nivel_log='INFO', **opciones):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError("El modo multiproceso requiere SO_REUSEPORT (Linux, BSD o macOS)")
+        if almacenamiento != 'sqlite':
+            raise ValueError(
+                "El modo multiproceso requiere almacenamiento sqlite: los demás "
+                "mantienen el inventario en la memoria de cada proceso")
+        if procesos < 1:
+            raise ValueError("Se necesita al menos un proceso")
+
+        self.procesos = procesos
+        self.host = host
+        self.puerto = puerto
+        self.archivo_datos = archivo_datos or 'inventario.db'
+        # Cada proceso publica sus propias métricas en puerto_metricas + índice
+        self.puerto_metricas = puerto_metricas
+        self.cola_log = cola_log  # Cola del escritor del log del proceso principal
+        self.nivel_log = nivel_log
+        self.opciones = opciones
+        # 'spawn': los hijos no heredan hilos ni locks del proceso principal
+        self._contexto = multiprocessing.get_context('spawn')
+        self._avisos = self._contexto.Queue()
+        self.trabajadores = {}  # índice -> proceso
+        self.pids = {}  # índice -> pid, una vez que el proceso escucha
+        self.listo = threading.Event()
+        self._deteniendo = threading.Event()
+
+    def opciones_trabajador(self, indice):
+        """Argumentos de ServidorInventario para el proceso 'indice'"""
+        puerto_metricas = self.puerto_metricas
+        if puerto_metricas:
+            puerto_metricas += indice
+        return dict(self.opciones, host=self.host, puerto=self.puerto,
+                    almacenamiento='sqlite', archivo_datos=self.archivo_datos,
+                    puerto_metricas=puerto_metricas)
+
+    def iniciar_trabajador(self, indice):
+        """Inicia (o reinicia) el proceso 'indice'"""
+        proceso = self._contexto.Process(
+            target=ejecutar_trabajador,
+            args=(indice, self.opciones_trabajador(indice), self.cola_log,
+                  self.nivel_log, self._avisos),
+            daemon=True)
+        proceso.start()
+        self.trabajadores[indice] = proceso
+
+    def recibir_avisos(self, cantidad, timeout=60):
+        """Espera a que 'cantidad' procesos avisen que están escuchando"""
+        for _ in range(cantidad):
+            indice, pid = self._avisos.get(timeout=timeout)
+            if pid is None:
+                raise RuntimeError(f"El proceso {indice} no pudo iniciar")
+            self.pids[indice] = pid
+
+    def mostrar_banner(self):
+        """Muestra la configuración del grupo de procesos en consola"""
+        logging.info(
+            f"Servidor multiproceso escuchando en {self.host}:{self.puerto} "
+            f"({self.procesos} procesos)")
+        print(f"\n{'='*60}")
+        print(f"SERVIDOR DE INVENTARIO DE EQUIPOS")
+        print(f"{'='*60}")
+        print(f"Escuchando en: {self.host}:{self.puerto}")
+        print(f"Procesos: {self.procesos} (SO_REUSEPORT), PIDs {sorted(self.pids.values())}")
+        print(f"Almacenamiento: SQLite (WAL): {self.archivo_datos}")
+        print(f"{'='*60}\n")
+
+    def iniciar(self):
+        """Inicia los procesos y los supervisa hasta que se detenga"""
+        # Crear las tablas una sola vez, antes de que los procesos compitan
+        almacen = crear_almacenamiento('sqlite', self.archivo_datos)
+        almacen.cargar()
+        almacen.cerrar()
+
+        # Reservar el puerto (el sistema elige uno si es 0) para que todos
+        # los procesos enlacen el mismo
+        reserva = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            reserva.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            reserva.bind((self.host, self.puerto))
+            self.puerto = reserva.getsockname()[1]
+
+            for indice in range(self.procesos):
+                self.iniciar_trabajador(indice)
+            self.recibir_avisos(self.procesos)
+        except BaseException:
+            self.detener()
+            self.esperar_trabajadores()
+            raise
+        finally:
+            reserva.close()  # Sin listen() no recibe conexiones
+
+        self.listo.set()
+        self.mostrar_banner()
+        if threading.current_thread() is threading.main_thread():
+            # Sin esto un SIGTERM al proceso principal dejaría huérfanos a los hijos
+            signal.signal(signal.SIGTERM, lambda *_: self.detener())
+        try:
+            self.supervisar()
+        except KeyboardInterrupt:
+            logging.info("Servidor detenido por el usuario")
+            print("\n\nServidor detenido.")
+        finally:
+            self.detener()
+            self.esperar_trabajadores()
+
+    def supervisar(self):
+        """Reinicia los procesos que terminan hasta que se llame a detener()"""
+        while not self._deteniendo.is_set():
+            multiprocessing.connection.wait(
+                [p.sentinel for p in self.trabajadores.values()], timeout=0.5)
+            for indice, proceso in list(self.trabajadores.items()):
+                if proceso.is_alive() or self._deteniendo.is_set():
+                    continue
+                logging.error(
+                    f"El proceso {indice} (PID {proceso.pid}) terminó con código "
+                    f"{proceso.exitcode}; se reinicia")
+                self.pids.pop(indice, None)
+                self.iniciar_trabajador(indice)
+                try:
+                    self.recibir_avisos(1)
+                except Exception as e:
+                    logging.error(f"Error al reiniciar el proceso {indice}: {e}")
+
+    def detener(self):
+        """Pide a todos los procesos que terminen"""
+        self.listo.clear()
+        if self._deteniendo.is_set():
+            return  # Un segundo SIGTERM podría llegar con el hijo ya finalizando
+        self._deteniendo.set()
+        for proceso in self.trabajadores.values():
+            if proceso.is_alive():
+                proceso.terminate()  # SIGTERM: cierre ordenado
+
+    def esperar_trabajadores(self, timeout=10):
+        """Espera a que terminen los procesos; fuerza los que no lo hagan"""
+        for proceso in self.trabajadores.values():
+            proceso.join(timeout)
+            if proceso.is_alive():
+                proceso.kill()
+                proceso.join()
 
 
 if __name__ == "__main__":
     # Configuración del servidor
-    HOST = '0.0.0.0'  # Escuchar en todas las interfaces
-    PUERTO = 5555      # Puerto del servidor
+    parser = argparse.ArgumentParser(
+        description="Servidor de inventario de equipos de laboratorio")
+    parser.add_argument('--host', default='0.0.0.0',
+                        help="Interfaz de escucha (por defecto todas)")
+    parser.add_argument('--puerto', type=int, default=5555,
+                        help="Puerto del servidor")
+    parser.add_argument('--modo', choices=MODOS_SERVIDOR, default='hilos',
+                        help="Motor de conexiones: un hilo por cliente o asyncio")
+    parser.add_argument('--backlog', type=int, default=128,
+                        help="Conexiones pendientes que admite el socket")
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="Procesos que aceptan en el mismo puerto (requiere --almacenamiento sqlite)")
+    parser.add_argument('--almacenamiento', choices=ALMACENAMIENTOS,
+                        default='json', help="Dónde se guardan los equipos")
+    parser.add_argument('--archivo',
+                        help="Archivo de datos (inventario.json o inventario.db por defecto)")
+    parser.add_argument('--persistencia', choices=MODOS_PERSISTENCIA,
+                        default='completo',
+                        help="Modo de persistencia del almacenamiento JSON")
+    parser.add_argument('--durabilidad', choices=MODOS_DURABILIDAD,
+                        default='sincrona',
+                        help="Cuándo se confirma un cambio del almacenamiento JSON: tras escribirlo bajo el lock, tras la escritura agrupada o en memoria")
+    parser.add_argument('--ventana-ms', type=float, default=0,
+                        help="Milisegundos que la escritura agrupada espera por más cambios")
+    parser.add_argument('--agrupar-cada', type=int, default=100,
+                        help="Cambios que disparan la escritura agrupada sin esperar la ventana")
+    parser.add_argument('--carga-diferida', action='store_true',
+                        help="Atender apenas inicia desde el volcado del inventario JSON mientras se carga en segundo plano")
+    parser.add_argument('--cache-mb', type=float, default=TAMANO_CACHE_RESPUESTAS / 2**20,
+                        help="MB de respuestas de consultar y buscar ya codificadas que se guardan (0 la desactiva)")
+    parser.add_argument('--puerto-metricas', type=int,
+                        help="Puerto HTTP para las métricas de Prometheus (desactivado por defecto)")
+    parser.add_argument('--nivel-log', choices=NIVELES_LOG, default='INFO',
+                        help="Nivel mínimo de los mensajes del log")
+    parser.add_argument('--archivo-log', default='servidor.log',
+                        help="Archivo del log; rota al llegar a 10 MB")
+    parser.add_argument('--muestreo-log', type=parsear_muestreo,
+                        help="Registrar una de cada N solicitudes por acción, p. ej. buscar=100,consultar=0")
+    args = parser.parse_args()
+    if args.procesos > 1 and args.almacenamiento != 'sqlite':
+        parser.error("--procesos mayor que 1 requiere --almacenamiento sqlite")
 
-    # Crear e iniciar servidor
-    servidor = ServidorInventario(host=HOST, puerto=PUERTO)
-    servidor.iniciar()
+    # El log se escribe desde un hilo aparte; con varios procesos todos
+    # envían sus registros a la cola de este
+    cola_log = None
+    if args.procesos > 1:
+        cola_log = multiprocessing.get_context('spawn').Queue(CAPACIDAD_COLA_LOG)
+    escritor_log = configurar_registro(args.archivo_log, args.nivel_log, cola=cola_log)
+    try:
+        opciones = dict(
+            host=args.host, puerto=args.puerto, archivo_datos=args.archivo,
+            almacenamiento=args.almacenamiento,
+            modo_persistencia=args.persistencia,
+            modo_servidor=args.modo, backlog=args.backlog,
+            puerto_metricas=args.puerto_metricas,
+            muestreo_log=args.muestreo_log,
+            durabilidad=args.durabilidad, ventana_ms=args.ventana_ms,
+            agrupar_cada=args.agrupar_cada, carga_diferida=args.carga_diferida,
+            cache_respuestas=int(args.cache_mb * 2**20))
+        # Crear e iniciar servidor
+        if args.procesos > 1:
+            servidor = ServidorMultiproceso(
+                args.procesos, cola_log=cola_log, nivel_log=args.nivel_log, **opciones)
+        else:
+            servidor = ServidorInventario(**opciones)
+        servidor.iniciar()
+    finally:
+        detener_registro(escritor_log)
@@ -0,0 +1,145 @@
+"""
+Envío y descarga de archivos del inventario desde el cliente
+
+Manda un archivo al servidor en bloques de líneas completas con la
+acción 'importar' y escribe en un archivo los bloques de 'exportar'. La
+validación de las filas la hace el servidor (importacion.py).
+
+Se usa desde la línea de comandos:
+
+    python transferencia.py importar datos_ejemplo.txt
+    python transferencia.py exportar inventario.csv
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from cliente import ConexionInventario, ErrorComunicacion
+from importacion import FILAS_POR_BLOQUE, FORMATOS_IMPORTACION
+
+# 'json': objetos JSON seguidos, con comentarios '#', como datos_ejemplo.txt;
+# se convierten a 'jsonl' antes de enviarlos
+FORMATOS_ARCHIVO = FORMATOS_IMPORTACION + ['json']
+MAXIMO_OBJETO_JSON = 1024 * 1024  # Caracteres de un objeto en formato 'json'
+
+
+def formato_de_archivo(archivo):
+    """Formato según la extensión: .csv, .jsonl/.ndjson o 'json' para lo demás"""
+    extension = os.path.splitext(archivo)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    return 'json'
+
+
+def leer_objetos_json(lineas):
+    """Genera los objetos de un texto con objetos JSON seguidos
+
+    Es el formato de datos_ejemplo.txt: objetos de varias líneas separados
+    por líneas en blanco, con comentarios que empiezan con '#'.
+    """
+    decodificador = json.JSONDecoder()
+    pendiente = ''
+    for linea in lineas:
+        if not pendiente.strip() and linea.lstrip().startswith('#'):
+            continue
+        pendiente += linea
+        while pendiente.strip():
+            try:
+                objeto, fin = decodificador.raw_decode(pendiente.lstrip())
+            except ValueError:
+                if len(pendiente) > MAXIMO_OBJETO_JSON:
+                    raise ValueError("Objeto JSON inválido o demasiado grande")
+                break  # Falta el resto del objeto
+            yield objeto
+            pendiente = pendiente.lstrip()[fin:]
+    if pendiente.strip():
+        raise ValueError("El archivo termina con un objeto JSON incompleto")
+
+
+def bloques_de_archivo(archivo, formato, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Genera los bloques de texto a enviar: (formato de envío, texto)"""
+    # Solo '\n' corta líneas: un '\r' suelto puede estar dentro de un campo CSV
+    with open(archivo, encoding='utf-8', newline='\n') as entrada:
+        if formato == 'json':
+            lineas = (json.dumps(objeto, ensure_ascii=False) + '\n'
+                      for objeto in leer_objetos_json(entrada))
+            formato = 'jsonl'
+        else:
+            lineas = entrada
+        bloque = []
+        for linea in lineas:
+            bloque.append(linea if linea.endswith('\n') else linea + '\n')
+            if len(bloque) >= filas_por_bloque:
+                yield formato, ''.join(bloque)
+                bloque = []
+        yield formato, ''.join(bloque)
+
+
+def importar_archivo(conexion, archivo, formato=None, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Envía un archivo con 'importar' y devuelve la respuesta final"""
+    formato = formato or formato_de_archivo(archivo)
+    bloques = bloques_de_archivo(archivo, formato, filas_por_bloque)
+    formato_envio, texto = next(bloques)
+    for siguiente in bloques:
+        respuesta = conexion.solicitar({'accion': 'importar', 'formato': formato_envio,
+                                        'datos': texto, 'fin': False})
+        if respuesta['resultado'] != 'ok':
+            return respuesta
+        formato_envio, texto = siguiente
+    return conexion.solicitar({'accion': 'importar', 'formato': formato_envio,
+                               'datos': texto, 'fin': True})
+
+
+def exportar_archivo(conexion, archivo, formato=None):
+    """Escribe el inventario en un archivo con 'exportar'; devuelve la última respuesta"""
+    formato = formato or formato_de_archivo(archivo)
+    if formato not in FORMATOS_IMPORTACION:
+        formato = 'jsonl'
+    conexion.enviar({'accion': 'exportar', 'formato': formato})
+    with open(archivo, 'w', encoding='utf-8', newline='') as salida:
+        while True:
+            respuesta = conexion.recibir()
+            if respuesta['resultado'] != 'ok':
+                return respuesta
+            salida.write(respuesta['datos'])
+            if respuesta.get('fin', True):
+                return respuesta
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Importación y exportación masiva del inventario")
+    parser.add_argument('operacion', choices=['importar', 'exportar'])
+    parser.add_argument('archivo', help="Archivo a importar o a crear")
+    parser.add_argument('--formato', choices=FORMATOS_ARCHIVO,
+                        help="Formato del archivo (por defecto según la extensión)")
+    parser.add_argument('--host', default='localhost', help="Servidor")
+    parser.add_argument('--puerto', type=int, default=5555, help="Puerto del servidor")
+    args = parser.parse_args()
+
+    conexion = ConexionInventario(args.host, args.puerto, timeout=None)
+    try:
+        if args.operacion == 'importar':
+            respuesta = importar_archivo(conexion, args.archivo, args.formato)
+        else:
+            respuesta = exportar_archivo(conexion, args.archivo, args.formato)
+    except (ErrorComunicacion, OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        conexion.cerrar()
+
+    print(respuesta['mensaje'])
+    for error in respuesta.get('detalle_errores', []):
+        print(f"  Fila {error['fila']}: {error['mensaje']}")
+    if respuesta.get('errores', 0) > len(respuesta.get('detalle_errores', [])):
+        print(f"  ... {respuesta['errores'] - len(respuesta['detalle_errores'])} errores más")
+    return 0 if respuesta['resultado'] == 'ok' else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())